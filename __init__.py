@@ -22,7 +22,11 @@ class NbUdmPluginConfig(PluginConfig):
         'auto_create_device_types': True,
         'tag_discovered_objects': True,
         'orphan_grace_scans': 3,
+        'fleet_max_concurrency': 8,
+        'scheduled_scans': False,
+        'share_session_cookies': False,
         'default_site_slug': '',
+        'oui_database': '',
     }
 
     queues = ['scanning']
@@ -34,25 +38,29 @@ class NbUdmPluginConfig(PluginConfig):
             warnings.filterwarnings('ignore', message='.*database during app initialization.*')
             self._cleanup_stale_jobs()
             self._schedule_reaper()
+            self._schedule_dispatcher()
 
     @staticmethod
     def _cleanup_stale_jobs():
-        """Mark 'running' scan jobs older than 5 minutes as failed on startup."""
+        """Mark 'running' scan jobs older than 5 minutes as failed on startup, discarding their results."""
         from django.db import OperationalError, ProgrammingError
         try:
             from datetime import timedelta
             from .models import ScanJob
+            from .reconciliation import discard_results
             from django.utils import timezone
             cutoff = timezone.now() - timedelta(minutes=5)
-            stale = ScanJob.objects.filter(
+            stale_ids = list(ScanJob.objects.filter(
                 status='running',
                 started_at__lt=cutoff,
-            ).update(
-                status='failed',
-                completed_at=timezone.now(),
-            )
-            if stale:
-                logger.warning('Marked %d stale scan job(s) as failed on startup', stale)
+            ).values_list('pk', flat=True))
+            if stale_ids:
+                ScanJob.objects.filter(pk__in=stale_ids).update(
+                    status='failed',
+                    completed_at=timezone.now(),
+                )
+                discard_results(stale_ids)
+                logger.warning('Marked %d stale scan job(s) as failed on startup', len(stale_ids))
         except (OperationalError, ProgrammingError):
             pass  # Table doesn't exist yet (fresh install before migrations)
 
@@ -66,5 +74,18 @@ class NbUdmPluginConfig(PluginConfig):
         except (OperationalError, ProgrammingError):
             pass  # Table doesn't exist yet
 
+    @staticmethod
+    def _schedule_dispatcher():
+        """Schedule the scan dispatcher to check per-type scan intervals every minute, if enabled."""
+        from django.db import OperationalError, ProgrammingError
+        from netbox.plugins import get_plugin_config
+        if not get_plugin_config('nb_udm_plugin', 'scheduled_scans'):
+            return
+        try:
+            from .jobs import ScheduledScanDispatcher
+            ScheduledScanDispatcher.enqueue_once(interval=1)
+        except (OperationalError, ProgrammingError):
+            pass  # Table doesn't exist yet
+
 
 config = NbUdmPluginConfig
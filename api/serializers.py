@@ -15,8 +15,10 @@ class DiscoverySourceSerializer(NetBoxModelSerializer):
         model = DiscoverySource
         fields = (
             'id', 'url', 'display', 'name', 'description', 'status',
-            'config', 'token', 'site', 'scan_interval', 'last_scan',
-            'last_scan_success', 'sync_devices', 'sync_clients',
+            'config', 'token', 'site', 'scan_interval', 'device_scan_interval',
+            'vlan_scan_interval', 'client_scan_interval', 'last_scan',
+            'last_scan_success', 'last_device_scan', 'last_vlan_scan',
+            'last_client_scan', 'sync_devices', 'sync_clients',
             'sync_vlans', 'tags', 'created', 'last_updated',
         )
         brief_fields = ('id', 'url', 'display', 'name', 'status')
@@ -31,9 +33,11 @@ class ScanJobSerializer(NetBoxModelSerializer):
         model = ScanJob
         fields = (
             'id', 'url', 'display', 'source', 'status',
-            'started_at', 'completed_at', 'dry_run',
+            'started_at', 'completed_at', 'dry_run', 'scan_kinds',
             'discovered_count', 'created_count', 'updated_count',
-            'error_count', 'log', 'tags', 'created', 'last_updated',
+            'error_count', 'retry_count', 'breaker_trip_count',
+            'rate_limit', 'concurrency_limit', 'shard_count', 'shards_done',
+            'log', 'tags', 'created', 'last_updated',
         )
         brief_fields = ('id', 'url', 'display', 'source', 'status')
 
@@ -46,7 +50,7 @@ class DiscoveryResultSerializer(NetBoxModelSerializer):
     class Meta:
         model = DiscoveryResult
         fields = (
-            'id', 'url', 'display', 'scan_job', 'source',
+            'id', 'url', 'display', 'scan_job', 'previous_scan_job', 'source',
             'discovered_type', 'discovered_data', 'proposed_data',
             'diff', 'status', 'action', 'identity_key',
             'reviewed_by', 'reviewed_at',
@@ -59,12 +63,25 @@ class DiscoveryMappingSerializer(NetBoxModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name='plugins-api:nb_udm_plugin-api:discoverymapping-detail',
     )
+    netbox_object = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = DiscoveryMapping
         fields = (
-            'id', 'url', 'display', 'source', 'identity_key',
-            'first_seen', 'last_seen', 'is_orphan',
+            'id', 'url', 'display', 'source', 'identity_key', 'netbox_object',
+            'first_seen', 'last_seen', 'last_seen_scan', 'miss_count', 'is_orphan',
+            'data_fingerprint', 'netbox_fingerprint',
             'tags', 'created', 'last_updated',
         )
         brief_fields = ('id', 'url', 'display', 'identity_key', 'is_orphan')
+
+    def get_netbox_object(self, obj):
+        """The mapped NetBox object as {id, object_type, display}, or None if it was deleted."""
+        target = obj.netbox_object
+        if target is None:
+            return None
+        return {
+            'id': target.pk,
+            'object_type': f'{target._meta.app_label}.{target._meta.model_name}',
+            'display': str(target),
+        }
@@ -27,19 +27,10 @@ class DiscoverySourceViewSet(NetBoxModelViewSet):
     @action(detail=True, methods=['post'])
     def test(self, request, pk=None):
         source = self.get_object()
-        from ..unifi_client import UnifiClient
+        from ..client_pool import acquire_client
         try:
-            config = source.config
-            client = UnifiClient(
-                base_url=f"https://{config.get('host', '')}:{config.get('port', 443)}",
-                api_mode=config.get('api_mode', 'token'),
-                site=config.get('site', 'default'),
-                verify_ssl=config.get('verify_ssl', False),
-                token=source.token,
-            )
-            client.connect()
-            site_count = len(client.sites)
-            client.disconnect()
+            with acquire_client(source) as client:
+                site_count = len(client.sites)
             return Response({'success': True, 'message': f'Connected. Found {site_count} site(s).'})
         except Exception as e:
             return Response({'success': False, 'message': str(e)})
@@ -51,6 +42,12 @@ class DiscoverySourceViewSet(NetBoxModelViewSet):
         DiscoveryScanJob.enqueue(instance=source, user=request.user)
         return Response({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
 
+    @action(detail=False, methods=['post'], url_path='scan-all')
+    def scan_all(self, request):
+        from ..jobs import FleetScanJob
+        job = FleetScanJob.enqueue(user=request.user)
+        return Response({'status': 'queued', 'job': job.pk}, status=status.HTTP_202_ACCEPTED)
+
 
 class ScanJobViewSet(NetBoxModelViewSet):
     queryset = ScanJob.objects.all()
@@ -66,14 +63,11 @@ class DiscoveryResultViewSet(NetBoxModelViewSet):
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         result = self.get_object()
-        from ..reconciliation import apply_result
-        from django.utils import timezone
-        obj = apply_result(result)
-        result.status = 'approved'
-        result.reviewed_by = request.user
-        result.reviewed_at = timezone.now()
-        result.save()
-        return Response({'status': 'approved', 'object': str(obj)})
+        from ..reconciliation import apply_results
+        applied, errors = apply_results([result], user=request.user)
+        if result.pk in errors:
+            return Response({'status': 'failed', 'error': errors[result.pk]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'approved', 'object': str(applied[result.pk])})
 
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
@@ -87,6 +81,6 @@ class DiscoveryResultViewSet(NetBoxModelViewSet):
 
 
 class DiscoveryMappingViewSet(NetBoxModelViewSet):
-    queryset = DiscoveryMapping.objects.all()
+    queryset = DiscoveryMapping.objects.with_targets()
     serializer_class = DiscoveryMappingSerializer
     filterset_class = DiscoveryMappingFilterSet
@@ -0,0 +1,267 @@
+"""
+asyncio UniFi API client for high fan-out scanning.
+
+AsyncUnifiClient has the same surface as UnifiClient (connect, get_devices,
+get_clients, get_networks and the iter_* variants), but every method is a
+coroutine on an httpx.AsyncClient. A single event loop can then keep many
+site and page requests in flight without a thread per request.
+
+Requires the optional ``httpx`` dependency (``pip install nb-udm-plugin[async]``).
+Select it per source with ``"client_backend": "async"`` in the config.
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+
+from . import jsonstream
+from .throttle import request_class
+from .transport import RETRY_STATUSES, RetryPolicy, UnifiAPIError
+from .unifi_client import BaseUnifiClient
+
+logger = logging.getLogger('nb_udm_plugin.async_client')
+
+
+class AsyncUnifiTransport(RetryPolicy):
+    """Send requests on an httpx.AsyncClient with timeouts, retries and circuit breaking."""
+
+    def __init__(self, host, verify_ssl=False, **options):
+        super().__init__(host, **options)
+        self.client = httpx.AsyncClient(
+            verify=verify_ssl,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+        )
+
+    async def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying 429/5xx responses and network errors.
+
+        Returns the final response (which may still carry an error status)
+        or raises UnifiAPIError when the host is unreachable.
+        """
+        attempt = 0
+        key = request_class(method, url)
+        while True:
+            trial = self.breaker.before_request()
+            try:
+                while (wait := self.throttle.try_acquire()) > 0:
+                    await asyncio.sleep(wait)
+                started = time.monotonic()
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    self.throttle.release(time.monotonic() - started)
+                    self._record_failure()
+                    if attempt >= self.max_retries:
+                        raise UnifiAPIError(f'{method} {url} failed: {e}') from e
+                    delay = self._backoff(attempt)
+                    logger.warning(f'{method} {url} failed ({e}), retrying in {delay:.1f}s')
+                except BaseException:
+                    self.throttle.cancel()
+                    raise
+                else:
+                    self.throttle.release(time.monotonic() - started, response.status_code, key)
+                    if response.status_code not in RETRY_STATUSES:
+                        self.breaker.record_success()
+                        return response
+                    self._record_failure()
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt, response.headers.get('Retry-After', ''))
+                    logger.warning(f'{method} {url} returned {response.status_code}, retrying in {delay:.1f}s')
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+
+            attempt += 1
+            self._record_retry()
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class AsyncUnifiClient(BaseUnifiClient):
+    """
+    asyncio UniFi API client supporting both API token and classic authentication.
+
+    Behaves like UnifiClient: the same endpoints, paging, site resolution,
+    transport limits and 401 re-authentication, with coroutine methods.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transport = AsyncUnifiTransport(
+            self.host, verify_ssl=self.verify_ssl, **self.transport_options,
+        )
+        self._auth_lock = asyncio.Lock()
+        # Prefetched pages of all collections share these slots (see UnifiClient._prefetch_pool)
+        self._prefetch_slots = asyncio.Semaphore(self.prefetch_pages)
+
+    async def connect(self):
+        """Establish connection and authenticate."""
+        if not self._authenticated:
+            await self._login()
+
+        self.sites = await self._get_sites()
+        self._connected = True
+        logger.info(f'Connected. Found {len(self.sites)} site(s)')
+
+    async def disconnect(self):
+        """Close the HTTP client."""
+        await self.transport.aclose()
+        self._connected = False
+        self._authenticated = False
+
+    def export_cookies(self):
+        """Return the session cookies of an authenticated classic-mode client."""
+        return dict(self.transport.client.cookies)
+
+    def restore_cookies(self, cookies):
+        """Adopt session cookies from an earlier login, skipping the next one."""
+        if self.api_mode == 'token' or not cookies:
+            return
+        self.transport.client.cookies.update(cookies)
+        self._authenticated = True
+
+    async def _login(self):
+        """Load credentials and authenticate according to the API mode."""
+        if self.api_mode == 'token':
+            self._load_token()
+        else:
+            await self._authenticate_classic()
+        self._authenticated = True
+
+    async def _authenticate_classic(self):
+        """Authenticate using username/password (classic mode)."""
+        login_url = f'{self.base_url}{self.LOGIN_ENDPOINT}'
+        response = await self.transport.request('POST', login_url, json=self._login_payload())
+        if response.status_code == 200:
+            logger.info('Classic authentication successful')
+        else:
+            raise Exception(f'Authentication failed: {response.status_code} - {response.text}')
+
+    async def _reauthenticate(self):
+        """Log in again after the controller rejected the session cookie."""
+        stale = self.export_cookies()
+        async with self._auth_lock:
+            # Another task may have renewed the session while we waited
+            if self.export_cookies() == stale:
+                logger.info(f'Session for {self.base_url} expired, re-authenticating')
+                self.transport.client.cookies.clear()
+                await self._login()
+
+    async def _api_request(self, endpoint):
+        """Make a GET API request. Raises UnifiAPIError on failure."""
+        url = f'{self.base_url}{endpoint}'
+        headers = self._get_headers()
+        logger.debug(f'GET {url}')
+
+        response = await self.transport.request('GET', url, headers=headers)
+        if response.status_code == 401 and self.api_mode != 'token':
+            await self._reauthenticate()
+            response = await self.transport.request('GET', url, headers=headers)
+        try:
+            response.raise_for_status()
+            return jsonstream.loads(response.content)
+        except (httpx.HTTPStatusError, ValueError) as e:
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {url} failed: {e}') from e
+
+    async def _iter_pages(self, endpoint):
+        """
+        Yield items from a paginated Integration API collection.
+
+        After the first page, up to ``prefetch_pages`` further pages are
+        requested as concurrent tasks, sharing ``prefetch_pages`` request
+        slots with every other collection being paged; items are yielded in
+        offset order.
+        """
+        first = await self._api_request(self._page_endpoint(endpoint, 0))
+        if not first or 'data' not in first:
+            return
+        for item in first['data']:
+            yield item
+
+        offsets = iter(self._remaining_offsets(first))
+        pending = []
+        try:
+            for offset in offsets:
+                pending.append(asyncio.ensure_future(self._prefetch_page(endpoint, offset)))
+                if len(pending) >= self.prefetch_pages:
+                    break
+            while pending:
+                page = await pending.pop(0)
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(asyncio.ensure_future(self._prefetch_page(endpoint, offset)))
+                if page and 'data' in page:
+                    for item in page['data']:
+                        yield item
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _prefetch_page(self, endpoint, offset):
+        async with self._prefetch_slots:
+            return await self._api_request(self._page_endpoint(endpoint, offset))
+
+    async def _iter_legacy(self, endpoint):
+        """Yield items from a legacy API endpoint (unpaged, wrapped in meta/data)."""
+        for item in self._legacy_items(await self._api_request(endpoint)):
+            yield item
+
+    async def _get_sites(self):
+        """Fetch all sites from the controller."""
+        if self.api_mode == 'token':
+            items = self._iter_pages(self.SITES_ENDPOINT)
+        else:
+            items = self._iter_legacy(self.LEGACY_SITES_ENDPOINT)
+        return dict([self._parse_site(site) async for site in items])
+
+    async def _iter_site_objects(self, site_name, resource, legacy_path, label):
+        """Yield objects of one collection from a site in either API mode."""
+        site_name = site_name or self.site
+        endpoint = self._site_endpoint(site_name, resource, legacy_path)
+        if endpoint is None:
+            return
+
+        if self.api_mode == 'token':
+            items = self._iter_pages(endpoint)
+        else:
+            items = self._iter_legacy(endpoint)
+
+        count = 0
+        async for item in items:
+            count += 1
+            yield item
+        logger.info(f"Found {count} {label}(s) on site '{site_name}'")
+
+    def iter_devices(self, site_name=None):
+        """Iterate asynchronously over all network devices on a site."""
+        return self._iter_site_objects(site_name, 'devices', 'stat/device', 'device')
+
+    def iter_clients(self, site_name=None):
+        """Iterate asynchronously over all connected clients on a site."""
+        return self._iter_site_objects(site_name, 'clients', 'stat/sta', 'client')
+
+    def iter_networks(self, site_name=None):
+        """Iterate asynchronously over all networks (VLANs) on a site."""
+        return self._iter_site_objects(site_name, 'networks', 'rest/networkconf', 'network')
+
+    async def get_devices(self, site_name=None):
+        """Fetch all network devices from a site."""
+        return [item async for item in self.iter_devices(site_name)]
+
+    async def get_clients(self, site_name=None):
+        """Fetch all connected clients from a site."""
+        return [item async for item in self.iter_clients(site_name)]
+
+    async def get_networks(self, site_name=None):
+        """Fetch all networks (VLANs) from a site."""
+        return [item async for item in self.iter_networks(site_name)]
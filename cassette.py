@@ -0,0 +1,167 @@
+"""
+Record/replay of controller HTTP traffic for reproducible scan profiling.
+
+A cassette is a gzip-compressed JSON-lines file with one entry per request:
+method, path (host stripped), status, a few response headers and the body.
+Credentials never reach the file: request headers and bodies (API key,
+login payload) are not recorded, Set-Cookie is dropped, login response
+bodies (which carry device and session tokens) are replaced with ``{}``,
+and controller fields named ``x_*`` (UniFi's convention for passphrases
+and keys) or listed in SECRET_FIELDS are blanked in response bodies.
+
+Enable per source with ``"cassette_mode": "record"`` or ``"replay"`` and
+``"cassette_path"`` in the config. Each recording client starts a new
+cassette, overwriting the file. In replay mode no network or credentials
+are needed; UnifiClient is served entirely from the file.
+"""
+import gzip
+import io
+import json
+import logging
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .transport import UnifiAPIError
+
+logger = logging.getLogger('nb_udm_plugin.cassette')
+
+KEPT_HEADERS = ('Content-Type', 'Retry-After')
+SCRUBBED = '********'
+
+# Response fields blanked wherever they appear (compared lowercased)
+SECRET_FIELDS = frozenset({
+    'access_token', 'api_key', 'apikey', 'csrf_token', 'csrftoken', 'devicetoken', 'password',
+    'passphrase', 'refresh_token', 'secret', 'sso_uuid', 'token', 'unique_id',
+})
+
+# Endpoints whose response bodies are never recorded
+LOGIN_PATHS = frozenset({'/api/auth/login', '/api/login'})
+
+
+def _relative_url(url):
+    parts = urlsplit(url)
+    return f'{parts.path}?{parts.query}' if parts.query else parts.path
+
+
+def _is_secret(key):
+    return key.startswith('x_') or key.lower() in SECRET_FIELDS
+
+
+def scrub(value):
+    """Blank UniFi secret fields (``x_*`` and SECRET_FIELDS) throughout a decoded body."""
+    if isinstance(value, dict):
+        return {
+            key: SCRUBBED if _is_secret(key) and value[key] else scrub(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+class CassetteResponse:
+    """The subset of requests.Response that UnifiClient uses, backed by recorded bytes."""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f'{self.status_code} Error for url: {self.url}', response=self,
+            )
+
+    def close(self):
+        pass
+
+
+class RecordingTransport:
+    """Wrap a transport and append every exchange to a cassette file."""
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+        self._lock = threading.Lock()
+        # Start a new cassette; appending to an old one would mix runs on replay
+        with gzip.open(path, 'wt', encoding='utf-8'):
+            pass
+
+    @property
+    def stats(self):
+        return self.transport.stats
+
+    @property
+    def throttle(self):
+        return self.transport.throttle
+
+    def request(self, method, url, **kwargs):
+        response = self.transport.request(method, url, **kwargs)
+        # Reading the body here ends streaming for recorded runs; replay
+        # serves it back through the same raw file interface.
+        content = response.content
+        body = content
+        if urlsplit(url).path in LOGIN_PATHS:
+            body = b'{}'
+        elif 'json' in response.headers.get('Content-Type', ''):
+            try:
+                body = json.dumps(scrub(json.loads(content))).encode()
+            except ValueError:
+                pass
+        entry = {
+            'method': method,
+            'url': _relative_url(url),
+            'status': response.status_code,
+            'headers': {key: response.headers[key] for key in KEPT_HEADERS if key in response.headers},
+            'body': body.decode('utf-8', errors='replace'),
+        }
+        with self._lock:
+            with gzip.open(self.path, 'at', encoding='utf-8') as fh:
+                fh.write(json.dumps(entry) + '\n')
+        return CassetteResponse(url, response.status_code, entry['headers'], content)
+
+
+class ReplayTransport:
+    """Serve requests from a cassette file instead of the network."""
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'retries': 0, 'breaker_trips': 0}
+        self._entries = defaultdict(deque)
+        self._lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as fh:
+            for line in fh:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[(entry['method'], entry['url'])].append(entry)
+        logger.info(f'Loaded {sum(map(len, self._entries.values()))} recorded request(s) from {path}')
+
+    def request(self, method, url, **kwargs):
+        """
+        Return the next recorded response for this method and path.
+
+        Repeated requests replay their recordings in order and then start
+        over, so a cassette can be replayed any number of times.
+        """
+        key = (method, _relative_url(url))
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise UnifiAPIError(f'{method} {key[1]} is not in cassette {self.path}')
+            entry = recorded[0]
+            recorded.rotate(-1)
+        return CassetteResponse(url, entry['status'], entry['headers'], entry['body'].encode())
@@ -30,12 +30,16 @@ class ResultStatusChoices(ChoiceSet):
     STATUS_APPROVED = 'approved'
     STATUS_REJECTED = 'rejected'
     STATUS_AUTO_APPLIED = 'auto_applied'
+    STATUS_SUPERSEDED = 'superseded'
+    STATUS_DISCARDED = 'discarded'
 
     CHOICES = [
         (STATUS_PENDING, 'Pending Review', 'yellow'),
         (STATUS_APPROVED, 'Approved', 'green'),
         (STATUS_REJECTED, 'Rejected', 'red'),
         (STATUS_AUTO_APPLIED, 'Auto-Applied', 'cyan'),
+        (STATUS_SUPERSEDED, 'Superseded', 'gray'),
+        (STATUS_DISCARDED, 'Discarded', 'orange'),
     ]
 
 
@@ -51,6 +55,18 @@ class ResultActionChoices(ChoiceSet):
     ]
 
 
+class ScanKindChoices(ChoiceSet):
+    KIND_DEVICE = 'device'
+    KIND_VLAN = 'vlan'
+    KIND_CLIENT = 'client'
+
+    CHOICES = [
+        (KIND_DEVICE, 'Devices', 'blue'),
+        (KIND_VLAN, 'VLANs', 'orange'),
+        (KIND_CLIENT, 'Clients', 'purple'),
+    ]
+
+
 class DiscoveredTypeChoices(ChoiceSet):
     TYPE_DEVICE = 'device'
     TYPE_IP_ADDRESS = 'ip_address'
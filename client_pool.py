@@ -0,0 +1,114 @@
+"""
+Per-process registry of connected UniFi clients.
+
+Scans and "Test connection" requests for the same source that run in one
+process reuse one UnifiClient, keeping its classic-mode login cookies and
+its keep-alive connections warm between runs. Entries are keyed by source
+and a hash of its connection settings, so editing a source starts a fresh
+client, and clients idle for longer than IDLE_TIMEOUT seconds are closed.
+
+RQ forks a new work horse for every job, so by default each scan job logs
+in once: classic-mode session cookies are as good as the controller
+credentials, so they stay in the process that logged in. With the
+``share_session_cookies`` plugin setting they are also written to the
+Django cache, so forked RQ work horses (which start with an empty registry)
+skip the login too -- anyone who can read the cache backend can then use
+the controller session. An expired session is renewed by UnifiClient on the
+first 401.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from netbox.plugins import get_plugin_config
+
+from .unifi_client import UnifiClient
+
+logger = logging.getLogger('nb_udm_plugin.client_pool')
+
+IDLE_TIMEOUT = 900
+COOKIE_CACHE_PREFIX = 'nb_udm_plugin:session:'
+
+_clients = {}  # key -> [client, last_used]
+_lock = threading.Lock()
+
+
+def config_hash(source):
+    """Stable hash of the settings that determine a source's controller session."""
+    payload = json.dumps([source.config, source.token], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cookie_cache_key(source):
+    return f'{COOKIE_CACHE_PREFIX}{source.pk}:{config_hash(source)}'
+
+
+def _share_cookies():
+    return get_plugin_config('nb_udm_plugin', 'share_session_cookies')
+
+
+def cached_cookies(source):
+    """Classic-mode session cookies saved by an earlier scan of this source, if shared and any."""
+    if not _share_cookies():
+        return None
+    return cache.get(_cookie_cache_key(source))
+
+
+def store_cookies(source, client):
+    """Save a classic-mode client's session cookies for later scans, if sharing is enabled."""
+    if client.api_mode != 'token' and _share_cookies():
+        cache.set(_cookie_cache_key(source), client.export_cookies(), IDLE_TIMEOUT)
+
+
+def forget_cookies(source):
+    cache.delete(_cookie_cache_key(source))
+
+
+@contextmanager
+def acquire_client(source):
+    """
+    Yield a connected client for a source, reusing a warm one when possible.
+
+    A client that raises inside the block is discarded rather than returned
+    to the registry.
+    """
+    key = (source.pk, config_hash(source))
+    _evict_idle()
+
+    with _lock:
+        entry = _clients.pop(key, None)
+    if entry:
+        client = entry[0]
+    else:
+        client = UnifiClient.from_source(source)
+        client.restore_cookies(cached_cookies(source))
+
+    try:
+        client.connect()
+        yield client
+    except BaseException:
+        client.disconnect()
+        forget_cookies(source)
+        raise
+
+    store_cookies(source, client)
+    with _lock:
+        previous = _clients.get(key)
+        _clients[key] = [client, time.monotonic()]
+    if previous:
+        previous[0].disconnect()
+
+
+def _evict_idle():
+    """Close and drop clients that have not been used for IDLE_TIMEOUT seconds."""
+    cutoff = time.monotonic() - IDLE_TIMEOUT
+    with _lock:
+        idle = [key for key, (_, last_used) in _clients.items() if last_used < cutoff]
+        evicted = [_clients.pop(key)[0] for key in idle]
+    for client in evicted:
+        logger.debug(f'Closing idle client for {client.base_url}')
+        client.disconnect()
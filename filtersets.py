@@ -40,7 +40,14 @@ class DiscoveryResultFilterSet(NetBoxModelFilterSet):
 
 class DiscoveryMappingFilterSet(NetBoxModelFilterSet):
     is_orphan = django_filters.BooleanFilter()
+    dangling = django_filters.BooleanFilter(method='filter_dangling')
 
     class Meta:
         model = DiscoveryMapping
         fields = ('id', 'source_id', 'is_orphan')
+
+    def filter_dangling(self, queryset, name, value):
+        if value is None:
+            return queryset
+        dangling = queryset.dangling()
+        return dangling if value else queryset.exclude(pk__in=dangling.values('pk'))
@@ -33,7 +33,8 @@ class DiscoverySourceForm(NetBoxModelForm):
         model = DiscoverySource
         fields = (
             'name', 'description', 'status', 'config', 'token', 'site',
-            'scan_interval', 'sync_devices', 'sync_clients', 'sync_vlans',
+            'scan_interval', 'device_scan_interval', 'vlan_scan_interval',
+            'client_scan_interval', 'sync_devices', 'sync_clients', 'sync_vlans',
             'tags',
         )
         widgets = {
@@ -93,6 +94,7 @@ class DiscoveryResultFilterForm(NetBoxModelFilterSetForm):
 class DiscoveryMappingFilterForm(NetBoxModelFilterSetForm):
     model = DiscoveryMapping
     is_orphan = forms.NullBooleanField(required=False, label='Orphan')
+    dangling = forms.NullBooleanField(required=False, label='NetBox object deleted')
     source_id = DynamicModelChoiceField(
         queryset=DiscoverySource.objects.all(),
         required=False,
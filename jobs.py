@@ -1,89 +1,345 @@
 """
 Background jobs for discovery scanning.
 """
+import asyncio
 import logging
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
 from django.utils import timezone
 
+from core.choices import JobStatusChoices
 from netbox.jobs import JobRunner
+from netbox.plugins import get_plugin_config
 
-from .choices import ScanJobStatusChoices
-from .models import DiscoveryResult, DiscoverySource, ScanJob
-from .reconciliation import reconcile
-from .scanner import scan_source
+from .choices import ScanJobStatusChoices, SourceStatusChoices
+from .client_pool import acquire_client
+from .models import DiscoverySource, ScanJob
+from .reconciliation import (
+    discard_results, mark_orphans, reconcile_chunks, save_results, supersede_stale_results,
+)
+from .scanner import DEFAULT_CHUNK_SIZE, async_scan_source, iter_scan_source
 
 logger = logging.getLogger('nb_udm_plugin')
 
 
+def run_scan(source, due_only=False):
+    """
+    Scan one source and record the outcome on a new ScanJob.
+
+    With ``due_only``, only the object types whose scan interval has elapsed
+    are fetched, and nothing runs if none are due. Scan errors are recorded
+    on the ScanJob rather than raised. Returns the ScanJob, or None if
+    nothing was due.
+
+    Sources with ``"shard_sites": true`` in their config are split into one
+    SiteShardJob per UniFi site instead; the ScanJob is then still running
+    when this returns and is completed by the last shard.
+    """
+    kinds = source.due_scan_kinds() if due_only else source.enabled_scan_kinds
+    if not kinds:
+        logger.info('Nothing due for source: %s', source.name)
+        return None
+
+    scan_job = ScanJob.objects.create(
+        source=source,
+        status=ScanJobStatusChoices.STATUS_RUNNING,
+        started_at=timezone.now(),
+        scan_kinds=kinds,
+    )
+
+    try:
+        logger.info('Starting scan for source: %s (%s)', source.name, ', '.join(kinds))
+
+        if source.config.get('shard_sites') and _shardable(source) and _enqueue_shards(source, scan_job, kinds):
+            return scan_job
+
+        # Run the scanner
+        # Cassettes are only supported by the threaded client
+        if source.config.get('client_backend') == 'async' and not source.config.get('cassette_mode'):
+            discovered = asyncio.run(async_scan_source(source, scan_job, kinds))
+        else:
+            discovered = iter_scan_source(source, scan_job, kinds)
+
+        _reconcile_and_save(source, scan_job, discovered, kinds)
+        logger.info('Discovered %d objects from %s', scan_job.discovered_count, source.name)
+        _complete_scan(scan_job, success=True)
+
+    except Exception as e:
+        logger.error('Scan failed for %s: %s', source.name, e)
+        scan_job.error_count += 1
+        scan_job.log = traceback.format_exc()
+        _complete_scan(scan_job, success=False)
+
+    return scan_job
+
+
+def _reconcile_and_save(source, scan_job, discovered, kinds, orphans=True):
+    """Reconcile discovered objects and save the results chunk by chunk, counting on scan_job."""
+    chunk_size = max(1, int(source.config.get('chunk_size', DEFAULT_CHUNK_SIZE)))
+    discovered = _counted(discovered, scan_job)
+    for results in reconcile_chunks(source, scan_job, discovered, chunk_size, kinds, orphans):
+        save_results(source, results)
+        scan_job.created_count += sum(
+            1 for r in results if r.action == 'create'
+        )
+        scan_job.updated_count += sum(
+            1 for r in results if r.action == 'update'
+        )
+        # Lets the stale job reaper see that the scan is progressing
+        ScanJob.objects.filter(pk=scan_job.pk).update(last_updated=timezone.now())
+
+
+def _complete_scan(scan_job, success):
+    """
+    Save the final ScanJob status and the source's last-scan fields.
+
+    The pending results a failed scan saved before it failed are discarded.
+    A scan the stale job reaper failed while it was running stays failed,
+    and the results it saved after that are discarded too.
+    """
+    source = scan_job.source
+    with transaction.atomic():
+        status = ScanJob.objects.select_for_update().filter(pk=scan_job.pk).values_list('status', flat=True).first()
+        if status != ScanJobStatusChoices.STATUS_RUNNING:
+            logger.warning('Scan of %s was marked failed as stale while it ran', source.name)
+            scan_job.log += 'Marked failed as stale while running; its results were discarded.\n'
+            success = False
+        scan_job.status = ScanJobStatusChoices.STATUS_COMPLETED if success else ScanJobStatusChoices.STATUS_FAILED
+        scan_job.completed_at = timezone.now()
+        scan_job.save()
+        if not success:
+            discard_results([scan_job.pk])
+
+    source.last_scan = timezone.now()
+    source.last_scan_success = success
+    if success:
+        for kind in scan_job.scan_kinds:
+            setattr(source, f'last_{kind}_scan', scan_job.started_at)
+    source.save()
+
+    if success:
+        logger.info(
+            'Scan complete for %s: %d discovered, %d to create, %d to update',
+            source.name, scan_job.discovered_count,
+            scan_job.created_count, scan_job.updated_count,
+        )
+
+
+def _shardable(source):
+    """False for sources recording a cassette: concurrent shards would overwrite each other's recording."""
+    if source.config.get('cassette_mode') == 'record':
+        logger.warning('Not sharding the scan of %s while it records a cassette', source.name)
+        return False
+    return True
+
+
+def _enqueue_shards(source, scan_job, kinds):
+    """Queue one SiteShardJob per UniFi site. Returns False if there is nothing to split."""
+    with acquire_client(source) as client:
+        sites = list(client.sites)
+    if len(sites) < 2:
+        return False
+
+    scan_job.shard_count = len(sites)
+    scan_job.save()
+    for site_name in sites:
+        SiteShardJob.enqueue(instance=source, scan_job_id=scan_job.pk, site_name=site_name, kinds=kinds)
+    logger.info('Split scan of %s into %d site shard(s)', source.name, len(sites))
+    return True
+
+
+def scan_in_progress(source):
+    """True if a scan of the source is queued or running."""
+    return (
+        source.jobs.filter(status__in=JobStatusChoices.ENQUEUED_STATE_CHOICES).exists()
+        or source.scan_jobs.filter(status=ScanJobStatusChoices.STATUS_RUNNING).exists()
+    )
+
+
 class DiscoveryScanJob(JobRunner):
     """Execute a discovery scan for a single UniFi source."""
 
     class Meta:
         name = 'Discovery Scan'
 
-    def run(self, *args, **kwargs):
+    def run(self, *args, due_only=False, **kwargs):
         source = self.job.object
         if not isinstance(source, DiscoverySource):
             logger.error('Expected DiscoverySource, got %s', type(source))
             return
 
-        scan_job = ScanJob.objects.create(
-            source=source,
-            status=ScanJobStatusChoices.STATUS_RUNNING,
-            started_at=timezone.now(),
-        )
+        run_scan(source, due_only)
+
 
+class SiteShardJob(JobRunner):
+    """
+    Scan one UniFi site of a sharded source scan.
+
+    Fetches, maps and reconciles the site, then adds its counters to the
+    parent ScanJob. The shard that finishes last fans in: it counts a miss
+    for the mappings no shard saw (see mark_orphans) and completes the ScanJob.
+    """
+
+    class Meta:
+        name = 'Discovery Site Shard'
+
+    def run(self, *args, scan_job_id=None, site_name='', kinds=None, **kwargs):
+        source = self.job.object
+        # Unsaved stand-in for the parent ScanJob: results point at the parent,
+        # while the counters only cover this shard
+        shard = ScanJob(pk=scan_job_id, source=source)
+        log = ''
         try:
-            logger.info('Starting scan for source: %s', source.name)
+            logger.info('Scanning site %s of %s', site_name, source.name)
+            discovered = iter_scan_source(source, shard, kinds, sites=[site_name])
+            _reconcile_and_save(source, shard, discovered, kinds, orphans=False)
+        except Exception as e:
+            logger.error('Shard %s of %s failed: %s', site_name, source.name, e)
+            shard.error_count += 1
+            log = f'Site {site_name}:\n{traceback.format_exc()}\n'
 
-            # Run the scanner
-            discovered = scan_source(source)
-            scan_job.discovered_count = len(discovered)
-            logger.info('Discovered %d objects from %s', len(discovered), source.name)
+        with transaction.atomic():
+            updates = {
+                'discovered_count': F('discovered_count') + shard.discovered_count,
+                'created_count': F('created_count') + shard.created_count,
+                'updated_count': F('updated_count') + shard.updated_count,
+                'error_count': F('error_count') + shard.error_count,
+                'retry_count': F('retry_count') + shard.retry_count,
+                'breaker_trip_count': F('breaker_trip_count') + shard.breaker_trip_count,
+                'shards_done': F('shards_done') + 1,
+                # Lets the stale job reaper see that the sharded scan is progressing
+                'last_updated': timezone.now(),
+            }
+            if shard.rate_limit is not None:
+                updates['rate_limit'] = shard.rate_limit
+                updates['concurrency_limit'] = shard.concurrency_limit
+            if log:
+                updates['log'] = Concat(F('log'), Value(log))
+            ScanJob.objects.filter(pk=scan_job_id).update(**updates)
+            scan_job = ScanJob.objects.select_for_update().get(pk=scan_job_id)
+            if scan_job.status != ScanJobStatusChoices.STATUS_RUNNING:
+                # The stale job reaper has failed the scan; drop what this shard saved
+                logger.warning('Scan of %s was failed while site %s ran', source.name, site_name)
+                discard_results([scan_job_id])
+                return
+            if scan_job.shards_done < scan_job.shard_count:
+                return
 
-            # Reconcile against NetBox
-            results = reconcile(source, scan_job, discovered)
+        # Fan-in: this was the last shard
+        if scan_job.error_count:
+            scan_job.log += 'Orphan marking skipped because some site shards failed.\n'
+            _complete_scan(scan_job, success=False)
+        else:
+            mark_orphans(source, scan_job, scan_job.scan_kinds)
+            supersede_stale_results(source, scan_job, scan_job.scan_kinds)
+            _complete_scan(scan_job, success=True)
 
-            # Bulk create results
-            DiscoveryResult.objects.bulk_create(results, batch_size=100)
 
-            # Update stats
-            scan_job.created_count = sum(
-                1 for r in results if r.action == 'create'
-            )
-            scan_job.updated_count = sum(
-                1 for r in results if r.action == 'update'
-            )
-            scan_job.status = ScanJobStatusChoices.STATUS_COMPLETED
-            scan_job.completed_at = timezone.now()
-            scan_job.save()
-
-            source.last_scan = timezone.now()
-            source.last_scan_success = True
-            source.save()
-
-            logger.info(
-                'Scan complete for %s: %d discovered, %d to create, %d to update',
-                source.name, scan_job.discovered_count,
-                scan_job.created_count, scan_job.updated_count,
-            )
+class FleetScanJob(JobRunner):
+    """
+    Scan every active source in parallel.
 
-        except Exception as e:
-            logger.error('Scan failed for %s: %s', source.name, e)
-            scan_job.status = ScanJobStatusChoices.STATUS_FAILED
-            scan_job.error_count += 1
-            scan_job.log = traceback.format_exc()
-            scan_job.completed_at = timezone.now()
-            scan_job.save()
-            source.last_scan = timezone.now()
-            source.last_scan_success = False
-            source.save()
+    Sources run on a thread pool of at most ``fleet_max_concurrency``
+    (plugin setting) and are isolated from each other: each gets its own
+    ScanJob, and a failing source does not stop the rest. Sources with a
+    scan already queued or running are skipped. The wall-clock time of the
+    whole run and the summed per-source time are stored in the job data.
+    """
+
+    class Meta:
+        name = 'Fleet Scan'
+
+    def run(self, *args, due_only=False, **kwargs):
+        sources = [
+            source
+            for source in DiscoverySource.objects.filter(status=SourceStatusChoices.STATUS_ACTIVE)
+            if not scan_in_progress(source)
+        ]
+        max_workers = max(1, int(get_plugin_config('nb_udm_plugin', 'fleet_max_concurrency')))
+        logger.info('Fleet scan of %d source(s), %d at a time', len(sources), max_workers)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            scan_jobs = [job for job in pool.map(_fleet_scan_one, sources, [due_only] * len(sources)) if job]
+        wall_time = time.monotonic() - started
+
+        source_time = sum(job.duration.total_seconds() for job in scan_jobs if job.duration)
+        failed = sum(1 for job in scan_jobs if job.status == ScanJobStatusChoices.STATUS_FAILED)
+        self.job.data = {
+            'sources': len(sources),
+            'scanned': len(scan_jobs),
+            'failed': failed,
+            'wall_time': round(wall_time, 1),
+            'source_time': round(source_time, 1),
+            'scan_jobs': [job.pk for job in scan_jobs],
+        }
+        logger.info(
+            'Fleet scan complete: %d scanned, %d failed in %.1fs (%.1fs summed over sources)',
+            len(scan_jobs), failed, wall_time, source_time,
+        )
+
+
+def _fleet_scan_one(source, due_only):
+    """Scan one source on a fleet worker thread, never raising."""
+    try:
+        return run_scan(source, due_only)
+    except Exception as e:
+        logger.error('Fleet scan of %s failed: %s', source.name, e)
+        return None
+    finally:
+        # Each worker thread has its own database connection
+        connection.close()
+
+
+def _counted(discovered, scan_job):
+    """Pass discovered objects through, counting them on the ScanJob."""
+    for obj in discovered:
+        scan_job.discovered_count += 1
+        yield obj
+
+
+class ScheduledScanDispatcher(JobRunner):
+    """
+    Queue due-only scans for active sources whose object types are due.
+
+    Does nothing unless the ``scheduled_scans`` plugin setting is enabled.
+    """
+
+    class Meta:
+        name = 'Scheduled Scan Dispatcher'
+
+    def run(self, *args, **kwargs):
+        # A dispatcher scheduled before the setting was turned off keeps running
+        if not get_plugin_config('nb_udm_plugin', 'scheduled_scans'):
+            logger.debug('Scheduled scans are disabled')
+            return
+        now = timezone.now()
+        queued = 0
+        for source in DiscoverySource.objects.filter(status=SourceStatusChoices.STATUS_ACTIVE):
+            if not source.due_scan_kinds(now):
+                continue
+            # Leave sources alone while an earlier scan is still queued or running
+            if scan_in_progress(source):
+                continue
+            DiscoveryScanJob.enqueue(instance=source, due_only=True)
+            queued += 1
+        if queued:
+            logger.info('Queued %d scheduled scan(s)', queued)
 
 
 class StaleJobReaper(JobRunner):
-    """Mark scan jobs that have been running too long as failed."""
+    """
+    Mark scan jobs that have stopped making progress as failed.
+
+    A scan job counts as progressing while it saves chunks of results (or,
+    when sharded, while shards finish): each bumps its last_updated.
+    """
 
     class Meta:
         name = 'Stale Job Reaper'
@@ -92,16 +348,23 @@ class StaleJobReaper(JobRunner):
 
     def run(self, *args, **kwargs):
         cutoff = timezone.now() - timedelta(minutes=self.MAX_RUNTIME_MINUTES)
-        stale_jobs = ScanJob.objects.filter(
-            status=ScanJobStatusChoices.STATUS_RUNNING,
-            started_at__lt=cutoff,
-        )
-        count = stale_jobs.count()
+        # Locked so a scan completing at the same time is either reaped or
+        # completed (see _complete_scan), never both
+        with transaction.atomic():
+            stale_ids = list(ScanJob.objects.select_for_update(skip_locked=True).filter(
+                status=ScanJobStatusChoices.STATUS_RUNNING,
+                last_updated__lt=cutoff,
+            ).values_list('pk', flat=True))
+            count = len(stale_ids)
+            if count:
+                ScanJob.objects.filter(pk__in=stale_ids).update(
+                    status=ScanJobStatusChoices.STATUS_FAILED,
+                    completed_at=timezone.now(),
+                )
+                discard_results(stale_ids)
         if count:
-            stale_jobs.update(
-                status=ScanJobStatusChoices.STATUS_FAILED,
-                completed_at=timezone.now(),
+            logger.warning(
+                'Marked %d stale scan job(s) as failed (no progress for %dmin)', count, self.MAX_RUNTIME_MINUTES,
             )
-            logger.warning('Marked %d stale scan job(s) as failed (>%dmin)', count, self.MAX_RUNTIME_MINUTES)
         else:
             logger.debug('Stale job reaper: no stale jobs found')
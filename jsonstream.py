@@ -0,0 +1,72 @@
+"""
+JSON decoding helpers for controller responses.
+
+``loads`` uses orjson when it is installed and falls back to the standard
+library. ``iter_data_items`` decodes the ``data`` array of a response body
+incrementally with ijson (using its C backend when available), so a
+multi-megabyte stat/sta or stat/device response is never held as one
+Python structure. Without ijson it falls back to a full ``loads``.
+
+Malformed or truncated bodies raise ValueError from either decoder.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def loads(data):
+    """Decode a complete JSON document from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class EnvelopeError(Exception):
+    """A legacy response's ``meta.rc`` was not 'ok'."""
+
+
+def _check_meta(meta):
+    if meta.get('rc') != 'ok':
+        message = f"controller returned rc={meta.get('rc')!r}"
+        if meta.get('msg'):
+            message += f": {meta['msg']}"
+        raise EnvelopeError(message)
+
+
+def iter_data_items(fp):
+    """
+    Yield the items of a legacy response's ``data`` array read from a binary file object.
+
+    Raises EnvelopeError when ``meta.rc`` is not 'ok' -- before the first
+    item when the controller sends ``meta`` first (as it does), otherwise
+    at the end of the body.
+    """
+    if ijson is None:
+        body = loads(fp.read())
+        _check_meta(body.get('meta') or {})
+        yield from body.get('data') or []
+        return
+
+    meta = {}
+
+    def events():
+        for prefix, event, value in ijson.parse(fp, use_float=True):
+            if prefix in ('meta.rc', 'meta.msg'):
+                meta[prefix[5:]] = value
+            yield prefix, event, value
+
+    try:
+        for item in ijson.items(events(), 'data.item'):
+            _check_meta(meta)
+            yield item
+    except ijson.JSONError as e:
+        raise ValueError(str(e)) from e
+    _check_meta(meta)
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0002_discoverysource_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='retry_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Controller requests retried after a 429/5xx or network error.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='breaker_trip_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Times the controller circuit breaker opened during the scan.',
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0003_scanjob_transport_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='rate_limit',
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                help_text='Controller request rate limit (requests/second) when the scan finished.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='concurrency_limit',
+            field=models.PositiveIntegerField(
+                blank=True,
+                null=True,
+                help_text='Controller in-flight request limit when the scan finished.',
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0004_scanjob_throttle_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoverymapping',
+            name='data_fingerprint',
+            field=models.CharField(
+                blank=True,
+                default='',
+                help_text='Hash of the discovered data when it was last found in sync with NetBox.',
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoverymapping',
+            name='netbox_fingerprint',
+            field=models.CharField(
+                blank=True,
+                default='',
+                help_text='Hash of the compared NetBox fields when they were last found in sync.',
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,94 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_scan_kind(apps, schema_editor):
+    """Derive the scan kind from the identity key formats the scanner produces."""
+    for model_name in ('DiscoveryMapping', 'DiscoveryResult'):
+        model = apps.get_model('nb_udm_plugin', model_name)
+        model.objects.filter(identity_key__startswith='vlan:').update(scan_kind='vlan')
+        model.objects.filter(
+            identity_key__contains=' [', identity_key__endswith=']',
+        ).update(scan_kind='client')
+        model.objects.filter(scan_kind='').exclude(
+            Q(identity_key__startswith='vlan:') | Q(identity_key__endswith=']'),
+        ).update(scan_kind='device')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0005_discoverymapping_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoverysource',
+            name='device_scan_interval',
+            field=models.PositiveIntegerField(
+                blank=True,
+                null=True,
+                help_text='Interval in minutes for infrastructure devices. Blank = use scan interval.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoverysource',
+            name='vlan_scan_interval',
+            field=models.PositiveIntegerField(
+                blank=True,
+                null=True,
+                help_text='Interval in minutes for VLANs. Blank = use scan interval.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoverysource',
+            name='client_scan_interval',
+            field=models.PositiveIntegerField(
+                blank=True,
+                null=True,
+                help_text='Interval in minutes for clients. Blank = use scan interval.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoverysource',
+            name='last_device_scan',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discoverysource',
+            name='last_vlan_scan',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='discoverysource',
+            name='last_client_scan',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='scan_kinds',
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=20),
+                blank=True,
+                default=list,
+                help_text='Object types fetched by this scan.',
+                size=None,
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoveryresult',
+            name='scan_kind',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='discoverymapping',
+            name='scan_kind',
+            field=models.CharField(
+                blank=True,
+                max_length=20,
+                help_text='Object type scan that discovers this object; orphan checks are scoped by it.',
+            ),
+        ),
+        migrations.RunPython(backfill_scan_kind, migrations.RunPython.noop),
+    ]
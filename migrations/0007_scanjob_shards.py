@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0006_per_kind_scan_cadence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='shard_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Per-site shard jobs this scan was split into (0 = not sharded).',
+            ),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='shards_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
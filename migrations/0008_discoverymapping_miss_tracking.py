@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0007_scanjob_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoverymapping',
+            name='last_seen_scan',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='nb_udm_plugin.scanjob',
+                help_text='Last scan that discovered this object.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='discoverymapping',
+            name='miss_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Consecutive scans that did not discover this object.',
+            ),
+        ),
+    ]
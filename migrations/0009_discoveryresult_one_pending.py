@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, Subquery
+
+
+def supersede_duplicates(apps, schema_editor):
+    """Keep the newest pending result per (source, identity_key) and supersede the rest."""
+    DiscoveryResult = apps.get_model('nb_udm_plugin', 'DiscoveryResult')
+    pending = DiscoveryResult.objects.filter(status='pending')
+    latest = pending.order_by().values('source_id', 'identity_key').annotate(latest=Max('pk')).values('latest')
+    pending.exclude(pk__in=Subquery(latest)).update(status='superseded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0008_discoverymapping_miss_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoveryresult',
+            name='previous_scan_job',
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+',
+                to='nb_udm_plugin.scanjob',
+                help_text='Scan that produced this result before the latest scan refreshed it.',
+            ),
+        ),
+        migrations.RunPython(supersede_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='discoveryresult',
+            constraint=models.UniqueConstraint(
+                fields=('source', 'identity_key'),
+                condition=models.Q(status='pending'),
+                name='nb_udm_plugin_discoveryresult_one_pending',
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def scope_vlan_keys(apps, schema_editor):
+    """
+    Rewrite VLAN identity keys from vlan:<vid> to vlan:<site>:<vid>.
+
+    Results carry the site they were discovered at in proposed_data; a
+    mapping takes the site of its source's latest result for the key, or
+    else the site of the VLAN it points at. Keys whose site is unknown are
+    left as they are.
+    """
+    DiscoveryMapping = apps.get_model('nb_udm_plugin', 'DiscoveryMapping')
+    DiscoveryResult = apps.get_model('nb_udm_plugin', 'DiscoveryResult')
+    VLAN = apps.get_model('ipam', 'VLAN')
+
+    def scoped(key, site_name):
+        return f'vlan:{site_name}:{key[5:]}'
+
+    latest_sites = {}
+    for result in DiscoveryResult.objects.filter(identity_key__regex=r'^vlan:[0-9]+$').order_by('pk'):
+        site_name = (result.proposed_data or {}).get('site_name')
+        if site_name:
+            latest_sites[(result.source_id, result.identity_key)] = site_name
+            result.identity_key = scoped(result.identity_key, site_name)
+            result.save(update_fields=['identity_key'])
+
+    mappings = list(DiscoveryMapping.objects.filter(identity_key__regex=r'^vlan:[0-9]+$'))
+    vlan_sites = dict(VLAN.objects.filter(
+        pk__in=[mapping.netbox_object_id for mapping in mappings], site__isnull=False,
+    ).values_list('pk', 'site__name'))
+    for mapping in mappings:
+        site_name = latest_sites.get((mapping.source_id, mapping.identity_key))
+        if site_name is None and mapping.netbox_object_type.model == 'vlan':
+            site_name = vlan_sites.get(mapping.netbox_object_id)
+        if site_name:
+            mapping.identity_key = scoped(mapping.identity_key, site_name)
+            mapping.save(update_fields=['identity_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nb_udm_plugin', '0009_discoveryresult_one_pending'),
+    ]
+
+    operations = [
+        migrations.RunPython(scope_vlan_keys, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,23 @@
+from datetime import timedelta
+
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 
 from netbox.models import NetBoxModel
 from netbox.models.features import JobsMixin
+from utilities.querysets import RestrictedQuerySet
 
 from .choices import (
     DiscoveredTypeChoices,
     ResultActionChoices,
     ResultStatusChoices,
     ScanJobStatusChoices,
+    ScanKindChoices,
     SourceStatusChoices,
 )
 
@@ -46,8 +53,26 @@ class DiscoverySource(JobsMixin, NetBoxModel):
         default=0,
         help_text='Auto-scan interval in minutes. 0 = manual only.',
     )
+    device_scan_interval = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='Interval in minutes for infrastructure devices. Blank = use scan interval.',
+    )
+    vlan_scan_interval = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='Interval in minutes for VLANs. Blank = use scan interval.',
+    )
+    client_scan_interval = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='Interval in minutes for clients. Blank = use scan interval.',
+    )
     last_scan = models.DateTimeField(blank=True, null=True)
     last_scan_success = models.BooleanField(default=True)
+    last_device_scan = models.DateTimeField(blank=True, null=True)
+    last_vlan_scan = models.DateTimeField(blank=True, null=True)
+    last_client_scan = models.DateTimeField(blank=True, null=True)
 
     sync_devices = models.BooleanField(default=True)
     sync_clients = models.BooleanField(default=True)
@@ -59,6 +84,51 @@ class DiscoverySource(JobsMixin, NetBoxModel):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        super().clean()
+        if not isinstance(self.config, dict):
+            raise ValidationError({'config': 'Config must be a JSON object.'})
+        from .scanner import raw_field_errors, role_rule_errors
+        errors = role_rule_errors(self.config) + raw_field_errors(self.config)
+        if self.config.get('shard_sites') and self.config.get('cassette_mode') == 'record':
+            errors.append('"shard_sites" cannot be used while recording a cassette: every shard would overwrite it')
+        if errors:
+            raise ValidationError({'config': errors})
+
+    @property
+    def enabled_scan_kinds(self):
+        """Object types this source syncs, in scan order."""
+        enabled = {
+            ScanKindChoices.KIND_DEVICE: self.sync_devices,
+            ScanKindChoices.KIND_VLAN: self.sync_vlans,
+            ScanKindChoices.KIND_CLIENT: self.sync_clients,
+        }
+        return [kind for kind, sync in enabled.items() if sync]
+
+    def get_scan_interval(self, kind):
+        """Scan interval in minutes for an object type (0 = manual only)."""
+        interval = getattr(self, f'{kind}_scan_interval')
+        return self.scan_interval if interval is None else interval
+
+    def due_scan_kinds(self, now=None):
+        """
+        Enabled object types whose interval has elapsed since they were last scanned.
+
+        After a failed scan the interval also runs from the failure, so an
+        unreachable controller is retried once per interval, not every time
+        the dispatcher runs.
+        """
+        now = now or timezone.now()
+        due = []
+        for kind in self.enabled_scan_kinds:
+            interval = self.get_scan_interval(kind)
+            last = getattr(self, f'last_{kind}_scan')
+            if not self.last_scan_success and self.last_scan and (last is None or self.last_scan > last):
+                last = self.last_scan
+            if interval and (last is None or now - last >= timedelta(minutes=interval)):
+                due.append(kind)
+        return due
+
     def get_absolute_url(self):
         return reverse('plugins:nb_udm_plugin:discoverysource', args=[self.pk])
 
@@ -79,10 +149,39 @@ class ScanJob(NetBoxModel):
     started_at = models.DateTimeField(blank=True, null=True)
     completed_at = models.DateTimeField(blank=True, null=True)
     dry_run = models.BooleanField(default=False)
+    scan_kinds = ArrayField(
+        base_field=models.CharField(max_length=20, choices=ScanKindChoices),
+        blank=True,
+        default=list,
+        help_text='Object types fetched by this scan.',
+    )
     discovered_count = models.PositiveIntegerField(default=0)
     created_count = models.PositiveIntegerField(default=0)
     updated_count = models.PositiveIntegerField(default=0)
     error_count = models.PositiveIntegerField(default=0)
+    retry_count = models.PositiveIntegerField(
+        default=0,
+        help_text='Controller requests retried after a 429/5xx or network error.',
+    )
+    breaker_trip_count = models.PositiveIntegerField(
+        default=0,
+        help_text='Times the controller circuit breaker opened during the scan.',
+    )
+    rate_limit = models.FloatField(
+        blank=True,
+        null=True,
+        help_text='Controller request rate limit (requests/second) when the scan finished.',
+    )
+    concurrency_limit = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text='Controller in-flight request limit when the scan finished.',
+    )
+    shard_count = models.PositiveIntegerField(
+        default=0,
+        help_text='Per-site shard jobs this scan was split into (0 = not sharded).',
+    )
+    shards_done = models.PositiveIntegerField(default=0)
     log = models.TextField(blank=True, default='')
 
     class Meta:
@@ -101,6 +200,31 @@ class ScanJob(NetBoxModel):
         return None
 
 
+def _netbox_object_prefetch(lookup):
+    """
+    GenericPrefetch of a NetBox object GFK, one query per content type.
+
+    Devices come with their site and primary IPv4, VLANs with their site
+    and IPs with their VRF. Deleted objects get a cached None, so reading
+    the GFK never issues a query.
+    """
+    from django.contrib.contenttypes.prefetch import GenericPrefetch
+    from dcim.models import Device
+    from ipam.models import IPAddress, VLAN
+    return GenericPrefetch(lookup, [
+        Device.objects.select_related('site', 'primary_ip4'),
+        VLAN.objects.select_related('site'),
+        IPAddress.objects.select_related('vrf'),
+    ])
+
+
+class DiscoveryResultQuerySet(RestrictedQuerySet):
+
+    def with_matched_objects(self):
+        """Prefetch matched_object with one query per content type."""
+        return self.prefetch_related(_netbox_object_prefetch('matched_object'))
+
+
 class DiscoveryResult(NetBoxModel):
     """A single discovered object staged for review."""
 
@@ -109,6 +233,14 @@ class DiscoveryResult(NetBoxModel):
         on_delete=models.CASCADE,
         related_name='results',
     )
+    previous_scan_job = models.ForeignKey(
+        to='ScanJob',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+',
+        help_text='Scan that produced this result before the latest scan refreshed it.',
+    )
     source = models.ForeignKey(
         to='DiscoverySource',
         on_delete=models.CASCADE,
@@ -118,6 +250,11 @@ class DiscoveryResult(NetBoxModel):
         max_length=50,
         choices=DiscoveredTypeChoices,
     )
+    scan_kind = models.CharField(
+        max_length=20,
+        choices=ScanKindChoices,
+        blank=True,
+    )
     discovered_data = models.JSONField(default=dict)
     proposed_data = models.JSONField(default=dict)
 
@@ -153,12 +290,22 @@ class DiscoveryResult(NetBoxModel):
     )
     reviewed_at = models.DateTimeField(blank=True, null=True)
 
+    objects = DiscoveryResultQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
         indexes = [
             models.Index(fields=['source', 'identity_key']),
             models.Index(fields=['status']),
         ]
+        constraints = [
+            # Scans refresh the pending result of an identity instead of adding another
+            models.UniqueConstraint(
+                fields=('source', 'identity_key'),
+                condition=models.Q(status=ResultStatusChoices.STATUS_PENDING),
+                name='nb_udm_plugin_discoveryresult_one_pending',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.get_discovered_type_display()}: {self.identity_key}'
@@ -167,6 +314,24 @@ class DiscoveryResult(NetBoxModel):
         return reverse('plugins:nb_udm_plugin:discoveryresult', args=[self.pk])
 
 
+class DiscoveryMappingQuerySet(RestrictedQuerySet):
+
+    def with_targets(self):
+        """Prefetch netbox_object with one query per content type."""
+        return self.prefetch_related(_netbox_object_prefetch('netbox_object'))
+
+    def dangling(self):
+        """Mappings whose NetBox object no longer exists, with one subquery per content type."""
+        dangling = models.Q()
+        for ct_id in self.order_by().values_list('netbox_object_type', flat=True).distinct():
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+            of_type = models.Q(netbox_object_type_id=ct_id)
+            if model is not None:
+                of_type &= ~models.Q(netbox_object_id__in=model.objects.values('pk'))
+            dangling |= of_type
+        return self.filter(dangling) if dangling else self.none()
+
+
 class DiscoveryMapping(NetBoxModel):
     """Persistent link: source identity <-> NetBox object."""
 
@@ -176,6 +341,12 @@ class DiscoveryMapping(NetBoxModel):
         related_name='mappings',
     )
     identity_key = models.CharField(max_length=255, db_index=True)
+    scan_kind = models.CharField(
+        max_length=20,
+        choices=ScanKindChoices,
+        blank=True,
+        help_text='Object type scan that discovers this object; orphan checks are scoped by it.',
+    )
 
     netbox_object_type = models.ForeignKey(
         to=ContentType,
@@ -187,7 +358,33 @@ class DiscoveryMapping(NetBoxModel):
 
     first_seen = models.DateTimeField(auto_now_add=True)
     last_seen = models.DateTimeField(auto_now=True)
+    last_seen_scan = models.ForeignKey(
+        to='ScanJob',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        blank=True,
+        null=True,
+        help_text='Last scan that discovered this object.',
+    )
+    miss_count = models.PositiveIntegerField(
+        default=0,
+        help_text='Consecutive scans that did not discover this object.',
+    )
     is_orphan = models.BooleanField(default=False)
+    data_fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text='Hash of the discovered data when it was last found in sync with NetBox.',
+    )
+    netbox_fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text='Hash of the compared NetBox fields when they were last found in sync.',
+    )
+
+    objects = DiscoveryMappingQuerySet.as_manager()
 
     class Meta:
         ordering = ('source', 'identity_key')
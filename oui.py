@@ -0,0 +1,288 @@
+"""
+MAC vendor (OUI) lookup for discovered clients.
+
+Assignments are held in one sorted ``array`` of prefixes per block size
+(MA-S 36 bit, MA-M 28 bit, MA-L 24 bit) with a parallel array of vendor
+indexes, and looked up with bisect, longest block first. Vendor names are
+canonicalised once when the table is loaded, so every lookup returns the
+same spelling for a vendor whatever the IEEE registry or the controller
+calls it.
+
+The bundled table (``data/oui.tsv``) holds the IEEE MA-L and IAB
+registries as of May 2024; MA-M and MA-S assignments, and anything newer,
+are not in it. For those, download the IEEE registry files (``oui.csv``,
+``mam.csv``, ``oui36.csv``, or the ``.txt`` versions) and either point the
+``oui_database`` plugin setting at one of them, or rebuild the bundled
+table:
+
+    python oui.py oui.csv mam.csv oui36.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+logger = logging.getLogger('nb_udm_plugin.oui')
+
+BUNDLED_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'oui.tsv')
+
+# Block size in bits by the number of hex digits in a prefix
+PREFIX_BITS = {6: 24, 7: 28, 9: 36}
+
+# Registry names (after suffix stripping) and controller 'oui' strings -> canonical vendor
+CANONICAL_VENDORS = {
+    'apple': 'Apple',
+    'applecomputer': 'Apple',
+    'ubiquiti': 'Ubiquiti',
+    'ubiquitinetworks': 'Ubiquiti',
+    'samsungelectronics': 'Samsung',
+    'samsungelectro': 'Samsung',
+    'samsung': 'Samsung',
+    'intel': 'Intel',
+    'intelcorporate': 'Intel',
+    'intelcor': 'Intel',
+    'raspberrypi': 'Raspberry Pi',
+    'raspberrypifoundation': 'Raspberry Pi',
+    'raspberrypitrading': 'Raspberry Pi',
+    'raspberr': 'Raspberry Pi',
+    'espressif': 'Espressif',
+    'espressifinc': 'Espressif',
+    'cisco': 'Cisco',
+    'ciscosystems': 'Cisco',
+    'vmware': 'VMware',
+    'microsoft': 'Microsoft',
+    'google': 'Google',
+    'amazontechnologies': 'Amazon',
+    'amazon': 'Amazon',
+    'sonos': 'Sonos',
+    'hewlettpackard': 'HP',
+    'hewlettpackardenterprise': 'HPE',
+    'dell': 'Dell',
+    'lenovo': 'Lenovo',
+    'honhaiprecisionind': 'Foxconn',
+    'honhaiprecisionindustry': 'Foxconn',
+    'honhaipr': 'Foxconn',
+    'tplinktechnologies': 'TP-Link',
+    'tplink': 'TP-Link',
+    'synology': 'Synology',
+}
+
+_SUFFIX_RE = re.compile(
+    r'[\s,.]+(inc|incorporated|corp|corporation|co|company|ltd|limited|llc|gmbh|ag|sa|bv|'
+    r'plc|oy|ab|as|srl|spa|pte|pty|kg|technologies|technology|electronics)\b\.?$',
+    re.IGNORECASE,
+)
+
+
+def _vendor_key(name):
+    """Lowercased alphanumerics of a vendor name with trailing company suffixes removed."""
+    name = name.strip()
+    while True:
+        stripped = _SUFFIX_RE.sub('', name)
+        if stripped == name:
+            break
+        name = stripped
+    return re.sub(r'[^0-9a-z]', '', name.lower())
+
+
+@lru_cache(maxsize=4096)
+def canonical_vendor(name):
+    """Canonical spelling of a vendor name from the IEEE registry or a controller."""
+    if not name:
+        return ''
+    key = _vendor_key(name)
+    canonical = CANONICAL_VENDORS.get(key) or CANONICAL_VENDORS.get(re.sub(r'[^0-9a-z]', '', name.lower()))
+    if canonical:
+        return canonical
+    # Drop trailing company suffixes but keep the registry's spelling otherwise
+    name = name.strip()
+    while True:
+        stripped = _SUFFIX_RE.sub('', name)
+        if stripped == name:
+            return name.strip(' ,.') or name
+        name = stripped
+
+
+def mac_to_int(mac):
+    """48-bit integer value of a MAC in any of the usual notations, or None."""
+    digits = mac.replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+class OUITable:
+    """Sorted prefix arrays per block size with bisect lookup."""
+
+    def __init__(self, entries=()):
+        vendors = {}
+        blocks = {}  # bits -> {prefix: vendor index}
+        for prefix, vendor in entries:
+            bits = PREFIX_BITS.get(len(prefix))
+            if bits is None:
+                continue
+            index = vendors.setdefault(canonical_vendor(vendor), len(vendors))
+            blocks.setdefault(bits, {})[int(prefix, 16)] = index
+
+        self.vendors = list(vendors)
+        self._blocks = []  # (shift, prefixes, vendor indexes), longest block first
+        for bits in sorted(blocks, reverse=True):
+            ordered = sorted(blocks[bits].items())
+            self._blocks.append((
+                48 - bits,
+                array('Q', (prefix for prefix, _ in ordered)),
+                array('I', (index for _, index in ordered)),
+            ))
+
+    def __len__(self):
+        return sum(len(prefixes) for _, prefixes, _ in self._blocks)
+
+    def lookup(self, mac):
+        """Canonical vendor for a MAC, or '' for unknown and locally administered MACs."""
+        value = mac_to_int(mac) if isinstance(mac, str) else mac
+        # Randomised/private MACs have the locally administered bit set
+        if value is None or value >> 40 & 0x02:
+            return ''
+        for shift, prefixes, indexes in self._blocks:
+            key = value >> shift
+            position = bisect_right(prefixes, key) - 1
+            if position >= 0 and prefixes[position] == key:
+                return self.vendors[indexes[position]]
+        return ''
+
+
+# Registry organisations that are not vendors (keys as from _vendor_key): MA-L
+# blocks the IEEE splits into MA-M/MA-S assignments, and private registrations
+UNASSIGNED_VENDORS = frozenset({'ieeeregistrationauthority', 'private'})
+
+# IEEE registry text format: a "(hex)" line with the MA-L block, then a
+# "(base 16)" line with the assignment (a range within the block for MA-M/MA-S/IAB)
+_TXT_HEX_RE = re.compile(r'^([0-9A-F]{2})-([0-9A-F]{2})-([0-9A-F]{2})\s+\(hex\)', re.IGNORECASE)
+_TXT_BASE16_RE = re.compile(r'^([0-9A-F]{6})(?:-([0-9A-F]{6}))?\s+\(base 16\)\s+(.*\S)', re.IGNORECASE)
+
+
+def _read_ieee_text(fh):
+    """Yield (hex prefix, vendor) from an IEEE registry text file (oui.txt, mam.txt, oui36.txt, iab.txt)."""
+    block = ''
+    for line in fh:
+        match = _TXT_HEX_RE.match(line)
+        if match:
+            block = ''.join(match.groups()).upper()
+            continue
+        match = _TXT_BASE16_RE.match(line)
+        if not match or not block:
+            continue
+        start, end, vendor = match.groups()
+        start = start.upper()
+        if end:
+            # Keep the digits of the range start that are not 0..F wildcards
+            digits = 6
+            while digits and start[digits - 1] == '0' and end[digits - 1].upper() == 'F':
+                digits -= 1
+            yield block + start[:digits], vendor.strip()
+        else:
+            yield start, vendor.strip()
+        block = ''
+
+
+def _read_ieee_csv(fh):
+    """Yield (hex prefix, vendor) from an IEEE registry CSV (oui.csv, mam.csv, oui36.csv)."""
+    # Registry,Assignment,Organization Name,Organization Address
+    for row in csv.DictReader(fh):
+        prefix = (row.get('Assignment') or '').strip().upper()
+        vendor = (row.get('Organization Name') or '').strip()
+        if prefix and vendor:
+            yield prefix, vendor
+
+
+def read_entries(path):
+    """
+    Yield (hex prefix, vendor) from an IEEE registry CSV or text file, or a compact table.
+
+    Registry entries in UNASSIGNED_VENDORS are skipped.
+    """
+    with open(path, encoding='utf-8', newline='') as fh:
+        first = fh.readline()
+        fh.seek(0)
+        if first.startswith('Registry,') or 'Organization' in first:
+            entries = _read_ieee_csv(fh) if first.startswith('Registry,') else _read_ieee_text(fh)
+            for prefix, vendor in entries:
+                if _vendor_key(vendor) not in UNASSIGNED_VENDORS:
+                    yield prefix, vendor
+            return
+        for line in fh:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            prefix, _, vendor = line.partition('\t')
+            if vendor:
+                yield prefix.upper(), vendor
+
+
+def write_table(entries, path):
+    """Write entries as a compact, sorted, canonicalised table file."""
+    rows = sorted({prefix: canonical_vendor(vendor) for prefix, vendor in entries}.items())
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write('# OUI prefix (hex, 6/7/9 digits)\tvendor\n')
+        for prefix, vendor in rows:
+            fh.write(f'{prefix}\t{vendor}\n')
+    return len(rows)
+
+
+def load_table(path=None):
+    """Load an OUITable from a table or IEEE CSV file (default: the bundled table)."""
+    path = path or BUNDLED_TABLE
+    try:
+        return OUITable(read_entries(path))
+    except OSError as e:
+        logger.warning(f'Could not read OUI table {path}: {e}')
+        return OUITable()
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    """Process-wide OUITable, loaded on first use from the ``oui_database`` setting or the bundled table."""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                path = ''
+                try:
+                    from netbox.plugins import get_plugin_config
+                    path = get_plugin_config('nb_udm_plugin', 'oui_database')
+                except ImportError:
+                    pass
+                _table = load_table(path)
+                logger.debug(f'Loaded {len(_table)} OUI assignments')
+    return _table
+
+
+def lookup_vendor(mac):
+    """Canonical vendor for a MAC from the process-wide table, or ''."""
+    return get_table().lookup(mac)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild the bundled OUI table from IEEE registry files')
+    parser.add_argument('csv', nargs='+', help='IEEE MA-L/MA-M/MA-S CSV or text files (oui.csv, mam.csv, oui36.csv)')
+    parser.add_argument('-o', '--output', default=BUNDLED_TABLE, help='table file to write')
+    args = parser.parse_args(argv)
+
+    entries = (entry for path in args.csv for entry in read_entries(path))
+    count = write_table(entries, args.output)
+    print(f'Wrote {count} assignments to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
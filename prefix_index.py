@@ -0,0 +1,105 @@
+"""
+Longest-prefix-match index used to give discovered IPs their real mask.
+
+Built once per scan from the NetBox prefixes (the source's VRF plus the
+global table); each scanned UniFi site adds a small index of its network
+subnets on top of it (see ``parent``). Networks are held in one hash table
+per (VRF, IP version, prefix length), so a lookup is at most one set probe
+per prefix length in use, longest first.
+"""
+import ipaddress
+import logging
+
+logger = logging.getLogger('nb_udm_plugin.prefix_index')
+
+
+class PrefixIndex:
+    """
+    IPv4/IPv6 networks by VRF, answering "which prefix length contains this IP".
+
+    With a ``parent`` index, lookups also search the parent and return the
+    longer of the two matches.
+    """
+
+    def __init__(self, vrf_id=None, parent=None):
+        self.vrf_id = vrf_id
+        self.parent = parent
+        self._tables = {}   # (vrf_id, version) -> {prefix length: {network int}}
+        self._lengths = {}  # (vrf_id, version) -> prefix lengths, longest first
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, network, vrf_id=None):
+        """Add a network (CIDR string or ip_network; host bits are ignored)."""
+        try:
+            network = ipaddress.ip_network(str(network), strict=False)
+        except ValueError:
+            logger.debug(f'Ignoring invalid network {network!r}')
+            return
+        key = (vrf_id, network.version)
+        table = self._tables.setdefault(key, {})
+        table.setdefault(network.prefixlen, set()).add(int(network.network_address))
+        self._lengths.pop(key, None)
+        self._count += 1
+
+    def prefix_length(self, ip, vrf_id=None):
+        """
+        Return the length of the longest prefix containing ip, or None.
+
+        Looks in ``vrf_id`` (default: the index's VRF) first, then in the
+        global table.
+        """
+        length = self._own_prefix_length(ip, vrf_id)
+        if self.parent is not None:
+            parent_length = self.parent.prefix_length(ip, vrf_id)
+            if length is None or (parent_length is not None and parent_length > length):
+                length = parent_length
+        return length
+
+    def _own_prefix_length(self, ip, vrf_id=None):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        vrf_id = self.vrf_id if vrf_id is None else vrf_id
+        value = int(address)
+        bits = address.max_prefixlen
+
+        for vrf in (vrf_id, None) if vrf_id is not None else (None,):
+            key = (vrf, address.version)
+            table = self._tables.get(key)
+            if not table:
+                continue
+            lengths = self._lengths.get(key)
+            if lengths is None:
+                lengths = self._lengths[key] = sorted(table, reverse=True)
+            for length in lengths:
+                shift = bits - length
+                if value >> shift << shift in table[length]:
+                    return length
+        return None
+
+
+def resolve_vrf_id(name):
+    """Primary key of the NetBox VRF with this name, or None."""
+    if not name:
+        return None
+    from ipam.models import VRF
+    return VRF.objects.filter(name=name).values_list('pk', flat=True).first()
+
+
+def load_prefix_index(vrf_name=''):
+    """Build a PrefixIndex holding the NetBox prefixes of a VRF (by name) and the global table."""
+    from django.db.models import Q
+    from ipam.models import Prefix
+
+    vrf_id = resolve_vrf_id(vrf_name)
+    index = PrefixIndex(vrf_id)
+    scope = Q(vrf__isnull=True)
+    if vrf_id is not None:
+        scope |= Q(vrf_id=vrf_id)
+    for prefix, prefix_vrf_id in Prefix.objects.filter(scope).values_list('prefix', 'vrf_id'):
+        index.add(prefix, prefix_vrf_id)
+    return index
@@ -2,89 +2,454 @@
 Reconciliation engine — matches discovered objects against NetBox,
 computes diffs, and applies approved results.
 """
+import hashlib
+import json
 import logging
+from collections import defaultdict
+from dataclasses import dataclass
 
 from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import F, QuerySet
 from django.utils import timezone
 from django.utils.text import slugify
 
 from dcim.models import Device, DeviceRole, DeviceType, Interface, MACAddress, Manufacturer, Site
 from ipam.models import IPAddress, VLAN, VLANGroup
+from netbox.plugins import get_plugin_config
 
 from .choices import ResultActionChoices, ResultStatusChoices
 from .models import DiscoveryMapping, DiscoveryResult
+from .oui import mac_to_int
 
 logger = logging.getLogger('nb_udm_plugin.reconciliation')
 
+# Results applied per transaction by apply_results
+APPLY_BATCH_SIZE = 500
 
-def reconcile(source, scan_job, discovered_objects):
+
+def _host(value):
+    """Host part of an IP with or without a mask."""
+    return str(value).split('/')[0] if value else ''
+
+
+def _slug(value):
+    return slugify(value) if value else ''
+
+
+def _mac(value):
+    return mac_to_int(str(value)) if value else None
+
+
+def _device_type_key(value):
+    manufacturer, model = value
+    return _slug(manufacturer), model
+
+
+@dataclass(frozen=True)
+class DiffField:
+    """
+    One field compared by the diff engine.
+
+    ``path`` is a values() path (or a tuple of them) on the matched NetBox
+    model and ``data_key`` the discovered data key(s) it is compared with,
+    after ``normalize`` is applied to both sides. A field is only compared
+    when the discovered value is set; with ``must_exist``, only when a
+    NetBox object of that model has the proposed name. ``related`` reads
+    the NetBox value from a related row instead, as (model, foreign key
+    field, filters, values path); objects without such a row are not
+    compared.
+    """
+    key: str
+    path: str | tuple = ''
+    data_key: str | tuple = ''
+    normalize: object = None
+    must_exist: object = None
+    related: tuple = None
+
+
+# Compared fields per discovered type, and the NetBox model each type matches
+FIELD_SPEC = {
+    'device': (
+        DiffField('name', 'name', 'name'),
+        DiffField('serial', 'serial', 'serial'),
+        DiffField('site', 'site__name', 'site_name', must_exist=Site),
+        DiffField('role', 'role__name', 'role', normalize=_slug),
+        DiffField(
+            'device_type',
+            ('device_type__manufacturer__name', 'device_type__model'),
+            ('manufacturer', 'model'),
+            normalize=_device_type_key,
+        ),
+        DiffField('primary_ip4', 'primary_ip4__address', 'ip', normalize=_host),
+        DiffField(
+            'mac',
+            data_key='mac',
+            normalize=_mac,
+            related=(Interface, 'device_id', {'name': 'mgmt'}, 'primary_mac_address__mac_address'),
+        ),
+    ),
+    'vlan': (
+        DiffField('name', 'name', 'name'),
+    ),
+    'ip_address': (
+        DiffField('description', 'description', 'description'),
+        DiffField('dns_name', 'dns_name', 'dns_name'),
+    ),
+}
+SPEC_MODELS = {'device': Device, 'vlan': VLAN, 'ip_address': IPAddress}
+SPEC_TYPES = {model: object_type for object_type, model in SPEC_MODELS.items()}
+
+
+def _paths(spec):
+    """values() paths of the fields read from the matched model itself."""
+    paths = []
+    for field in spec:
+        if not field.related:
+            paths.extend(field.path if isinstance(field.path, tuple) else (field.path,))
+    return tuple(paths)
+
+
+def _load_netbox_values(spec, model, pks):
+    """
+    Read the fields of spec for model's objects in pks.
+
+    One values() query on the model plus one per related field. Returns the
+    values() rows by pk and the related values by field key, then by pk.
+    """
+    rows = {row['pk']: row for row in model.objects.filter(pk__in=pks).values('pk', *_paths(spec))}
+    related = {}
+    for field in spec:
+        if field.related:
+            related_model, fk, filters, path = field.related
+            values = {}
+            for pk, value in related_model.objects.filter(**{f'{fk}__in': pks}, **filters).values_list(fk, path):
+                values.setdefault(pk, value)
+            related[field.key] = values
+    return rows, related
+
+
+def fingerprint(value):
+    """Stable hash of a JSON-serializable value."""
+    payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _netbox_fingerprint(spec, row, related, pk):
+    """Fingerprint of every field of spec, related ones included, as read by _load_netbox_values."""
+    values = [row[path] for path in _paths(spec)]
+    values.extend(related[field.key].get(pk) for field in spec if field.related)
+    return fingerprint(values)
+
+
+def netbox_fingerprints(model, pks):
+    """
+    Fingerprints of the NetBox fields the diff engine compares, by pk.
+
+    They are stored on the mapping (netbox_fingerprint) so NetBox-side edits
+    invalidate a fingerprint skip. Returns {} for models without a FIELD_SPEC.
+    """
+    object_type = SPEC_TYPES.get(model)
+    if object_type is None or not pks:
+        return {}
+    spec = FIELD_SPEC[object_type]
+    rows, related = _load_netbox_values(spec, model, pks)
+    return {pk: _netbox_fingerprint(spec, row, related, pk) for pk, row in rows.items()}
+
+
+def reconcile(source, scan_job, discovered_objects, kinds=None):
     """
     Compare discovered objects against NetBox and create DiscoveryResult records.
 
     Returns list of DiscoveryResult instances (not yet saved).
     """
-    results = []
-    seen_keys = set()
+    return [
+        result
+        for chunk in reconcile_chunks(source, scan_job, discovered_objects, kinds=kinds)
+        for result in chunk
+    ]
+
+
+def reconcile_chunks(source, scan_job, discovered_objects, chunk_size=500, kinds=None, orphans=True):
+    """
+    Reconcile a stream of discovered objects, yielding lists of unsaved DiscoveryResults.
+
+    At most ``chunk_size`` discovered objects are reconciled per yielded
+    chunk, so a caller that saves and drops each chunk holds only one chunk
+    of results at a time. Each chunk stamps its mappings with scan_job as
+    their last_seen_scan; orphans are marked once the stream is exhausted.
+
+    Objects whose data and NetBox fingerprints still match their mapping
+    are skipped without any per-object queries. ``kinds`` names the object
+    types that were scanned; only their mappings can become orphans. With
+    ``orphans=False`` (a partial scan, such as one site shard) the caller
+    runs mark_orphans once every part of the scan is done.
+    """
+    chunk = []
 
     for obj in discovered_objects:
-        result = _reconcile_one(source, scan_job, obj)
-        if result:
-            results.append(result)
-        seen_keys.add(obj.identity_key)
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield _reconcile_chunk(source, scan_job, chunk)
+            chunk = []
 
-    # Mark orphans
-    DiscoveryMapping.objects.filter(
-        source=source,
-    ).exclude(
-        identity_key__in=seen_keys,
-    ).update(is_orphan=True)
+    if chunk:
+        yield _reconcile_chunk(source, scan_job, chunk)
 
-    # Clear orphan flag for seen keys
-    DiscoveryMapping.objects.filter(
-        source=source,
-        identity_key__in=seen_keys,
-    ).update(is_orphan=False, last_seen=timezone.now())
+    if orphans:
+        mark_orphans(source, scan_job, kinds)
+        supersede_stale_results(source, scan_job, kinds)
 
-    return results
 
+# Fields a scan refreshes on the live pending result of an identity
+REFRESHED_RESULT_FIELDS = (
+    'scan_job', 'previous_scan_job', 'discovered_type', 'scan_kind', 'discovered_data',
+    'proposed_data', 'matched_object_type', 'matched_object_id', 'diff', 'action', 'last_updated',
+)
 
-def _reconcile_one(source, scan_job, discovered):
-    """Reconcile a single discovered object."""
-    existing = _find_match(source, discovered)
 
-    if existing:
-        diff = _compute_diff(existing, discovered)
-        if not diff:
-            # No changes — skip
-            return None
-        return DiscoveryResult(
-            scan_job=scan_job,
+def save_results(source, results):
+    """
+    Save a chunk of results, refreshing existing pending results in place.
+
+    Each (source, identity_key) has at most one pending result. When the
+    identity already has one, it is updated with the new scan's data,
+    diff and scan_job, and its previous scan job is kept as
+    previous_scan_job; otherwise a new row is inserted. One query looks up
+    the live rows, then one bulk insert and one bulk update save the chunk.
+
+    If another scan of the source inserts a pending result for one of the
+    identities in between, the bulk insert violates the one-pending
+    constraint and is rolled back; the new results are then saved one by
+    one, refreshing the rows that won the race.
+    """
+    # The last result for an identity wins within a chunk
+    results = list({result.identity_key: result for result in results}.values())
+    if not results:
+        return
+    live = {
+        key: (pk, scan_job_id)
+        for key, pk, scan_job_id in DiscoveryResult.objects.filter(
             source=source,
-            discovered_type=discovered.object_type,
-            discovered_data=discovered.raw_data,
-            proposed_data=discovered.data,
-            matched_object_type=ContentType.objects.get_for_model(existing),
-            matched_object_id=existing.pk,
-            diff=diff,
             status=ResultStatusChoices.STATUS_PENDING,
-            action=ResultActionChoices.ACTION_UPDATE,
-            identity_key=discovered.identity_key,
-        )
-    else:
-        return DiscoveryResult(
-            scan_job=scan_job,
+            identity_key__in=[result.identity_key for result in results],
+        ).values_list('identity_key', 'pk', 'scan_job_id')
+    }
+
+    new, refreshed = [], []
+    now = timezone.now()
+    for result in results:
+        if result.identity_key in live:
+            result.pk, result.previous_scan_job_id = live[result.identity_key]
+            result.last_updated = now
+            refreshed.append(result)
+        else:
+            new.append(result)
+
+    if new:
+        try:
+            with transaction.atomic():
+                DiscoveryResult.objects.bulk_create(new, batch_size=100)
+        except IntegrityError:
+            logger.info(f'Pending results of {source.name} were saved concurrently, saving them one by one')
+            for result in new:
+                _save_pending_result(result, now)
+    if refreshed:
+        DiscoveryResult.objects.bulk_update(refreshed, REFRESHED_RESULT_FIELDS, batch_size=100)
+
+
+def _save_pending_result(result, now):
+    """Insert a result, or refresh the identity's pending result if another scan inserted one first."""
+    # Undo what the rolled-back bulk insert may have set
+    result.pk = None
+    result._state.adding = True
+    try:
+        with transaction.atomic():
+            result.save(force_insert=True)
+        return
+    except IntegrityError:
+        pass
+    result.pk, result.previous_scan_job_id = DiscoveryResult.objects.filter(
+        source=result.source_id,
+        status=ResultStatusChoices.STATUS_PENDING,
+        identity_key=result.identity_key,
+    ).values_list('pk', 'scan_job_id').get()
+    result._state.adding = False
+    result.last_updated = now
+    result.save(update_fields=REFRESHED_RESULT_FIELDS)
+
+
+def supersede_stale_results(source, scan_job, kinds=None):
+    """
+    Close out pending results a completed scan did not refresh.
+
+    Their object is now in sync with NetBox or no longer discovered, so they
+    are marked superseded with one UPDATE. With ``kinds``, only results of
+    those scan kinds are closed.
+    """
+    stale = DiscoveryResult.objects.filter(
+        source=source,
+        status=ResultStatusChoices.STATUS_PENDING,
+    ).exclude(scan_job=scan_job.pk)
+    if kinds is not None:
+        stale = stale.filter(scan_kind__in=kinds)
+    count = stale.update(status=ResultStatusChoices.STATUS_SUPERSEDED, last_updated=timezone.now())
+    if count:
+        logger.info(f'Superseded {count} stale pending result(s) of {source.name}')
+
+
+def discard_results(scan_jobs):
+    """
+    Take the pending results of failed scan jobs out of review.
+
+    A scan that fails part-way has only saved some of its chunks, so the
+    results it inserted are marked discarded rather than left approvable.
+    Pending results of earlier scans that it only refreshed (see
+    save_results) were approvable before it started and stay pending,
+    handed back to their previous scan job. The next successful scan
+    proposes any change that still applies. Returns the number of results
+    discarded.
+    """
+    pending = DiscoveryResult.objects.filter(
+        scan_job__in=scan_jobs,
+        status=ResultStatusChoices.STATUS_PENDING,
+    )
+    now = timezone.now()
+    pending.filter(previous_scan_job__isnull=False).update(scan_job=F('previous_scan_job'), last_updated=now)
+    count = pending.filter(previous_scan_job__isnull=True).update(
+        status=ResultStatusChoices.STATUS_DISCARDED, last_updated=now,
+    )
+    if count:
+        logger.info(f'Discarded {count} pending result(s) of failed scan(s)')
+    return count
+
+
+def _reconcile_chunk(source, scan_job, chunk):
+    """Reconcile a chunk of discovered objects, skipping unchanged ones."""
+    data_fingerprints = {obj.identity_key: fingerprint(obj.data) for obj in chunk}
+    mappings = {
+        row[0]: row[1:]
+        for row in DiscoveryMapping.objects.filter(
             source=source,
-            discovered_type=discovered.object_type,
-            discovered_data=discovered.raw_data,
-            proposed_data=discovered.data,
-            diff={},
-            status=ResultStatusChoices.STATUS_PENDING,
-            action=ResultActionChoices.ACTION_CREATE,
-            identity_key=discovered.identity_key,
+            identity_key__in=data_fingerprints,
+        ).values_list('identity_key', 'pk', 'data_fingerprint', 'netbox_fingerprint',
+                      'netbox_object_type_id', 'netbox_object_id')
+    }
+    unchanged = _unchanged_keys(mappings, data_fingerprints)
+    index = MatchIndex(
+        source,
+        [obj for obj in chunk if obj.identity_key not in unchanged],
+        mapping_ids=[row[0] for key, row in mappings.items() if key not in unchanged],
+    )
+    if index.dangling:
+        logger.warning(
+            f'{len(index.dangling)} mapping(s) of {source.name} point at deleted NetBox objects '
+            f'(filter mappings with dangling=true to clean them up)'
         )
 
+    matches = [
+        (obj, _find_match(source, obj, index))
+        for obj in chunk if obj.identity_key not in unchanged
+    ]
+    diffs = diff_batch([(obj, existing) for obj, existing in matches if existing is not None])
 
-def _find_match(source, discovered):
+    results = []
+    in_sync = []
+    for obj, existing in matches:
+        if existing is None:
+            results.append(_make_result(source, scan_job, obj))
+            continue
+        diff, netbox_fp = diffs.get(id(obj), ({}, ''))
+        if diff:
+            results.append(_make_result(source, scan_job, obj, existing, diff))
+        elif obj.identity_key in mappings:
+            in_sync.append(DiscoveryMapping(
+                pk=mappings[obj.identity_key][0],
+                data_fingerprint=data_fingerprints[obj.identity_key],
+                netbox_fingerprint=netbox_fp,
+            ))
+
+    # Every mapped object of the chunk was seen by this scan
+    if mappings:
+        DiscoveryMapping.objects.filter(pk__in=[row[0] for row in mappings.values()]).update(
+            last_seen_scan=scan_job.pk,
+            miss_count=0,
+            is_orphan=False,
+            last_seen=timezone.now(),
+        )
+
+    # Remember what matched so the next scan can skip these objects
+    if in_sync:
+        DiscoveryMapping.objects.bulk_update(in_sync, ['data_fingerprint', 'netbox_fingerprint'])
+    if unchanged:
+        logger.debug(f'Skipped {len(unchanged)} unchanged object(s)')
+
+    return results
+
+
+def _unchanged_keys(mappings, data_fingerprints):
+    """
+    Return the identity keys whose data and NetBox fingerprints both still match.
+
+    The NetBox side is re-hashed with netbox_fingerprints(): one values()
+    query per model plus one per related field.
+    """
+    candidates = defaultdict(dict)
+    for key, (_, data_fp, netbox_fp, ct_id, object_id) in mappings.items():
+        if netbox_fp and data_fp == data_fingerprints[key]:
+            candidates[ct_id][object_id] = (key, netbox_fp)
+
+    unchanged = set()
+    for ct_id, objects in candidates.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        for pk, current_fp in netbox_fingerprints(model, list(objects)).items():
+            key, netbox_fp = objects[pk]
+            if current_fp == netbox_fp:
+                unchanged.add(key)
+    return unchanged
+
+
+def mark_orphans(source, scan_job, kinds=None):
+    """
+    Count a miss for the source's mappings this scan did not see, and flag orphans.
+
+    Mappings not stamped with scan_job as their last_seen_scan get their
+    miss_count incremented; those that have now missed ``orphan_grace_scans``
+    (plugin setting) scans in a row become orphans. Both are single UPDATEs
+    on an indexed column, whatever the number of mappings. With ``kinds``,
+    only mappings of those scan kinds are counted.
+    """
+    grace = max(1, int(get_plugin_config('nb_udm_plugin', 'orphan_grace_scans')))
+    missed = DiscoveryMapping.objects.filter(source=source).exclude(last_seen_scan=scan_job.pk)
+    if kinds is not None:
+        missed = missed.filter(scan_kind__in=kinds)
+
+    missed.update(miss_count=F('miss_count') + 1)
+    missed.filter(miss_count__gte=grace, is_orphan=False).update(is_orphan=True)
+
+
+def _make_result(source, scan_job, discovered, existing=None, diff=None):
+    """Unsaved DiscoveryResult proposing to create (no existing object) or update an object."""
+    result = DiscoveryResult(
+        scan_job=scan_job,
+        source=source,
+        discovered_type=discovered.object_type,
+        discovered_data=discovered.raw_data,
+        proposed_data=discovered.data,
+        diff=diff or {},
+        status=ResultStatusChoices.STATUS_PENDING,
+        action=ResultActionChoices.ACTION_CREATE,
+        identity_key=discovered.identity_key,
+        scan_kind=discovered.kind,
+    )
+    if existing is not None:
+        result.matched_object_type = ContentType.objects.get_for_model(existing)
+        result.matched_object_id = existing.pk
+        result.action = ResultActionChoices.ACTION_UPDATE
+    return result
+
+
+def _find_match(source, discovered, index=None):
     """
     Try to find an existing NetBox object matching the discovered data.
 
@@ -94,162 +459,533 @@ def _find_match(source, discovered):
     3. MAC address match (devices)
     4. Name + site match (devices)
     5. VID + site match (VLANs)
-    6. IP address match (IP addresses)
+    6. IP address match (IP addresses), on the host part whatever the mask
+
+    All lookups go through a MatchIndex; without one, an index is built for
+    this object alone.
     """
+    if index is None:
+        index = MatchIndex(source, [discovered])
+
     # 1. Existing mapping
-    mapping = DiscoveryMapping.objects.filter(
-        source=source,
-        identity_key=discovered.identity_key,
-    ).first()
-    if mapping:
-        try:
-            return mapping.netbox_object
-        except Exception:
-            pass
+    existing = index.mapped.get(discovered.identity_key)
+    if existing is not None:
+        return existing
 
     data = discovered.data
 
     if discovered.object_type == 'device':
         # 2. Serial match
         serial = data.get('serial')
-        if serial:
-            device = Device.objects.filter(serial=serial).first()
-            if device:
-                return device
+        if serial and serial in index.by_serial:
+            return index.by_serial[serial]
 
         # 3. MAC match via MACAddress model
-        mac = data.get('mac')
-        if mac:
-            mac_obj = MACAddress.objects.filter(mac_address=mac).first()
-            if mac_obj and mac_obj.assigned_object and hasattr(mac_obj.assigned_object, 'device'):
-                return mac_obj.assigned_object.device
+        mac = mac_to_int(data.get('mac') or '')
+        if mac is not None and mac in index.by_mac:
+            return index.by_mac[mac]
 
         # 4. Name + site
         name = data.get('name')
-        site_name = data.get('site_name')
         if name:
-            qs = Device.objects.filter(name=name)
-            if site_name:
-                qs = qs.filter(site__name=site_name)
-            device = qs.first()
-            if device:
+            device = index.by_name.get((name, data.get('site_name') or None))
+            if device is not None:
                 return device
 
     elif discovered.object_type == 'vlan':
         vid = data.get('vid')
-        site_name = data.get('site_name')
         if vid:
-            qs = VLAN.objects.filter(vid=vid)
-            if site_name:
-                qs = qs.filter(site__name=site_name)
-            vlan = qs.first()
-            if vlan:
+            vlan = index.by_vid.get((vid, data.get('site_name') or None))
+            if vlan is not None:
                 return vlan
 
     elif discovered.object_type == 'ip_address':
         ip = data.get('ip')
-        prefix_len = data.get('prefix_length', 24)
         if ip:
-            ip_obj = IPAddress.objects.filter(
-                address=f'{ip}/{prefix_len}',
-            ).first()
-            if ip_obj:
-                return ip_obj
+            return index.by_ip.get((ip, data.get('vrf', '')))
 
     return None
 
 
-def _compute_diff(existing, discovered):
-    """Compute field-level diff between existing NetBox object and discovered data."""
-    diff = {}
-    data = discovered.data
-
-    if discovered.object_type == 'device':
-        if data.get('name') and existing.name != data['name']:
-            diff['name'] = {'current': existing.name, 'proposed': data['name']}
-        if data.get('ip'):
-            current_ip = str(existing.primary_ip4).split('/')[0] if existing.primary_ip4 else ''
-            if current_ip != data['ip']:
-                diff['primary_ip4'] = {'current': current_ip, 'proposed': data['ip']}
-
-    elif discovered.object_type == 'vlan':
-        if data.get('name') and existing.name != data['name']:
-            diff['name'] = {'current': existing.name, 'proposed': data['name']}
-
-    elif discovered.object_type == 'ip_address':
-        if data.get('description') and existing.description != data['description']:
-            diff['description'] = {'current': existing.description, 'proposed': data['description']}
-        dns = data.get('dns_name', '')
-        if dns and existing.dns_name != dns:
-            diff['dns_name'] = {'current': existing.dns_name, 'proposed': dns}
-
-    return diff
-
+class MatchIndex:
+    """
+    Candidate NetBox objects for a batch of discovered objects, loaded in bulk.
+
+    Mapped objects (DiscoveryMapping.objects.with_targets(): one query for
+    the mappings plus one per NetBox model), devices by serial, devices
+    by MAC (two queries), devices by name, VLANs by VID and IPs by host are
+    each fetched with one ``__in`` query over the batch, so the number of
+    queries does not grow with the batch size. Lookups keep the ordering of
+    the per-object queries they replace: the first row in the model's
+    default ordering wins.
+    """
 
-def apply_result(result):
+    def __init__(self, source, discovered, mapping_ids=None):
+        serials, macs, names, vids, hosts = set(), set(), set(), set(), set()
+        for obj in discovered:
+            data = obj.data
+            if obj.object_type == 'device':
+                if data.get('serial'):
+                    serials.add(data['serial'])
+                if mac_to_int(data.get('mac') or '') is not None:
+                    macs.add(data['mac'])
+                if data.get('name'):
+                    names.add(data['name'])
+            elif obj.object_type == 'vlan':
+                if data.get('vid'):
+                    vids.add(data['vid'])
+            elif obj.object_type == 'ip_address':
+                if data.get('ip'):
+                    hosts.add(data['ip'])
+
+        if mapping_ids is None:
+            mappings = DiscoveryMapping.objects.filter(
+                source=source,
+                identity_key__in=[obj.identity_key for obj in discovered],
+            )
+        elif mapping_ids:
+            mappings = DiscoveryMapping.objects.filter(pk__in=mapping_ids)
+        else:
+            mappings = DiscoveryMapping.objects.none()
+        self.mapped = {}
+        self.dangling = []  # pks of mappings whose NetBox object was deleted
+        for mapping in mappings.only('identity_key', 'netbox_object_type', 'netbox_object_id').with_targets():
+            if mapping.netbox_object is None:
+                self.dangling.append(mapping.pk)
+            else:
+                self.mapped[mapping.identity_key] = mapping.netbox_object
+        self.by_serial = self._first_by(
+            Device.objects.filter(serial__in=serials).select_related('primary_ip4'),
+            lambda device: device.serial,
+        ) if serials else {}
+        self.by_mac = self._load_mac_devices(macs) if macs else {}
+        self.by_name = self._first_by(
+            Device.objects.filter(name__in=names).select_related('site', 'primary_ip4'),
+            lambda device: (device.name, device.site.name if device.site else None),
+            lambda device: (device.name, None),
+        ) if names else {}
+        self.by_vid = self._first_by(
+            VLAN.objects.filter(vid__in=vids).select_related('site'),
+            lambda vlan: (vlan.vid, vlan.site.name if vlan.site else None),
+            lambda vlan: (vlan.vid, None),
+        ) if vids else {}
+        self.by_ip = self._first_by(
+            IPAddress.objects.filter(address__net_in=list(hosts)).select_related('vrf'),
+            lambda ip_obj: (str(ip_obj.address.ip), ip_obj.vrf.name if ip_obj.vrf else ''),
+        ) if hosts else {}
+
+    @staticmethod
+    def _first_by(queryset, *key_funcs):
+        """Index a queryset under each key function, keeping the first object per key."""
+        index = {}
+        for obj in queryset:
+            for key_func in key_funcs:
+                index.setdefault(key_func(obj), obj)
+        return index
+
+    @staticmethod
+    def _load_mac_devices(macs):
+        """Devices owning an interface with one of the MACs, keyed by MAC integer value."""
+        interface_type = ContentType.objects.get_for_model(Interface)
+        interface_macs = {}
+        for mac, ct_id, object_id in MACAddress.objects.filter(mac_address__in=macs).values_list(
+            'mac_address', 'assigned_object_type_id', 'assigned_object_id',
+        ):
+            # VM interfaces carry MACs too but have no device
+            if ct_id == interface_type.pk and object_id:
+                interface_macs.setdefault(mac_to_int(str(mac)), object_id)
+        if not interface_macs:
+            return {}
+
+        devices = {
+            interface.pk: interface.device
+            for interface in Interface.objects.filter(
+                pk__in=set(interface_macs.values()),
+            ).select_related('device', 'device__primary_ip4')
+        }
+        return {
+            mac: devices[interface_id]
+            for mac, interface_id in interface_macs.items()
+            if interface_id in devices
+        }
+
+
+def diff_batch(pairs):
     """
-    Apply an approved DiscoveryResult to NetBox.
+    Diff (discovered object, matched NetBox object) pairs by FIELD_SPEC.
 
-    Creates or updates the appropriate NetBox object and establishes
-    a DiscoveryMapping for future reconciliation.
+    NetBox values are read with one values() query per model, one per
+    related field and one per must_exist model, whatever the number of
+    pairs. Returns {id(discovered object): (diff, netbox fingerprint)};
+    diff maps each changed field to its current and proposed value.
+    """
+    by_type = defaultdict(list)
+    for discovered, existing in pairs:
+        if discovered.object_type in FIELD_SPEC and isinstance(existing, SPEC_MODELS[discovered.object_type]):
+            by_type[discovered.object_type].append((discovered, existing))
+
+    diffs = {}
+    for object_type, typed_pairs in by_type.items():
+        spec = FIELD_SPEC[object_type]
+        model = SPEC_MODELS[object_type]
+        pks = {existing.pk for _, existing in typed_pairs}
+        rows, related = _load_netbox_values(spec, model, pks)
+
+        known = {}
+        for field in spec:
+            if field.must_exist:
+                names = {discovered.data.get(field.data_key) for discovered, _ in typed_pairs} - {None, ''}
+                known[field.key] = set(
+                    field.must_exist.objects.filter(name__in=names).values_list('name', flat=True)
+                ) if names else set()
+
+        for discovered, existing in typed_pairs:
+            row = rows.get(existing.pk)
+            if row is None:
+                diffs[id(discovered)] = ({}, '')
+                continue
+            diff = {}
+            for field in spec:
+                current = _field_value(field, row, related, existing.pk)
+                proposed = _field_value(field, discovered.data)
+                if current is _MISSING or not _is_set(proposed):
+                    continue
+                if field.must_exist and proposed not in known[field.key]:
+                    continue
+                normalize = field.normalize or (lambda value: value)
+                if normalize(current) != normalize(proposed):
+                    diff[field.key] = {'current': _display(current), 'proposed': _display(proposed)}
+            diffs[id(discovered)] = (diff, _netbox_fingerprint(spec, row, related, existing.pk))
+    return diffs
+
+
+_MISSING = object()
+
+
+def _field_value(field, values, related=None, pk=None):
+    """Value of a field from a values() row or discovered data; _MISSING if it has no related row."""
+    if related is not None and field.related:
+        return related[field.key].get(pk, _MISSING)
+    keys = field.path if related is not None else field.data_key
+    if isinstance(keys, tuple):
+        return tuple(values.get(key) for key in keys)
+    return values.get(keys)
+
+
+def _is_set(value):
+    if isinstance(value, tuple):
+        return all(value)
+    return bool(value)
+
+
+def _display(value):
+    """JSON-friendly form of a compared value."""
+    if isinstance(value, tuple):
+        return ' '.join(str(part) for part in value if part)
+    if value is None:
+        return ''
+    if hasattr(value, 'ip'):
+        # Addresses show without their mask, as they are discovered
+        return str(value.ip)
+    return value if isinstance(value, (str, int)) else str(value)
+
+
+def apply_results(results, user=None, batch_size=APPLY_BATCH_SIZE):
+    """
+    Apply approved DiscoveryResults to NetBox and mark them approved.
+
+    Results are applied in batches of ``batch_size``, each in one
+    transaction and in dependency order: lookups (manufacturers, device
+    types, roles, sites, ...), then devices, VLANs and IPs, then management
+    interfaces, MACs and IPs, then primary IPs, and finally mappings and
+    tags. Existing objects are looked up per level in bulk, and mappings
+    are written with one bulk upsert; tags are added per object so they
+    are change-logged. If a batch fails it is rolled back and its results
+    are applied one by one, so one bad result does not block the others.
+
+    Returns (applied, errors): the NetBox object and the error message, by
+    result pk. Results in errors stay pending.
+    """
+    if isinstance(results, QuerySet):
+        pks = list(results.values_list('pk', flat=True))
+    else:
+        pks = [result.pk for result in results]
 
-    Returns the created/updated NetBox object.
+    applied, errors = {}, {}
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start:start + batch_size]
+        try:
+            applied.update(_apply_batch(batch, user, errors))
+        except Exception as e:
+            if len(batch) == 1:
+                errors[batch[0]] = str(e)
+                continue
+            logger.warning(f'Applying {len(batch)} results failed ({e}), applying them one by one')
+            for pk in batch:
+                try:
+                    applied.update(_apply_batch([pk], user, errors))
+                except Exception as e:
+                    logger.error(f'Failed to apply result {pk}: {e}')
+                    errors[pk] = str(e)
+    return applied, errors
+
+
+def _apply_batch(pks, user, errors):
     """
-    data = result.proposed_data
+    Apply the pending results among pks in one transaction.
 
-    if result.action == ResultActionChoices.ACTION_CREATE:
-        obj = _create_object(result.discovered_type, data, result.source)
-    elif result.action == ResultActionChoices.ACTION_UPDATE:
-        obj = _update_object(result.matched_object, result.discovered_type, data, result.diff)
-    else:
-        return None
+    Results that cannot be applied are recorded in errors and left pending:
+    results that are no longer pending, updates whose matched NetBox object
+    has been deleted, and results that produced no object.
+    """
+    batch = []
+    for result in DiscoveryResult.objects.filter(pk__in=pks).select_related(
+        'source', 'source__site',
+    ).with_matched_objects().order_by('pk'):
+        if result.status != ResultStatusChoices.STATUS_PENDING:
+            errors[result.pk] = f'Result is already {result.get_status_display()}'
+        elif result.action == ResultActionChoices.ACTION_UPDATE and result.matched_object is None:
+            errors[result.pk] = 'The matched NetBox object no longer exists; rescan to propose it again'
+        else:
+            batch.append(result)
+    if not batch:
+        return {}
+
+    memo = LookupMemo()
+    memo.preload(batch)
+    with transaction.atomic():
+        objects = _apply_plan(batch, memo)
+        for pk, obj in list(objects.items()):
+            if obj is None:
+                errors[pk] = 'Nothing to apply for this result'
+                del objects[pk]
+        DiscoveryResult.objects.filter(pk__in=objects).update(
+            status=ResultStatusChoices.STATUS_APPROVED,
+            reviewed_by=user,
+            reviewed_at=timezone.now(),
+        )
+    return objects
+
+
+def _apply_plan(batch, memo):
+    """Create/update the NetBox objects for a batch of results, level by level."""
+    objects = {}
+    device_ips = []  # (device, data, {'ip', 'mac'}) needing a management interface, IP or MAC
+    to_save = {}     # updated objects, saved once after their IP is assigned
+
+    # Devices, VLANs and IPs (their lookups come from the memo)
+    for result in batch:
+        data = result.proposed_data
+        obj = None
+        if result.action == ResultActionChoices.ACTION_CREATE:
+            obj = _create_object(result.discovered_type, data, result.source, memo)
+            if obj is not None and result.discovered_type == 'device' and data.get('ip'):
+                device_ips.append((obj, data, {'ip'}))
+        elif result.action == ResultActionChoices.ACTION_UPDATE:
+            obj = result.matched_object
+            if obj is not None:
+                _update_fields(obj, result.discovered_type, data, result.diff, result.source, memo)
+                to_save[(type(obj), obj.pk)] = obj
+                if result.discovered_type == 'device':
+                    fields = {'ip'} if 'primary_ip4' in result.diff and data.get('ip') else set()
+                    if 'mac' in result.diff and data.get('mac'):
+                        fields.add('mac')
+                    if fields:
+                        device_ips.append((obj, data, fields))
+        objects[result.pk] = obj
+
+    # Management interfaces, MACs, IPs and primary IPs
+    skipped = set()  # devices whose discovered IP or MAC could not be assigned
+    for device in _assign_device_ips(device_ips, memo, skipped):
+        to_save[(type(device), device.pk)] = device
+    for obj in to_save.values():
+        obj.save()
+        logger.info(f'Updated {obj._meta.model_name}: {obj}')
+
+    # Mappings and tags
+    _save_mappings(batch, objects, memo, skipped)
+    _tag_objects(batch, objects, memo)
+    return objects
+
+
+class LookupMemo:
+    """
+    Lookups shared by the apply helpers for one run (a single or bulk approval).
 
-    if obj is None:
-        return None
+    Each distinct site, tenant, VRF, manufacturer, device type, role, VLAN
+    group, tag and content type is resolved (or created) once and reused
+    for every result. preload() fetches the existing ones for a batch of
+    results with one query per kind up front.
+    """
 
-    # Create or update mapping
-    ct = ContentType.objects.get_for_model(obj)
-    DiscoveryMapping.objects.update_or_create(
-        source=result.source,
-        identity_key=result.identity_key,
-        defaults={
-            'netbox_object_type': ct,
-            'netbox_object_id': obj.pk,
-            'is_orphan': False,
-        },
-    )
+    def __init__(self):
+        self._sites = {}
+        self._tenants = {}
+        self._vrfs = {}
+        self._manufacturers = {}
+        self._device_types = {}
+        self._roles = {}
+        self._vlan_groups = {}
+        self._tags = {}
+        self._content_types = {}
+
+    def preload(self, results):
+        """Fetch the existing objects every result in a batch refers to, one query per kind."""
+        from extras.models import Tag
+        from ipam.models import VRF
+        from tenancy.models import Tenant
+
+        site_names, tenants, vrfs, manufacturers, models, roles, tags = set(), set(), set(), set(), set(), set(), set()
+        for result in results:
+            data = result.proposed_data or {}
+            config = result.source.config
+            site_names.add(data.get('site_name') or '')
+            tenants.add(config.get('tenant', ''))
+            tags.add(config.get('discovery_tag', 'udm-discovered'))
+            vrfs.add(data.get('vrf', ''))
+            if result.discovered_type == 'device':
+                manufacturers.add(data.get('manufacturer', 'Ubiquiti'))
+                models.add((data.get('manufacturer', 'Ubiquiti'), data.get('model', 'Unknown')))
+                roles.add(data.get('role', 'Network Switch'))
+
+        self._preload(self._sites, Site.objects.filter(name__in=site_names - {''}), 'name')
+        self._preload(self._tenants, Tenant.objects.filter(name__in=tenants - {''}), 'name')
+        self._preload(self._vrfs, VRF.objects.filter(name__in=vrfs - {''}), 'name')
+        self._preload(
+            self._manufacturers,
+            Manufacturer.objects.filter(slug__in={slugify(name) for name in manufacturers}),
+            'slug',
+        )
+        self._preload(self._roles, DeviceRole.objects.filter(slug__in={slugify(name) for name in roles}), 'slug')
+        self._preload(self._tags, Tag.objects.filter(slug__in={slugify(name) for name in tags}), 'slug')
+
+        by_model = defaultdict(set)
+        for manufacturer_name, model in models:
+            manufacturer = self._manufacturers.get(slugify(manufacturer_name))
+            if manufacturer:
+                by_model[model].add(manufacturer.pk)
+        if by_model:
+            for device_type in DeviceType.objects.filter(model__in=by_model).order_by('pk'):
+                if device_type.manufacturer_id in by_model[device_type.model]:
+                    self._device_types.setdefault((device_type.manufacturer_id, device_type.model), device_type)
+
+    @staticmethod
+    def _preload(cache, queryset, field):
+        for obj in queryset:
+            cache.setdefault(getattr(obj, field), obj)
+
+    def site(self, site_name, source):
+        """Resolve a site name to a NetBox Site, falling back to the source's site."""
+        if site_name:
+            if site_name not in self._sites:
+                self._sites[site_name] = Site.objects.filter(name=site_name).first()
+            if self._sites[site_name]:
+                return self._sites[site_name]
+        return source.site
 
-    # Tag the object
-    from extras.models import Tag
-    tag_name = result.source.config.get('discovery_tag', 'udm-discovered')
-    tag, _ = Tag.objects.get_or_create(
-        slug=slugify(tag_name),
-        defaults={'name': tag_name},
-    )
-    obj.tags.add(tag)
+    def tenant(self, tenant_name):
+        """Resolve a tenant name to a NetBox Tenant object."""
+        if not tenant_name:
+            return None
+        if tenant_name not in self._tenants:
+            from tenancy.models import Tenant
+            self._tenants[tenant_name] = Tenant.objects.filter(name=tenant_name).first()
+        return self._tenants[tenant_name]
+
+    def vrf(self, vrf_name):
+        """Resolve a VRF name to a NetBox VRF object."""
+        if not vrf_name:
+            return None
+        if vrf_name not in self._vrfs:
+            from ipam.models import VRF
+            self._vrfs[vrf_name] = VRF.objects.filter(name=vrf_name).first()
+        return self._vrfs[vrf_name]
+
+    def manufacturer(self, name):
+        """Get or create a Manufacturer by name."""
+        slug = slugify(name)
+        if slug not in self._manufacturers:
+            self._manufacturers[slug], _ = Manufacturer.objects.get_or_create(
+                slug=slug,
+                defaults={'name': name},
+            )
+        return self._manufacturers[slug]
+
+    def device_type(self, manufacturer, model):
+        """Get or create a DeviceType."""
+        key = (manufacturer.pk, model)
+        if key not in self._device_types:
+            device_type = DeviceType.objects.filter(manufacturer=manufacturer, model=model).first()
+            if device_type is None:
+                slug = slugify(f'{manufacturer.slug}-{model}')
+                device_type, _ = DeviceType.objects.get_or_create(
+                    slug=slug,
+                    defaults={'manufacturer': manufacturer, 'model': model},
+                )
+            self._device_types[key] = device_type
+        return self._device_types[key]
+
+    def device_role(self, name):
+        """Get or create a DeviceRole by name."""
+        slug = slugify(name)
+        if slug not in self._roles:
+            self._roles[slug], _ = DeviceRole.objects.get_or_create(
+                slug=slug,
+                defaults={'name': name, 'color': '9e9e9e'},
+            )
+        return self._roles[slug]
+
+    def vlan_group(self, site, pattern):
+        """Get or create the VLAN group of a site."""
+        slug = pattern.format(site_slug=site.slug)
+        if slug not in self._vlan_groups:
+            self._vlan_groups[slug], _ = VLANGroup.objects.get_or_create(
+                slug=slug,
+                defaults={
+                    'name': f'{site.name} VLANs',
+                    'scope_type': self.content_type(Site),
+                    'scope_id': site.id,
+                },
+            )
+        return self._vlan_groups[slug]
+
+    def tag(self, name):
+        """Get or create the discovery Tag by name."""
+        slug = slugify(name)
+        if slug not in self._tags:
+            from extras.models import Tag
+            self._tags[slug], _ = Tag.objects.get_or_create(
+                slug=slug,
+                defaults={'name': name},
+            )
+        return self._tags[slug]
 
-    return obj
+    def content_type(self, model):
+        """ContentType of a model."""
+        if model not in self._content_types:
+            self._content_types[model] = ContentType.objects.get_for_model(model)
+        return self._content_types[model]
 
 
-def _create_object(object_type, data, source):
+def _create_object(object_type, data, source, memo):
     """Create a new NetBox object from discovered data."""
     if object_type == 'device':
-        return _create_device(data, source)
+        return _create_device(data, source, memo)
     elif object_type == 'vlan':
-        return _create_vlan(data, source)
+        return _create_vlan(data, source, memo)
     elif object_type == 'ip_address':
-        return _create_ip_address(data, source)
+        return _create_ip_address(data, source, memo)
     return None
 
 
-def _create_device(data, source):
-    """Create a Device with its management interface and IP."""
-    site = _resolve_site(data.get('site_name'), source)
-    manufacturer = _ensure_manufacturer(data.get('manufacturer', 'Ubiquiti'))
-    device_type = _ensure_device_type(manufacturer, data.get('model', 'Unknown'))
-    role = _ensure_device_role(data.get('role', 'Network Switch'))
+def _create_device(data, source, memo):
+    """Create a Device; its management interface and IP are added by _assign_device_ips."""
+    site = memo.site(data.get('site_name'), source)
+    manufacturer = memo.manufacturer(data.get('manufacturer', 'Ubiquiti'))
+    device_type = memo.device_type(manufacturer, data.get('model', 'Unknown'))
+    role = memo.device_role(data.get('role', 'Network Switch'))
 
-    tenant = _resolve_tenant(source.config.get('tenant', ''))
+    tenant = memo.tenant(source.config.get('tenant', ''))
 
     device_data = {
         'name': data['name'],
@@ -266,33 +1002,17 @@ def _create_device(data, source):
     device = Device(**device_data)
     device.save()
     logger.info(f'Created device: {device.name}')
-
-    # Create mgmt interface and IP
-    ip = data.get('ip')
-    mac = data.get('mac')
-    if ip:
-        _assign_device_ip(device, ip, mac)
-
     return device
 
 
-def _create_vlan(data, source):
+def _create_vlan(data, source, memo):
     """Create a VLAN in NetBox."""
-    site = _resolve_site(data.get('site_name'), source)
+    site = memo.site(data.get('site_name'), source)
     vlan_group = None
     if site:
-        pattern = source.config.get('vlan_group_pattern', '{site_slug}-vlans')
-        group_slug = pattern.format(site_slug=site.slug)
-        vlan_group, _ = VLANGroup.objects.get_or_create(
-            slug=group_slug,
-            defaults={
-                'name': f'{site.name} VLANs',
-                'scope_type': ContentType.objects.get_for_model(Site),
-                'scope_id': site.id,
-            },
-        )
+        vlan_group = memo.vlan_group(site, source.config.get('vlan_group_pattern', '{site_slug}-vlans'))
 
-    tenant = _resolve_tenant(source.config.get('tenant', ''))
+    tenant = memo.tenant(source.config.get('tenant', ''))
 
     vlan_data = {
         'vid': data['vid'],
@@ -312,12 +1032,13 @@ def _create_vlan(data, source):
     return vlan
 
 
-def _create_ip_address(data, source):
+def _create_ip_address(data, source, memo):
     """Create an IP address in NetBox."""
     prefix_len = data.get('prefix_length', 24)
     ip_addr = f"{data['ip']}/{prefix_len}"
 
-    tenant = _resolve_tenant(source.config.get('tenant', ''))
+    tenant = memo.tenant(source.config.get('tenant', ''))
+    vrf = memo.vrf(data.get('vrf', ''))
 
     ip_data = {
         'address': ip_addr,
@@ -327,6 +1048,8 @@ def _create_ip_address(data, source):
     }
     if tenant:
         ip_data['tenant'] = tenant
+    if vrf:
+        ip_data['vrf'] = vrf
 
     ip_obj = IPAddress(**ip_data)
     ip_obj.save()
@@ -334,135 +1057,207 @@ def _create_ip_address(data, source):
     return ip_obj
 
 
-def _update_object(existing, object_type, data, diff):
-    """Update an existing NetBox object with changed fields."""
-    if existing is None:
-        return None
+def _update_fields(existing, object_type, data, diff, source, memo):
+    """Set the changed FIELD_SPEC fields on an existing NetBox object (saved by the caller).
 
+    The primary IP and MAC are assigned separately, by _assign_device_ips.
+    """
     if object_type == 'device':
         if 'name' in diff:
             existing.name = data['name']
-        if 'primary_ip4' in diff and data.get('ip'):
-            _assign_device_ip(existing, data['ip'], data.get('mac'))
-        existing.save()
+        if 'serial' in diff:
+            existing.serial = data['serial']
+        if 'site' in diff:
+            existing.site = memo.site(data.get('site_name'), source)
+        if 'role' in diff:
+            existing.role = memo.device_role(data['role'])
+        if 'device_type' in diff:
+            manufacturer = memo.manufacturer(data['manufacturer'])
+            existing.device_type = memo.device_type(manufacturer, data['model'])
 
     elif object_type == 'vlan':
         if 'name' in diff:
             existing.name = data['name']
-        existing.save()
 
     elif object_type == 'ip_address':
         if 'description' in diff:
             existing.description = data['description']
         if 'dns_name' in diff:
             existing.dns_name = data.get('dns_name', '')
-        existing.save()
-
-    logger.info(f'Updated {object_type}: {existing}')
-    return existing
 
 
 # --- Helper functions ---
 
-def _resolve_site(site_name, source):
-    """Resolve a site name to a NetBox Site object."""
-    if site_name:
-        site = Site.objects.filter(name=site_name).first()
-        if site:
-            return site
-    if source.site:
-        return source.site
-    return None
-
-
-def _resolve_tenant(tenant_name):
-    """Resolve a tenant name to a NetBox Tenant object."""
-    if not tenant_name:
-        return None
-    from tenancy.models import Tenant
-    return Tenant.objects.filter(name=tenant_name).first()
-
-
-def _ensure_manufacturer(name):
-    """Get or create a Manufacturer by name."""
-    slug = slugify(name)
-    mfr, _ = Manufacturer.objects.get_or_create(
-        slug=slug,
-        defaults={'name': name},
-    )
-    return mfr
-
-
-def _ensure_device_type(manufacturer, model):
-    """Get or create a DeviceType."""
-    device_type = DeviceType.objects.filter(
-        manufacturer=manufacturer, model=model,
-    ).first()
-    if device_type:
-        return device_type
+def _assign_device_ips(items, memo, skipped=None):
+    """
+    Give devices their management interface, MAC and IP, with their real mask.
+
+    items are (device, data, fields) triples, where fields names what to
+    assign: 'ip' and/or 'mac' (new management interfaces always get the
+    MAC). Existing interfaces, MACs and IPs are looked up with one query
+    each; missing ones are created. Returns the devices whose primary_ip4
+    changed (not yet saved). MACs and IPs assigned to another object are
+    left alone (an unassigned MAC is assigned to the interface); the pks of
+    devices that were skipped this way are added to ``skipped``.
+    """
+    if not items:
+        return []
+    interface_type = memo.content_type(Interface)
+
+    interfaces = {}
+    for interface in Interface.objects.filter(device__in=[device for device, _, _ in items], name='mgmt'):
+        interfaces.setdefault(interface.device_id, interface)
+
+    set_macs = [
+        (device, data) for device, data, fields in items
+        if data.get('mac') and (device.pk not in interfaces or 'mac' in fields)
+    ]
+    macs = defaultdict(list)  # MAC integer value -> MACAddress rows with that value
+    wanted = [data['mac'] for _, data in set_macs if mac_to_int(data['mac']) is not None]
+    if wanted:
+        for mac_obj in MACAddress.objects.filter(mac_address__in=wanted):
+            macs[mac_to_int(str(mac_obj.mac_address))].append(mac_obj)
+
+    for device, _, _ in items:
+        if device.pk not in interfaces:
+            interface = Interface(device=device, name='mgmt', type='virtual')
+            interface.save()
+            interfaces[device.pk] = interface
+
+    for device, data in set_macs:
+        interface = interfaces[device.pk]
+        key = mac_to_int(data['mac'])
+        rows = macs.get(key, []) if key is not None else []
+        # Reuse the MAC only if it is on this interface already or unassigned
+        mac_obj = next((
+            row for row in rows
+            if row.assigned_object_type_id == interface_type.pk and row.assigned_object_id == interface.id
+        ), None)
+        if mac_obj is None:
+            mac_obj = next((row for row in rows if row.assigned_object_id is None), None)
+            if mac_obj is not None:
+                mac_obj.assigned_object_type = interface_type
+                mac_obj.assigned_object_id = interface.id
+                mac_obj.save()
+        if mac_obj is None and rows:
+            logger.warning(f"MAC {data['mac']} assigned elsewhere, skipping for {device.name}")
+            if skipped is not None:
+                skipped.add(device.pk)
+            continue
+        if mac_obj is None:
+            mac_obj = MACAddress(
+                mac_address=data['mac'],
+                assigned_object_type=interface_type,
+                assigned_object_id=interface.id,
+            )
+            mac_obj.save()
+            if key is not None:
+                macs[key].append(mac_obj)
+        if interface.primary_mac_address_id != mac_obj.pk:
+            interface.primary_mac_address = mac_obj
+            interface.save()
 
-    slug = slugify(f'{manufacturer.slug}-{model}')
-    device_type, _ = DeviceType.objects.get_or_create(
-        slug=slug,
-        defaults={'manufacturer': manufacturer, 'model': model},
-    )
-    return device_type
+    ip_items = [(device, data) for device, data, fields in items if 'ip' in fields]
+    if not ip_items:
+        return []
+
+    # Match on the host part: the mask may differ from NetBox's
+    ips = {}
+    for ip_obj in IPAddress.objects.filter(address__net_in=list({data['ip'] for _, data in ip_items})):
+        ips.setdefault((str(ip_obj.address.ip), ip_obj.vrf_id), ip_obj)
+
+    changed = []
+    for device, data in ip_items:
+        ip = data['ip']
+        interface = interfaces[device.pk]
+        vrf = memo.vrf(data.get('vrf', ''))
+        key = (ip, vrf.pk if vrf else None)
+        ip_obj = ips.get(key)
+        if ip_obj is None:
+            ip_obj = IPAddress(
+                address=f"{ip}/{data.get('prefix_length', 24)}",
+                vrf=vrf,
+                assigned_object_type=interface_type,
+                assigned_object_id=interface.id,
+                status='active',
+            )
+            ip_obj.save()
+            ips[key] = ip_obj
+            logger.info(f'Assigned IP {ip} to {device.name}')
+        elif ip_obj.assigned_object_id != interface.id:
+            logger.warning(f'IP {ip} assigned elsewhere, skipping for {device.name}')
+            if skipped is not None:
+                skipped.add(device.pk)
+            continue
+        if device.primary_ip4_id != ip_obj.pk:
+            device.primary_ip4 = ip_obj
+            changed.append(device)
+    return changed
 
 
-def _ensure_device_role(name):
-    """Get or create a DeviceRole by name."""
-    slug = slugify(name)
-    role, _ = DeviceRole.objects.get_or_create(
-        slug=slug,
-        defaults={'name': name, 'color': '9e9e9e'},
-    )
-    return role
+def _save_mappings(batch, objects, memo, skipped=()):
+    """
+    Create or update the DiscoveryMapping of every applied result with one bulk upsert.
 
+    The fingerprints record that NetBox now matches the discovered data, so
+    they are left blank for devices in ``skipped`` (part of the change was
+    not applied); the next scan then diffs them again instead of skipping.
+    """
+    # Read back from the database, as _unchanged_keys will re-hash them
+    pks = defaultdict(set)
+    for obj in objects.values():
+        if obj is not None:
+            pks[type(obj)].add(obj.pk)
+    netbox_fps = {
+        (model, pk): netbox_fp
+        for model, model_pks in pks.items()
+        for pk, netbox_fp in netbox_fingerprints(model, model_pks).items()
+    }
 
-def _assign_device_ip(device, ip, mac=None):
-    """Create or find a management interface and assign an IP to a device."""
-    interfaces = Interface.objects.filter(device=device, name='mgmt')
-    if interfaces.exists():
-        interface = interfaces.first()
-    else:
-        interface = Interface(
-            device=device,
-            name='mgmt',
-            type='virtual',
+    mappings = {}
+    for result in batch:
+        obj = objects[result.pk]
+        if obj is None:
+            continue
+        partial = isinstance(obj, Device) and obj.pk in skipped
+        # A later result for the same identity wins
+        mappings[(result.source_id, result.identity_key)] = DiscoveryMapping(
+            source=result.source,
+            identity_key=result.identity_key,
+            netbox_object_type=memo.content_type(type(obj)),
+            netbox_object_id=obj.pk,
+            is_orphan=False,
+            last_seen_scan_id=result.scan_job_id,
+            miss_count=0,
+            scan_kind=result.scan_kind,
+            data_fingerprint='' if partial else fingerprint(result.proposed_data),
+            netbox_fingerprint='' if partial else netbox_fps.get((type(obj), obj.pk), ''),
+        )
+    if mappings:
+        DiscoveryMapping.objects.bulk_create(
+            mappings.values(),
+            update_conflicts=True,
+            unique_fields=('source', 'identity_key'),
+            update_fields=(
+                'netbox_object_type', 'netbox_object_id', 'is_orphan', 'last_seen_scan', 'miss_count', 'scan_kind',
+                'data_fingerprint', 'netbox_fingerprint', 'last_seen', 'last_updated',
+            ),
         )
-        interface.save()
-        if mac:
-            ct = ContentType.objects.get_for_model(Interface)
-            mac_obj, _ = MACAddress.objects.get_or_create(
-                mac_address=mac,
-                defaults={
-                    'assigned_object_type': ct,
-                    'assigned_object_id': interface.id,
-                },
-            )
-            interface.primary_mac_address = mac_obj
-            interface.save()
 
-    ip_with_prefix = f'{ip}/24'
-    existing_ip = IPAddress.objects.filter(address=ip_with_prefix).first()
 
-    if existing_ip:
-        if existing_ip.assigned_object_id == interface.id:
-            # Already assigned correctly
-            if not device.primary_ip4 or device.primary_ip4.id != existing_ip.id:
-                device.primary_ip4 = existing_ip
-                device.save()
-        else:
-            logger.warning(f'IP {ip} assigned elsewhere, skipping for {device.name}')
-    else:
-        ct = ContentType.objects.get_for_model(Interface)
-        new_ip = IPAddress(
-            address=ip_with_prefix,
-            assigned_object_type=ct,
-            assigned_object_id=interface.id,
-            status='active',
-        )
-        new_ip.save()
-        device.primary_ip4 = new_ip
-        device.save()
-        logger.info(f'Assigned IP {ip} to {device.name}')
+def _tag_objects(batch, objects, memo):
+    """
+    Add the discovery tag of each result's source to its object.
+
+    Tags go through obj.tags.add(), once per object with all of its tags,
+    so m2m_changed fires and the change is recorded in the changelog.
+    """
+    wanted = {}  # (model, pk) -> (object, {tags})
+    for result in batch:
+        obj = objects[result.pk]
+        if obj is not None:
+            tag = memo.tag(result.source.config.get('discovery_tag', 'udm-discovered'))
+            wanted.setdefault((type(obj), obj.pk), (obj, set()))[1].add(tag)
+
+    for obj, tags in wanted.values():
+        obj.tags.add(*tags)
@@ -4,179 +4,687 @@ and produces normalized DiscoveredObject records for reconciliation.
 
 Field mappings ported from ~/unifi2netbox/main.py.
 """
+import asyncio
+import hashlib
+import json
 import logging
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from itertools import repeat
 
-from .unifi_client import UnifiClient
+from asgiref.sync import sync_to_async
 
-logger = logging.getLogger('nb_udm_plugin.scanner')
+from .client_pool import acquire_client, cached_cookies, forget_cookies, store_cookies
+from .oui import canonical_vendor, get_table as get_oui_table
+from .prefix_index import PrefixIndex, load_prefix_index
 
+logger = logging.getLogger('nb_udm_plugin.scanner')
 
-@dataclass
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 500
+
+# Client iterator used for each kind of per-site fetch
+SITE_ITERATORS = {
+    'device': 'iter_devices',
+    'vlan': 'iter_networks',
+    'client': 'iter_clients',
+}
+
+# Controller fields kept in raw_data (and DiscoveryResult.discovered_data) per
+# kind of fetch, covering both the Integration and legacy API field names.
+# Override per kind with the "raw_fields" config key, or set "keep_full_raw".
+RAW_FIELDS = {
+    'device': (
+        'id', '_id', 'name', 'model', 'type', 'mac', 'macAddress', 'ip', 'ipAddress',
+        'serial', 'version', 'firmwareVersion', 'state', 'adopted', 'uptime',
+    ),
+    'vlan': (
+        'id', '_id', 'name', 'purpose', 'vlanId', 'vlan', 'ip_subnet', 'enabled',
+    ),
+    'client': (
+        'id', '_id', 'name', 'hostname', 'mac', 'macAddress', 'ip', 'ipAddress',
+        'type', 'oui', 'network', 'essid', 'is_wired', 'last_seen', 'connectedAt',
+    ),
+}
+
+
+@dataclass(slots=True)
 class DiscoveredObject:
     """Normalized discovery output for reconciliation."""
     object_type: str        # 'device', 'ip_address', 'vlan'
-    identity_key: str       # Unique within source (serial, MAC, vid)
+    identity_key: str       # Unique within source (serial, MAC, site + vid)
     data: dict              # Normalized fields for NetBox
     raw_data: dict = field(default_factory=dict)
+    kind: str = ''          # Scan that produced it: 'device', 'vlan', 'client'
+
+
+def raw_fields(config, kind):
+    """Return the raw_data whitelist for a kind of fetch, or None to keep full payloads."""
+    if config.get('keep_full_raw'):
+        return None
+    overrides = config.get('raw_fields') or {}
+    if not isinstance(overrides, dict):
+        logger.warning(f'Ignoring "raw_fields": expected an object, got {type(overrides).__name__}')
+        return RAW_FIELDS[kind]
+    fields = overrides.get(kind, RAW_FIELDS[kind])
+    if not _is_field_list(fields):
+        logger.warning(f'Ignoring "raw_fields" for {kind}: expected a list of field names')
+        return RAW_FIELDS[kind]
+    return tuple(fields)
+
+
+def _is_field_list(fields):
+    return isinstance(fields, (list, tuple)) and all(isinstance(name, str) for name in fields)
+
+
+def raw_field_errors(config):
+    """One message per malformed entry of a source config's "raw_fields"."""
+    overrides = config.get('raw_fields') or {}
+    if not isinstance(overrides, dict):
+        return ['"raw_fields" must be an object mapping device, vlan or client to a list of field names']
+    errors = []
+    for kind, fields in overrides.items():
+        if kind not in RAW_FIELDS:
+            errors.append(f'"raw_fields": unknown kind "{kind}" (expected one of {", ".join(RAW_FIELDS)})')
+        elif not _is_field_list(fields):
+            errors.append(f'"raw_fields" for {kind} must be a list of field names')
+    return errors
+
+
+def _project(raw, fields):
+    """Keep only the whitelisted fields of a controller payload."""
+    if fields is None:
+        return raw
+    return {key: raw[key] for key in fields if key in raw}
+
+
+# Controller field names per API mode: Integration API ('token') or legacy ('classic').
+# Integration API networks do not report their subnet, so token-mode IP masks
+# come from the NetBox prefixes alone.
+FIELD_NAMES = {
+    'token': {'mac': 'macAddress', 'ip': 'ipAddress', 'vid': 'vlanId', 'subnet': None},
+    'classic': {'mac': 'mac', 'ip': 'ip', 'vid': 'vlan', 'subnet': 'ip_subnet'},
+}
+
+DEFAULT_ROLES = {
+    'wireless': 'Wireless AP',
+    'router': 'Router',
+    'lan': 'Network Switch',
+    'wireless_client': 'Wireless Client',
+    'wired_client': 'Wired Client',
+}
+
+# Built-in device role rules, applied after the source's "role_rules".
+# 'role' names a key of the "roles" config rather than a NetBox role.
+DEFAULT_ROLE_RULES = (
+    {'field': 'type', 'regex': '^uap$', 'role': 'wireless'},
+    {'field': 'model', 'regex': 'UAP|U6|U7', 'role': 'wireless'},
+    {'field': 'model', 'regex': 'UDM|USG|UXG', 'role': 'router'},
+    {'field': 'type', 'regex': 'gateway', 'role': 'router'},
+)
+
+MAX_CACHED_PROFILES = 64
+
+
+class MappingProfile:
+    """
+    Mapping rules for one source config, compiled once and reused for every item.
+
+    Role rules are precompiled (case-insensitive) regexes, controller field
+    names are fixed for the source's api_mode, and the role names, defaults
+    and raw_data whitelists are resolved up front, so mapping an item is a
+    handful of dict lookups.
+    """
+
+    def __init__(self, config):
+        self.classic = config.get('api_mode', 'token') != 'token'
+        names = FIELD_NAMES['classic' if self.classic else 'token']
+        self.mac_key = names['mac']
+        self.ip_key = names['ip']
+        self.vid_key = names['vid']
+        self.subnet_key = names['subnet']
+
+        roles = {**DEFAULT_ROLES, **config.get('roles', {})}
+        self.wireless_role = roles['wireless']
+        self.default_role = roles['lan']
+        self.wireless_client_role = roles['wireless_client']
+        self.wired_client_role = roles['wired_client']
+        self.role_rules = []
+        for rule in _role_rules(config):
+            try:
+                self.role_rules.append(self._compile_rule(rule))
+            except ValueError as e:
+                logger.warning(f'Skipping invalid role rule: {e}')
+        self.default_role_rules = [self._compile_rule(rule, roles[rule['role']]) for rule in DEFAULT_ROLE_RULES]
+
+        self.manufacturer = config.get('manufacturer', 'Ubiquiti')
+        self.client_manufacturer = config.get('client_manufacturer', 'Unknown')
+        self.oui_table = get_oui_table()
+        self.default_prefix_length = int(config.get('client_prefix_length', 24))
+        self.sync_ip_addresses = bool(config.get('sync_ip_addresses', False))
+        self.vrf = config.get('vrf', '')
+        self.client_description_format = config.get('client_description_format', '{hostname} [{mac}] ({type})')
+        self.raw_fields = {kind: raw_fields(config, kind) for kind in RAW_FIELDS}
+
+    @staticmethod
+    def _compile_rule(rule, role=None):
+        """
+        Compile a {"field", "prefix" | "regex", "role"} rule to (field, matcher, role).
+
+        ``role`` overrides the rule's own. Raises ValueError for a malformed rule.
+        """
+        if not isinstance(rule, dict):
+            raise ValueError(f'role_rules entry must be an object: {rule!r}')
+        role = role or rule.get('role')
+        if not role or not isinstance(role, str):
+            raise ValueError(f'role_rules entry has no role: {rule}')
+        if 'prefix' in rule:
+            pattern, search = re.escape(str(rule['prefix'])), False
+        elif 'regex' in rule:
+            pattern, search = rule['regex'], True
+        else:
+            raise ValueError(f'role_rules entry needs "prefix" or "regex": {rule}')
+        try:
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except (re.error, TypeError) as e:
+            raise ValueError(f'role_rules entry has an invalid regex ({e}): {rule}') from e
+        return str(rule.get('field', 'model')), compiled.search if search else compiled.match, role
+
+    def map_ip_address(self, obj):
+        """DiscoveredObject for the IP of a mapped device or client, or None if it has none."""
+        data = obj.data
+        if not data.get('ip'):
+            return None
+        vrf = data.get('vrf', '')
+        return DiscoveredObject(
+            object_type='ip_address',
+            identity_key=f"ip:{vrf}:{data['ip']}" if vrf else f"ip:{data['ip']}",
+            data={
+                'ip': data['ip'],
+                'prefix_length': data['prefix_length'],
+                'vrf': vrf,
+                'description': data.get('description') or data['name'],
+                'dns_name': '',
+                'site_name': data['site_name'],
+            },
+            kind=obj.kind,
+        )
+
+    def device_role(self, device):
+        """Determine NetBox device role based on device model/type."""
+        for field_name, matches, role in self.role_rules:
+            value = device.get(field_name)
+            if value and matches(str(value)):
+                return role
+        if device.get('is_access_point'):
+            return self.wireless_role
+        for field_name, matches, role in self.default_role_rules:
+            value = device.get(field_name)
+            if value and matches(str(value)):
+                return role
+        return self.default_role
+
+    def client_vendor(self, mac, oui=None):
+        """Canonical client manufacturer: the OUI table, then the controller's 'oui' string, then the default."""
+        return self.oui_table.lookup(mac) or canonical_vendor(oui) or self.client_manufacturer
+
+    def prefix_length(self, ip, prefixes):
+        """Mask length for a discovered IP: the longest known prefix containing it, else the default."""
+        length = prefixes.prefix_length(ip) if prefixes is not None else None
+        return self.default_prefix_length if length is None else length
+
+    def site_prefixes(self, prefixes, networks):
+        """PrefixIndex of the subnets of a site's UniFi networks, in the source's VRF, on top of prefixes."""
+        index = PrefixIndex(prefixes.vrf_id, parent=prefixes)
+        for network in networks:
+            subnet = network.get(self.subnet_key)
+            if subnet:
+                index.add(subnet, prefixes.vrf_id)
+        return index
+
+    def map_device(self, device, site_name, prefixes=None):
+        """Map a UniFi device to a DiscoveredObject."""
+        mac = device.get(self.mac_key) or ''
+        # Serial: prefer actual serial, fallback to MAC
+        serial = device.get('serial') or mac.replace(':', '').upper()
+        if not serial:
+            return None
+
+        ip = device.get(self.ip_key) or ''
+        data = {
+            'name': device.get('name') or device.get('hostname') or f'UniFi-{serial[-6:]}',
+            'serial': serial,
+            'model': device.get('model', 'Unknown'),
+            'manufacturer': self.manufacturer,
+            'role': self.device_role(device),
+            'mac': mac,
+            'ip': ip,
+            'site_name': site_name,
+        }
+        if ip:
+            data['prefix_length'] = self.prefix_length(ip, prefixes)
+            if self.vrf:
+                data['vrf'] = self.vrf
+
+        return DiscoveredObject(
+            object_type='device',
+            identity_key=serial,
+            data=data,
+            raw_data=_project(device, self.raw_fields['device']),
+            kind='device',
+        )
+
+    def map_vlan(self, network, site_name, prefixes=None):
+        """Map a UniFi network to a VLAN DiscoveredObject."""
+        vlan_id = network.get(self.vid_key)
+        # The legacy API reports the VLAN ID as a string on some versions
+        if not vlan_id or not str(vlan_id).isdigit():
+            return None
+        vlan_id = int(vlan_id)
+
+        # VLAN IDs repeat across sites, so the identity is scoped by site
+        return DiscoveredObject(
+            object_type='vlan',
+            identity_key=f'vlan:{site_name}:{vlan_id}',
+            data={
+                'vid': vlan_id,
+                'name': network.get('name', f'VLAN-{vlan_id}'),
+                'site_name': site_name,
+            },
+            raw_data=_project(network, self.raw_fields['vlan']),
+            kind='vlan',
+        )
+
+    def map_client(self, client_data, site_name, prefixes=None):
+        """Map a UniFi client to a Device DiscoveredObject."""
+        mac = client_data.get(self.mac_key) or ''
+        if not mac:
+            return None
+
+        name = (
+            client_data.get('name')
+            or client_data.get('hostname')
+            or f"Client-{mac[-8:].replace(':', '')}"
+        )
+
+        # Role based on connection type
+        if self.classic:
+            wireless = client_data.get('is_wired') is False
+        else:
+            wireless = (client_data.get('type') or '').upper() in ('WIRELESS', 'WIFI')
+
+        ip = client_data.get(self.ip_key) or ''
+        data = {
+            'name': name,
+            'serial': mac.replace(':', '').upper(),
+            'model': 'Client Device',
+            'manufacturer': self.client_vendor(mac, client_data.get('oui')),
+            'role': self.wireless_client_role if wireless else self.wired_client_role,
+            'mac': mac,
+            'ip': ip,
+            'site_name': site_name,
+        }
+        if ip:
+            data['prefix_length'] = self.prefix_length(ip, prefixes)
+            if self.vrf:
+                data['vrf'] = self.vrf
+            data['description'] = self.client_description_format.format(
+                hostname=name, mac=mac, type='wireless' if wireless else 'wired',
+            )
+
+        return DiscoveredObject(
+            object_type='device',
+            identity_key=f'{name} [{mac}]',
+            data=data,
+            raw_data=_project(client_data, self.raw_fields['client']),
+            kind='client',
+        )
+
+
+def _role_rules(config):
+    rules = config.get('role_rules') or []
+    return rules if isinstance(rules, list) else [rules]
+
+
+def role_rule_errors(config):
+    """One message per malformed entry of a source config's "role_rules"."""
+    if not isinstance(config.get('role_rules') or [], list):
+        return ['"role_rules" must be a list of rules']
+    errors = []
+    for position, rule in enumerate(_role_rules(config), start=1):
+        try:
+            MappingProfile._compile_rule(rule)
+        except ValueError as e:
+            errors.append(f'Rule {position}: {e}')
+    return errors
+
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def get_mapping_profile(config):
+    """Return the compiled MappingProfile for a source config, cached by config hash."""
+    key = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+    with _profiles_lock:
+        profile = _profiles.get(key)
+    if profile is None:
+        profile = MappingProfile(config)
+        with _profiles_lock:
+            if len(_profiles) >= MAX_CACHED_PROFILES:
+                _profiles.clear()
+            _profiles[key] = profile
+    return profile
 
 
 def determine_device_role(device, config):
     """Determine NetBox device role based on device model/type."""
-    roles = config.get('roles', {})
-    model = (device.get('model') or '').upper()
-    device_type = (device.get('type') or '').lower()
-    is_ap = device.get('is_access_point', False) or device.get('type') == 'uap'
-
-    if is_ap or 'UAP' in model or 'U6' in model or 'U7' in model:
-        return roles.get('wireless', 'Wireless AP')
-    elif 'UDM' in model or 'USG' in model or 'UXG' in model or 'gateway' in device_type:
-        return roles.get('router', 'Router')
-    else:
-        return roles.get('lan', 'Network Switch')
+    return get_mapping_profile(config).device_role(device)
 
 
-def scan_source(source):
+def scan_source(source, scan_job=None, kinds=None):
     """
     Run a full discovery scan against a DiscoverySource.
 
-    Returns a list of DiscoveredObject records.
+    Returns a list of DiscoveredObject records; see iter_scan_source.
+    """
+    return list(iter_scan_source(source, scan_job, kinds))
+
+
+def iter_scan_source(source, scan_job=None, kinds=None, sites=None):
+    """
+    Run a discovery scan against a DiscoverySource, yielding DiscoveredObject records.
+
+    The per-site, per-endpoint fetches run concurrently on a bounded thread
+    pool (``max_concurrency`` in the source config) sharing the client's
+    session. Each fetch maps items as they arrive and buffers at most
+    ``chunk_size`` objects, so memory does not grow with the size of the
+    controller. Objects are yielded in the order of a sequential scan. The
+    client comes from the per-process registry, so a warm session from the
+    previous scan is reused.
+
+    ``kinds`` limits the scan to some object types ('device', 'vlan',
+    'client') and ``sites`` to some UniFi site names; by default every type
+    the source syncs is fetched from every site.
+
+    If a ScanJob is given, the transport's retry and circuit-breaker
+    counters are copied onto it (unsaved) when the scan finishes or fails.
     """
     config = source.config
-    discovered = []
+    profile = get_mapping_profile(config)
+
+    with acquire_client(source) as client:
+        stats_before = dict(client.transport.stats)
+        try:
+            site_names = [name for name in client.sites if sites is None or name in sites]
+            tasks = _site_tasks(source, site_names, kinds)
+            max_workers = max(1, int(config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)))
+            buffer_size = max(1, int(config.get('chunk_size', DEFAULT_CHUNK_SIZE)))
+
+            prefixes = None
+            if _needs_prefixes({task[0] for task in tasks}):
+                prefixes = load_prefix_index(profile.vrf)
+                logger.info(f'Loaded {len(prefixes)} prefix(es) for IP masks')
+            networks = SiteNetworks(client, profile, prefixes)
+
+            def fetch(task):
+                kind, unifi_site_name, netbox_site_name = task
+                if kind == 'vlan':
+                    items = networks.networks(unifi_site_name)
+                else:
+                    items = getattr(client, SITE_ITERATORS[kind])(unifi_site_name)
+                site_prefixes = networks.prefixes(unifi_site_name)
+                return _map_items(profile, kind, items, netbox_site_name, site_prefixes)
+
+            yield from _ordered_stream(fetch, tasks, max_workers, buffer_size)
+        finally:
+            if scan_job is not None:
+                _record_transport_stats(scan_job, client, stats_before)
+
+
+async def async_scan_source(source, scan_job=None, kinds=None):
+    """
+    Run a full discovery scan using AsyncUnifiClient.
 
-    client = UnifiClient(
-        base_url=f"https://{config.get('host', '')}:{config.get('port', 443)}",
-        api_mode=config.get('api_mode', 'token'),
-        site=config.get('site', 'default'),
-        verify_ssl=config.get('verify_ssl', False),
-        token=source.token,
-    )
-    client.connect()
+    Used when the source config sets ``"client_backend": "async"``. All
+    site/endpoint fetches are tasks on one event loop, at most
+    ``max_concurrency`` at a time; the output matches scan_source.
+    """
+    from .async_client import AsyncUnifiClient
 
-    site_mappings = config.get('site_mappings', {})
-    manufacturer = config.get('manufacturer', 'Ubiquiti')
+    config = source.config
+    profile = get_mapping_profile(config)
+    client = AsyncUnifiClient.from_source(source)
+    client.restore_cookies(cached_cookies(source))
+    stats_before = dict(client.transport.stats)
+    try:
+        try:
+            await client.connect()
+        except Exception:
+            forget_cookies(source)
+            raise
+
+        tasks = _site_tasks(source, client.sites, kinds)
+        semaphore = asyncio.Semaphore(
+            max(1, int(config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))),
+        )
+
+        prefixes = None
+        if _needs_prefixes({task[0] for task in tasks}):
+            # The ORM must not be called from the event loop thread
+            prefixes = await sync_to_async(load_prefix_index)(profile.vrf)
+        networks = AsyncSiteNetworks(client, profile, prefixes)
+
+        async def fetch(kind, unifi_site_name, netbox_site_name):
+            async with semaphore:
+                if kind == 'vlan':
+                    items = await networks.networks(unifi_site_name)
+                else:
+                    iterator = getattr(client, SITE_ITERATORS[kind])(unifi_site_name)
+                    items = [item async for item in iterator]
+                site_prefixes = await networks.prefixes(unifi_site_name)
+            return list(_map_items(profile, kind, items, netbox_site_name, site_prefixes))
+
+        results = await asyncio.gather(*(fetch(*task) for task in tasks))
+        store_cookies(source, client)
+    finally:
+        if scan_job is not None:
+            _record_transport_stats(scan_job, client, stats_before)
+        await client.disconnect()
+
+    return [obj for objects in results for obj in objects]
+
+
+class SiteNetworks:
+    """
+    The UniFi networks of each site of one scan, fetched at most once per site.
 
-    for unifi_site_name in client.sites:
+    A site's VLAN fetch and the IP masks of its devices and clients share
+    one fetch, made by whichever worker needs it first. Masks use the
+    network subnets only in classic mode (see FIELD_NAMES); otherwise, and
+    when the scan needs no masks, no networks are fetched for them.
+    """
+
+    def __init__(self, client, profile, prefixes=None):
+        self.client = client
+        self.profile = profile
+        self.netbox_prefixes = prefixes
+        self._sites = {}  # UniFi site name -> {'lock', 'networks', 'prefixes'}
+        self._lock = threading.Lock()
+
+    def _uses_subnets(self):
+        return self.netbox_prefixes is not None and self.profile.subnet_key is not None
+
+    def _load(self, unifi_site_name):
+        with self._lock:
+            site = self._sites.setdefault(unifi_site_name, {'lock': threading.Lock()})
+        with site['lock']:
+            if 'networks' not in site:
+                networks = list(self.client.iter_networks(unifi_site_name))
+                if self._uses_subnets():
+                    site['prefixes'] = self.profile.site_prefixes(self.netbox_prefixes, networks)
+                site['networks'] = networks
+        return site
+
+    def networks(self, unifi_site_name):
+        """The raw networks of a site."""
+        return self._load(unifi_site_name)['networks']
+
+    def prefixes(self, unifi_site_name):
+        """PrefixIndex for the IPs of a site, or None if the scan needs no masks."""
+        if not self._uses_subnets():
+            return self.netbox_prefixes
+        return self._load(unifi_site_name)['prefixes']
+
+
+class AsyncSiteNetworks(SiteNetworks):
+    """SiteNetworks for AsyncUnifiClient: the same methods, as coroutines."""
+
+    def _load(self, unifi_site_name):
+        # One task per site; every caller awaits the same fetch
+        if unifi_site_name not in self._sites:
+            self._sites[unifi_site_name] = asyncio.ensure_future(self._fetch(unifi_site_name))
+        return self._sites[unifi_site_name]
+
+    async def _fetch(self, unifi_site_name):
+        networks = [item async for item in self.client.iter_networks(unifi_site_name)]
+        site = {'networks': networks}
+        if self._uses_subnets():
+            site['prefixes'] = self.profile.site_prefixes(self.netbox_prefixes, networks)
+        return site
+
+    async def networks(self, unifi_site_name):
+        """The raw networks of a site."""
+        return (await self._load(unifi_site_name))['networks']
+
+    async def prefixes(self, unifi_site_name):
+        """PrefixIndex for the IPs of a site, or None if the scan needs no masks."""
+        if not self._uses_subnets():
+            return self.netbox_prefixes
+        return (await self._load(unifi_site_name))['prefixes']
+
+
+def _site_tasks(source, sites, kinds=None):
+    """List the (kind, unifi_site, netbox_site) fetches a scan of the source needs."""
+    kinds = [kind for kind in source.enabled_scan_kinds if kinds is None or kind in kinds]
+    tasks = []
+    site_mappings = source.config.get('site_mappings', {})
+    for unifi_site_name in sites:
         netbox_site_name = site_mappings.get(unifi_site_name, unifi_site_name)
         logger.info(f'Scanning site: {unifi_site_name} -> {netbox_site_name}')
+        for kind in kinds:
+            tasks.append((kind, unifi_site_name, netbox_site_name))
+    return tasks
 
-        if source.sync_devices:
-            devices = client.get_devices(unifi_site_name)
-            for device in devices:
-                obj = _map_device(device, config, manufacturer, netbox_site_name)
-                if obj:
-                    discovered.append(obj)
-
-        if source.sync_vlans:
-            networks = client.get_networks(unifi_site_name)
-            for network in networks:
-                obj = _map_vlan(network, netbox_site_name)
-                if obj:
-                    discovered.append(obj)
-
-        if source.sync_clients:
-            clients = client.get_clients(unifi_site_name)
-            for cli in clients:
-                obj = _map_client(cli, config, netbox_site_name)
-                if obj:
-                    discovered.append(obj)
-
-    client.disconnect()
-    return discovered
-
-
-def _map_device(device, config, manufacturer, site_name):
-    """Map a UniFi device to a DiscoveredObject."""
-    # Serial: prefer actual serial, fallback to MAC
-    serial = (
-        device.get('serial')
-        or (device.get('mac') or '').replace(':', '').upper()
-        or (device.get('macAddress') or '').replace(':', '').upper()
-    )
-    if not serial:
-        return None
 
-    name = device.get('name') or device.get('hostname') or f'UniFi-{serial[-6:]}'
-    model = device.get('model', 'Unknown')
-    mac = device.get('mac') or device.get('macAddress', '')
-    ip = device.get('ip') or device.get('ipAddress', '')
-    role_name = determine_device_role(device, config)
+def _record_transport_stats(scan_job, client, stats_before):
+    """Copy the retries, breaker trips and current throttle limits onto the ScanJob (unsaved)."""
+    stats = client.transport.stats
+    scan_job.retry_count = stats['retries'] - stats_before['retries']
+    scan_job.breaker_trip_count = stats['breaker_trips'] - stats_before['breaker_trips']
+    throttle = getattr(client.transport, 'throttle', None)
+    if throttle is not None:
+        scan_job.rate_limit = throttle.rate_limit
+        scan_job.concurrency_limit = throttle.concurrency_limit
 
-    return DiscoveredObject(
-        object_type='device',
-        identity_key=serial,
-        data={
-            'name': name,
-            'serial': serial,
-            'model': model,
-            'manufacturer': manufacturer,
-            'role': role_name,
-            'mac': mac,
-            'ip': ip,
-            'site_name': site_name,
-        },
-        raw_data=device,
-    )
 
+def _map_items(profile, kind, items, netbox_site_name, prefixes=None):
+    """
+    Map the raw items of one endpoint ('device', 'vlan' or 'client') of one site, lazily.
 
-def _map_vlan(network, site_name):
-    """Map a UniFi network to a VLAN DiscoveredObject."""
-    vlan_id = network.get('vlanId')
-    name = network.get('name', f'VLAN-{vlan_id}')
+    With ``sync_ip_addresses`` enabled, each device or client with an IP is
+    followed by an ip_address object for it.
+    """
+    if kind == 'device':
+        map_one = profile.map_device
+    elif kind == 'vlan':
+        map_one = profile.map_vlan
+    elif kind == 'client':
+        map_one = profile.map_client
+    else:
+        return iter(())
 
-    if not vlan_id:
-        return None
+    objects = (obj for obj in map(map_one, items, repeat(netbox_site_name), repeat(prefixes)) if obj)
+    if kind == 'vlan' or not profile.sync_ip_addresses:
+        return objects
+    return _with_ip_addresses(profile, objects)
 
-    return DiscoveredObject(
-        object_type='vlan',
-        identity_key=f'vlan:{vlan_id}',
-        data={
-            'vid': vlan_id,
-            'name': name,
-            'site_name': site_name,
-        },
-        raw_data=network,
-    )
 
+def _with_ip_addresses(profile, objects):
+    for obj in objects:
+        yield obj
+        ip_obj = profile.map_ip_address(obj)
+        if ip_obj:
+            yield ip_obj
 
-def _map_client(client_data, config, site_name):
-    """Map a UniFi client to a Device DiscoveredObject."""
-    mac = client_data.get('mac') or client_data.get('macAddress', '')
-    if not mac:
-        return None
 
-    ip = client_data.get('ip') or client_data.get('ipAddress', '')
-    name = (
-        client_data.get('name')
-        or client_data.get('hostname')
-        or f"Client-{mac[-8:].replace(':', '')}"
-    )
-    client_type = (client_data.get('type') or 'unknown').upper()
-    oui = client_data.get('oui', '')
-
-    # Role based on connection type
-    roles = config.get('roles', {})
-    if client_type in ('WIRELESS', 'WIFI'):
-        role = roles.get('wireless_client', 'Wireless Client')
-    else:
-        role = roles.get('wired_client', 'Wired Client')
+def _needs_prefixes(kinds):
+    """Only devices and clients carry IPs that need a mask."""
+    return 'device' in kinds or 'client' in kinds
 
-    # Manufacturer from OUI lookup if available
-    manufacturer = oui if oui else config.get('client_manufacturer', 'Unknown')
 
-    return DiscoveredObject(
-        object_type='device',
-        identity_key=f'{name} [{mac}]',
-        data={
-            'name': name,
-            'serial': mac.replace(':', '').upper(),
-            'model': 'Client Device',
-            'manufacturer': manufacturer,
-            'role': role,
-            'mac': mac,
-            'ip': ip,
-            'site_name': site_name,
-        },
-        raw_data=client_data,
-    )
+_DONE = object()
+
+
+def _ordered_stream(func, items, max_workers, buffer_size):
+    """
+    Run func(item) -> iterable on a thread pool, yielding the values in input order.
+
+    At most ``max_workers`` calls are in flight. Each call feeds its own
+    queue of at most ``buffer_size`` values and blocks while it is full,
+    so no more than max_workers * buffer_size values are held at once
+    however much a single call produces. Exceptions are re-raised in the
+    consumer when the failing call's values are reached.
+    """
+    stop = threading.Event()
+
+    def put(out, value):
+        while not stop.is_set():
+            try:
+                out.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce(item, out):
+        try:
+            for value in func(item):
+                if stop.is_set():
+                    return
+                put(out, value)
+        except Exception as e:
+            put(out, e)
+        else:
+            put(out, _DONE)
+
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    def submit(item):
+        out = queue.Queue(maxsize=buffer_size)
+        pool.submit(produce, item, out)
+        pending.append(out)
+
+    try:
+        for item in items:
+            submit(item)
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            out = pending[0]
+            while (value := out.get()) is not _DONE:
+                if isinstance(value, Exception):
+                    raise value
+                yield value
+            pending.popleft()
+            item = next(items, None)
+            if item is not None:
+                submit(item)
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
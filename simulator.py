@@ -0,0 +1,435 @@
+"""
+Local UniFi controller simulator for offline load testing.
+
+Serves the Integration API paths (/proxy/network/integration/v1/sites/...)
+and the legacy paths (/api/auth/login, /api/self/sites,
+/proxy/network/api/s/<site>/stat/device, stat/sta, rest/networkconf) used by
+UnifiClient, with generated sites, devices, clients and networks.
+
+Objects are generated from their index on demand and large responses are
+written with chunked transfer encoding, so 50k clients cost no memory up
+front. Latency, error rates, session expiry and paging limits are
+configurable to exercise the client's retry, re-auth and paging paths.
+
+The module only uses the standard library, so it can run outside NetBox:
+
+    python simulator.py --sites 4 --clients 50000 --port 8443
+
+and point a Discovery Source at it with
+``{"host": "127.0.0.1", "port": 8443, "scheme": "http", ...}``. Pass
+``--certfile``/``--keyfile`` to serve HTTPS instead.
+"""
+import argparse
+import json
+import random
+import re
+import secrets
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+INTEGRATION_PREFIX = '/proxy/network/integration/v1/sites'
+LEGACY_PREFIX = '/proxy/network/api/s/'
+
+DEVICE_MODELS = (
+    ('U6LR', 'uap'), ('U7PRO', 'uap'), ('UAPAC', 'uap'),
+    ('USW24P', 'usw'), ('USW48', 'usw'), ('USWLITE8', 'usw'),
+    ('UDMPRO', 'udm'),
+)
+CLIENT_OUIS = ('Apple', 'Samsung', 'Intel', 'Raspberry Pi', 'Espressif', '')
+
+
+class SimulatedController:
+    """Deterministic UniFi data set plus the fault-injection settings."""
+
+    def __init__(self, sites=1, devices=10, clients=100, networks=4, port_table_size=8,
+                 latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 max_limit=200, ignore_paging=False, token='', username='', password='',
+                 session_ttl=0, seed=0):
+        self.site_count = sites
+        self.device_count = devices
+        self.client_count = clients
+        self.network_count = networks
+        self.port_table_size = port_table_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_limit = max_limit
+        self.ignore_paging = ignore_paging
+        self.token = token
+        self.username = username
+        self.password = password
+        self.session_ttl = session_ttl
+        self.seed = seed
+
+        self.sessions = {}  # cookie token -> expiry (monotonic), 0 = never
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    # --- Data generation ---
+
+    @staticmethod
+    def _mac(kind, site, index):
+        value = (kind << 40) | (site << 24) | index
+        return ':'.join(f'{(value >> shift) & 0xff:02x}' for shift in range(40, -8, -8))
+
+    def site_key(self, site):
+        return 'default' if site == 0 else f'site{site}'
+
+    def site_id(self, site):
+        return f'00000000-0000-0000-0000-{site:012d}'
+
+    def site_from_id(self, site_id):
+        for site in range(self.site_count):
+            if site_id in (self.site_id(site), self.site_key(site)):
+                return site
+        return None
+
+    def site(self, site, legacy):
+        name = 'Default' if site == 0 else f'Site {site}'
+        if legacy:
+            return {'_id': f'{site:024x}', 'name': self.site_key(site), 'desc': name}
+        return {'id': self.site_id(site), 'internalReference': self.site_key(site), 'name': name}
+
+    def device(self, site, index, legacy):
+        rng = random.Random(f'{self.seed}:device:{site}:{index}')
+        model, dev_type = DEVICE_MODELS[index % len(DEVICE_MODELS)]
+        mac = self._mac(0x0c, site, index)
+        ip = f'10.{site % 256}.0.{index % 250 + 2}'
+        name = f'{dev_type}-{site}-{index}'
+        if not legacy:
+            return {
+                'id': f'dev-{site}-{index}',
+                'name': name,
+                'model': model,
+                'macAddress': mac,
+                'ipAddress': ip,
+                'state': 'ONLINE',
+                'features': ['accessPoint'] if dev_type == 'uap' else ['switching'],
+            }
+        return {
+            '_id': f'{site:08x}{index:016x}',
+            'mac': mac,
+            'serial': mac.replace(':', '').upper(),
+            'model': model,
+            'type': dev_type,
+            'name': name,
+            'ip': ip,
+            'version': '7.1.68',
+            'uptime': rng.randint(1000, 10 ** 7),
+            'port_table': [
+                {
+                    'port_idx': port + 1,
+                    'name': f'Port {port + 1}',
+                    'up': rng.random() > 0.3,
+                    'speed': rng.choice((100, 1000, 2500)),
+                    'rx_bytes': rng.randint(0, 10 ** 12),
+                    'tx_bytes': rng.randint(0, 10 ** 12),
+                }
+                for port in range(self.port_table_size)
+            ],
+        }
+
+    def client(self, site, index, legacy):
+        rng = random.Random(f'{self.seed}:client:{site}:{index}')
+        mac = self._mac(0x02, site, index)
+        wired = index % 3 == 0
+        ip = f'10.{site % 256}.{(index // 250) % 256}.{index % 250 + 2}'
+        hostname = f'host-{site}-{index}'
+        if not legacy:
+            return {
+                'id': f'cli-{site}-{index}',
+                'name': hostname,
+                'type': 'WIRED' if wired else 'WIRELESS',
+                'macAddress': mac,
+                'ipAddress': ip,
+                'connectedAt': '2026-01-01T00:00:00Z',
+            }
+        return {
+            '_id': f'{site:08x}{index:016x}',
+            'mac': mac,
+            'hostname': hostname,
+            'ip': ip,
+            'oui': CLIENT_OUIS[index % len(CLIENT_OUIS)],
+            'is_wired': wired,
+            'network': f'LAN {index % max(self.network_count, 1)}',
+            'rx_bytes': rng.randint(0, 10 ** 10),
+            'tx_bytes': rng.randint(0, 10 ** 10),
+            'uptime': rng.randint(0, 10 ** 6),
+        }
+
+    def network(self, site, index, legacy):
+        vid = 10 * (index + 1)
+        subnet = f'10.{site % 256}.{index + 100}.1/24'
+        if not legacy:
+            return {
+                'id': f'net-{site}-{index}',
+                'name': f'LAN {index}',
+                'vlanId': vid,
+                'enabled': True,
+            }
+        return {
+            '_id': f'{site:08x}{index:016x}',
+            'name': f'LAN {index}',
+            'purpose': 'corporate',
+            'vlan': vid,
+            'vlan_enabled': True,
+            'ip_subnet': subnet,
+        }
+
+    def collection(self, resource):
+        """(count, factory) for a per-site collection name."""
+        return {
+            'devices': (self.device_count, self.device),
+            'clients': (self.client_count, self.client),
+            'networks': (self.network_count, self.network),
+        }[resource]
+
+    # --- Sessions ---
+
+    def login(self, payload):
+        if self.username and (
+            payload.get('username') != self.username or payload.get('password') != self.password
+        ):
+            return None
+        cookie = secrets.token_hex(16)
+        expiry = time.monotonic() + self.session_ttl if self.session_ttl else 0
+        with self._lock:
+            self.sessions[cookie] = expiry
+        return cookie
+
+    def session_valid(self, cookie):
+        with self._lock:
+            expiry = self.sessions.get(cookie)
+        return expiry is not None and (expiry == 0 or expiry > time.monotonic())
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    controller = None  # set by make_server()
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- Plumbing ---
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_items(self, prefix, items, suffix):
+        """Stream a JSON envelope around a generated item sequence, chunk-encoded."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        buffer = [prefix]
+        size = len(prefix)
+        first = True
+        for item in items:
+            piece = ('' if first else ',') + json.dumps(item)
+            first = False
+            buffer.append(piece)
+            size += len(piece)
+            if size >= 64 * 1024:
+                self._write_chunk(''.join(buffer))
+                buffer, size = [], 0
+        buffer.append(suffix)
+        self._write_chunk(''.join(buffer))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def _inject_faults(self):
+        """Apply latency and random failures. Returns True if a response was sent."""
+        ctl = self.controller
+        with ctl._lock:
+            ctl.requests += 1
+        delay = ctl.latency + (random.uniform(-ctl.jitter, ctl.jitter) if ctl.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < ctl.throttle_rate:
+            self._send_json(429, {'error': 'rate limited'}, {'Retry-After': '1'})
+            return True
+        if roll < ctl.throttle_rate + ctl.error_rate:
+            self._send_json(503, {'error': 'simulated failure'})
+            return True
+        return False
+
+    def _cookie(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == 'TOKEN':
+                return value
+        return ''
+
+    # --- Routing ---
+
+    def do_POST(self):
+        if self._inject_faults():
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if urlsplit(self.path).path != '/api/auth/login':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            payload = {}
+        cookie = self.controller.login(payload)
+        if cookie is None:
+            self._send_json(401, {'meta': {'rc': 'error', 'msg': 'api.err.Invalid'}, 'data': []})
+            return
+        self._send_json(
+            200, {'username': payload.get('username', '')},
+            {'Set-Cookie': f'TOKEN={cookie}; Path=/; HttpOnly'},
+        )
+
+    def do_GET(self):
+        if self._inject_faults():
+            return
+        url = urlsplit(self.path)
+        if url.path.startswith(INTEGRATION_PREFIX):
+            self._integration(url)
+        elif url.path == '/api/self/sites' or url.path.startswith(LEGACY_PREFIX):
+            self._legacy(url)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _integration(self, url):
+        ctl = self.controller
+        if ctl.token and self.headers.get('X-API-KEY') != ctl.token:
+            self._send_json(401, {'error': 'unauthorized'})
+            return
+
+        rest = url.path[len(INTEGRATION_PREFIX):].strip('/')
+        if not rest:
+            total, factory = ctl.site_count, lambda site, index, legacy: ctl.site(index, legacy)
+            site = None
+        else:
+            match = re.fullmatch(r'([^/]+)/(devices|clients|networks)', rest)
+            site = ctl.site_from_id(match.group(1)) if match else None
+            if site is None:
+                self._send_json(404, {'error': 'not found'})
+                return
+            total, factory = ctl.collection(match.group(2))
+
+        query = parse_qs(url.query)
+        offset = max(0, int(query.get('offset', ['0'])[0]))
+        limit = int(query.get('limit', ['25'])[0])
+        if ctl.ignore_paging:
+            offset, limit = 0, total
+        else:
+            limit = max(0, min(limit, ctl.max_limit))
+        end = min(total, offset + limit)
+
+        self._send_items(
+            f'{{"offset":{offset},"limit":{limit},"count":{max(0, end - offset)},'
+            f'"totalCount":{total},"data":[',
+            (factory(site, index, False) for index in range(offset, end)),
+            ']}',
+        )
+
+    def _legacy(self, url):
+        ctl = self.controller
+        if not ctl.session_valid(self._cookie()):
+            self._send_json(401, {'meta': {'rc': 'error', 'msg': 'api.err.LoginRequired'}, 'data': []})
+            return
+
+        if url.path == '/api/self/sites':
+            total, factory, site = ctl.site_count, (lambda site, index, legacy: ctl.site(index, legacy)), None
+        else:
+            match = re.fullmatch(
+                re.escape(LEGACY_PREFIX) + r'([^/]+)/(stat/device|stat/sta|rest/networkconf)', url.path,
+            )
+            site = ctl.site_from_id(match.group(1)) if match else None
+            if site is None:
+                self._send_json(404, {'meta': {'rc': 'error', 'msg': 'api.err.NoSiteContext'}, 'data': []})
+                return
+            resource = {
+                'stat/device': 'devices', 'stat/sta': 'clients', 'rest/networkconf': 'networks',
+            }[match.group(2)]
+            total, factory = ctl.collection(resource)
+
+        self._send_items(
+            '{"meta":{"rc":"ok"},"data":[',
+            (factory(site, index, True) for index in range(total)),
+            ']}',
+        )
+
+
+def make_server(controller, host='127.0.0.1', port=8443, certfile=None, keyfile=None):
+    """Build a threaded HTTP(S) server for a SimulatedController."""
+    handler = type('BoundSimulatorHandler', (SimulatorHandler,), {'controller': controller})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated UniFi controller for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--certfile', help='Serve HTTPS with this certificate')
+    parser.add_argument('--keyfile', help='Private key for --certfile')
+    parser.add_argument('--sites', type=int, default=1)
+    parser.add_argument('--devices', type=int, default=10, help='Devices per site')
+    parser.add_argument('--clients', type=int, default=100, help='Clients per site')
+    parser.add_argument('--networks', type=int, default=4, help='Networks per site')
+    parser.add_argument('--port-table-size', type=int, default=8,
+                        help='Ports per legacy device record (inflates stat/device)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds on the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered 429')
+    parser.add_argument('--max-limit', type=int, default=200, help='Largest page the Integration API returns')
+    parser.add_argument('--ignore-paging', action='store_true',
+                        help='Return whole collections regardless of offset/limit')
+    parser.add_argument('--token', default='', help='Required X-API-KEY (any key accepted if empty)')
+    parser.add_argument('--username', default='', help='Required login username (any accepted if empty)')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--session-ttl', type=float, default=0,
+                        help='Seconds before a legacy login expires (0 = never)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    controller = SimulatedController(
+        sites=args.sites, devices=args.devices, clients=args.clients, networks=args.networks,
+        port_table_size=args.port_table_size, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, max_limit=args.max_limit,
+        ignore_paging=args.ignore_paging, token=args.token, username=args.username,
+        password=args.password, session_ttl=args.session_ttl, seed=args.seed,
+    )
+    server = make_server(controller, args.host, args.port, args.certfile, args.keyfile)
+    scheme = 'https' if args.certfile else 'http'
+    print(f'Simulated UniFi controller on {scheme}://{args.host}:{args.port} '
+          f'({args.sites} site(s), {args.devices} devices, {args.clients} clients per site)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'Served {controller.requests} request(s)')
+
+
+if __name__ == '__main__':
+    main()
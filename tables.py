@@ -39,6 +39,10 @@ class ScanJobTable(NetBoxTable):
     created_count = tables.Column(verbose_name='Created')
     updated_count = tables.Column(verbose_name='Updated')
     error_count = tables.Column(verbose_name='Errors')
+    retry_count = tables.Column(verbose_name='Retries')
+    breaker_trip_count = tables.Column(verbose_name='Breaker Trips')
+    rate_limit = tables.Column(verbose_name='Rate Limit')
+    concurrency_limit = tables.Column(verbose_name='Concurrency Limit')
     actions = columns.ActionsColumn(actions=('changelog',))
 
     class Meta(NetBoxTable.Meta):
@@ -46,7 +50,8 @@ class ScanJobTable(NetBoxTable):
         fields = (
             'pk', 'id', 'source', 'status', 'started_at', 'completed_at',
             'dry_run', 'discovered_count', 'created_count',
-            'updated_count', 'error_count',
+            'updated_count', 'error_count', 'retry_count', 'breaker_trip_count',
+            'rate_limit', 'concurrency_limit',
         )
         default_columns = (
             'pk', 'source', 'status', 'started_at',
@@ -77,17 +82,20 @@ class DiscoveryResultTable(NetBoxTable):
 class DiscoveryMappingTable(NetBoxTable):
     source = tables.Column(linkify=True)
     identity_key = tables.Column(linkify=True)
+    netbox_object = tables.Column(linkify=True, orderable=False, verbose_name='NetBox Object')
     first_seen = tables.DateTimeColumn()
     last_seen = tables.DateTimeColumn()
+    last_seen_scan = tables.Column(linkify=True, verbose_name='Last Seen Scan')
+    miss_count = tables.Column(verbose_name='Missed Scans')
     is_orphan = columns.BooleanColumn()
     actions = columns.ActionsColumn(actions=('changelog',))
 
     class Meta(NetBoxTable.Meta):
         model = DiscoveryMapping
         fields = (
-            'pk', 'id', 'source', 'identity_key',
-            'first_seen', 'last_seen', 'is_orphan',
+            'pk', 'id', 'source', 'identity_key', 'netbox_object',
+            'first_seen', 'last_seen', 'last_seen_scan', 'miss_count', 'is_orphan',
         )
         default_columns = (
-            'source', 'identity_key', 'last_seen', 'is_orphan',
+            'source', 'identity_key', 'netbox_object', 'last_seen', 'is_orphan',
         )
@@ -0,0 +1,65 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from nb_udm_plugin import simulator
+from nb_udm_plugin.cassette import SCRUBBED, scrub
+from nb_udm_plugin.unifi_client import UnifiClient
+
+CREDENTIALS = {'NB_UDM_UNIFI_USERNAME': 'admin', 'NB_UDM_UNIFI_PASSWORD': 'secret'}
+
+
+class ScrubTest(unittest.TestCase):
+
+    def test_secret_fields_are_blanked(self):
+        body = {
+            'deviceToken': 'abc', 'unique_id': 'u1', 'name': 'gw',
+            'data': [{'x_passphrase': 'p', 'wlan': {'token': 't', 'ssid': 'home'}}],
+        }
+        self.assertEqual(scrub(body), {
+            'deviceToken': SCRUBBED, 'unique_id': SCRUBBED, 'name': 'gw',
+            'data': [{'x_passphrase': SCRUBBED, 'wlan': {'token': SCRUBBED, 'ssid': 'home'}}],
+        })
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = simulator.make_server(simulator.SimulatedController(clients=20), port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cassette.jsonl.gz')
+
+    def record(self):
+        with mock.patch.dict('os.environ', CREDENTIALS):
+            client = UnifiClient(
+                f'http://127.0.0.1:{self.server.server_address[1]}', api_mode='legacy',
+                cassette_mode='record', cassette_path=self.path,
+            )
+            client.connect()
+            client.get_clients(next(iter(client.sites)))
+            client.disconnect()
+        with gzip.open(self.path, 'rt') as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_login_body_is_not_recorded(self):
+        entries = self.record()
+        login = [entry for entry in entries if entry['url'] == '/api/auth/login']
+        self.assertEqual([entry['body'] for entry in login], ['{}'])
+
+    def test_recording_starts_a_new_cassette(self):
+        first = self.record()
+        self.assertEqual(len(self.record()), len(first))
+
+    def test_replay(self):
+        self.record()
+        client = UnifiClient('http://unused', api_mode='legacy', cassette_mode='replay', cassette_path=self.path)
+        client.connect()
+        self.assertEqual(len(client.get_clients(next(iter(client.sites)))), 20)
@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from nb_udm_plugin.choices import ResultStatusChoices, ScanJobStatusChoices
+from nb_udm_plugin.jobs import SiteShardJob, _complete_scan
+from nb_udm_plugin.models import DiscoveryResult, DiscoverySource, ScanJob
+
+
+class ScanJobTestCase(TestCase):
+    """A running scan job with one pending result."""
+
+    def setUp(self):
+        self.source = DiscoverySource.objects.create(name='UDM')
+        self.scan_job = ScanJob.objects.create(
+            source=self.source,
+            status=ScanJobStatusChoices.STATUS_RUNNING,
+            started_at=timezone.now(),
+            scan_kinds=['device'],
+        )
+        self.result = DiscoveryResult.objects.create(
+            scan_job=self.scan_job,
+            source=self.source,
+            discovered_type='device',
+            scan_kind='device',
+            status=ResultStatusChoices.STATUS_PENDING,
+            action='create',
+            identity_key='S1',
+        )
+
+
+class CompleteScanTest(ScanJobTestCase):
+
+    def test_successful_scan_completes(self):
+        _complete_scan(self.scan_job, success=True)
+        self.scan_job.refresh_from_db()
+        self.assertEqual(self.scan_job.status, ScanJobStatusChoices.STATUS_COMPLETED)
+        self.source.refresh_from_db()
+        self.assertIsNotNone(self.source.last_device_scan)
+
+    def test_reaped_scan_stays_failed(self):
+        # The stale job reaper failed the scan while it was still saving chunks
+        ScanJob.objects.filter(pk=self.scan_job.pk).update(status=ScanJobStatusChoices.STATUS_FAILED)
+        _complete_scan(self.scan_job, success=True)
+
+        self.scan_job.refresh_from_db()
+        self.assertEqual(self.scan_job.status, ScanJobStatusChoices.STATUS_FAILED)
+        self.result.refresh_from_db()
+        self.assertEqual(self.result.status, ResultStatusChoices.STATUS_DISCARDED)
+        self.source.refresh_from_db()
+        self.assertFalse(self.source.last_scan_success)
+        self.assertIsNone(self.source.last_device_scan)
+
+
+class ShardFanInTest(ScanJobTestCase):
+
+    def test_last_shard_of_reaped_scan_does_not_complete_it(self):
+        ScanJob.objects.filter(pk=self.scan_job.pk).update(
+            status=ScanJobStatusChoices.STATUS_FAILED, shard_count=1,
+        )
+        shard = SiteShardJob(mock.Mock(object=self.source))
+        with mock.patch('nb_udm_plugin.jobs.iter_scan_source', return_value=iter(())), \
+                mock.patch('nb_udm_plugin.jobs.mark_orphans') as mark_orphans:
+            shard.run(scan_job_id=self.scan_job.pk, site_name='default', kinds=['device'])
+
+        mark_orphans.assert_not_called()
+        self.scan_job.refresh_from_db()
+        self.assertEqual(self.scan_job.status, ScanJobStatusChoices.STATUS_FAILED)
+        self.result.refresh_from_db()
+        self.assertEqual(self.result.status, ResultStatusChoices.STATUS_DISCARDED)
@@ -0,0 +1,73 @@
+import io
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from nb_udm_plugin import jsonstream, simulator
+from nb_udm_plugin.transport import UnifiAPIError
+from nb_udm_plugin.unifi_client import UnifiClient
+
+
+class IterDataItemsTest(unittest.TestCase):
+
+    def items(self, body):
+        return list(jsonstream.iter_data_items(io.BytesIO(body)))
+
+    def test_items_of_ok_envelope(self):
+        self.assertEqual(self.items(b'{"meta": {"rc": "ok"}, "data": [{"a": 1}, {"b": [2]}]}'),
+                         [{'a': 1}, {'b': [2]}])
+
+    def test_error_envelope_raises(self):
+        with self.assertRaisesRegex(jsonstream.EnvelopeError, 'api.err.NoSiteContext'):
+            self.items(b'{"meta": {"rc": "error", "msg": "api.err.NoSiteContext"}, "data": []}')
+
+    def test_error_after_data_raises(self):
+        with self.assertRaises(jsonstream.EnvelopeError):
+            self.items(b'{"data": [{"a": 1}], "meta": {"rc": "error"}}')
+
+    def test_truncated_body_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.items(b'{"meta": {"rc": "ok"}, "data": [{"a": 1')
+
+    def test_without_ijson(self):
+        with mock.patch.object(jsonstream, 'ijson', None):
+            self.assertEqual(self.items(b'{"meta": {"rc": "ok"}, "data": [1, 2]}'), [1, 2])
+            with self.assertRaises(jsonstream.EnvelopeError):
+                self.items(b'{"meta": {"rc": "error"}, "data": []}')
+
+
+class LegacyStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        controller = simulator.SimulatedController(sites=1, devices=5, clients=50)
+        self.server = simulator.make_server(controller, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        credentials = {'NB_UDM_UNIFI_USERNAME': 'admin', 'NB_UDM_UNIFI_PASSWORD': 'secret'}
+        with mock.patch.dict('os.environ', credentials):
+            self.client = UnifiClient(f'http://127.0.0.1:{self.server.server_address[1]}', api_mode='legacy')
+            self.client.connect()
+        self.site = next(iter(self.client.sites))
+
+    def test_streams_items(self):
+        self.assertEqual(len(list(self.client.iter_clients(self.site))), 50)
+
+    def test_error_envelope_is_api_error(self):
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(b'{"meta": {"rc": "error", "msg": "api.err.NoPermission"}, "data": []}')
+        with mock.patch.object(self.client, '_get', return_value=response):
+            with self.assertRaisesRegex(UnifiAPIError, 'api.err.NoPermission'):
+                list(self.client.iter_clients(self.site))
+
+    def test_read_error_is_api_error(self):
+        def broken(fp):
+            yield {'a': 1}
+            raise OSError('connection reset')
+
+        with mock.patch.object(jsonstream, 'iter_data_items', broken):
+            with self.assertRaisesRegex(UnifiAPIError, 'connection reset'):
+                list(self.client.iter_clients(self.site))
@@ -0,0 +1,31 @@
+import unittest
+from datetime import timedelta
+
+from django.utils import timezone
+
+from nb_udm_plugin.models import DiscoverySource
+
+
+class DueScanKindsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.source = DiscoverySource(
+            name='UDM', scan_interval=60, sync_vlans=False, sync_clients=False,
+            last_device_scan=self.now - timedelta(hours=2),
+        )
+
+    def test_due_after_interval(self):
+        self.assertEqual(self.source.due_scan_kinds(self.now), ['device'])
+
+    def test_failed_scan_waits_an_interval(self):
+        self.source.last_scan = self.now - timedelta(minutes=5)
+        self.source.last_scan_success = False
+        self.assertEqual(self.source.due_scan_kinds(self.now), [])
+        self.assertEqual(self.source.due_scan_kinds(self.now + timedelta(minutes=55)), ['device'])
+
+    def test_never_scanned_source_backs_off_after_failure(self):
+        self.source.last_device_scan = None
+        self.source.last_scan = self.now
+        self.source.last_scan_success = False
+        self.assertEqual(self.source.due_scan_kinds(self.now + timedelta(minutes=1)), [])
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from nb_udm_plugin.oui import load_table, read_entries
+
+IEEE_TEXT = (
+    'OUI/MA-L                                                    Organization\r\n'
+    'company_id                                                  Organization\r\n'
+    '\r\n'
+    'B8-27-EB   (hex)\t\tRaspberry Pi Foundation\r\n'
+    'B827EB     (base 16)\t\tRaspberry Pi Foundation\r\n'
+    '\t\t\t\tMitchell Wood House\r\n'
+    '\r\n'
+    '00-50-C2                      (hex)                         RF Code\r\n'
+    'F71000-F71FFF                 (base 16)                     RF Code\r\n'
+    '\r\n'
+    '70-B3-D5   (hex)\t\tIEEE Registration Authority\r\n'
+    '70B3D5     (base 16)\t\tIEEE Registration Authority\r\n'
+)
+
+
+class ReadEntriesTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'oui.txt')
+        with open(self.path, 'w', encoding='utf-8', newline='') as fh:
+            fh.write(IEEE_TEXT)
+
+    def test_ieee_text_blocks_and_ranges(self):
+        self.assertEqual(list(read_entries(self.path)), [
+            ('B827EB', 'Raspberry Pi Foundation'),
+            ('0050C2F71', 'RF Code'),
+        ])
+
+    def test_bundled_table_covers_the_registry(self):
+        table = load_table()
+        self.assertGreater(len(table), 30000)
+        self.assertEqual(table.lookup('b8:27:eb:12:34:56'), 'Raspberry Pi')
+        self.assertEqual(table.lookup('f0:9f:c2:12:34:56'), 'Ubiquiti')
@@ -0,0 +1,224 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.utils import timezone
+
+from dcim.models import Device, DeviceRole, DeviceType, Interface, MACAddress, Manufacturer, Site
+from ipam.models import IPAddress
+
+from nb_udm_plugin import reconciliation
+from nb_udm_plugin.choices import ResultActionChoices, ResultStatusChoices, ScanJobStatusChoices
+from nb_udm_plugin.models import DiscoveryMapping, DiscoveryResult, DiscoverySource, ScanJob
+from nb_udm_plugin.scanner import DiscoveredObject
+
+
+class ReconciliationTestCase(TestCase):
+    """A source with one scan job and one mapped switch, 'sw1' (serial S1)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='HQ', slug='hq')
+        manufacturer = Manufacturer.objects.create(name='Ubiquiti', slug='ubiquiti')
+        cls.device_type = DeviceType.objects.create(manufacturer=manufacturer, model='USW-24', slug='usw-24')
+        cls.role = DeviceRole.objects.create(name='Network Switch', slug='network-switch')
+        cls.device = cls._device('sw1', 'S1')
+        cls.source = DiscoverySource.objects.create(name='UDM', site=cls.site)
+        cls.scan_job = ScanJob.objects.create(
+            source=cls.source,
+            status=ScanJobStatusChoices.STATUS_RUNNING,
+            started_at=timezone.now(),
+            scan_kinds=['device'],
+        )
+        cls.mapping = DiscoveryMapping.objects.create(
+            source=cls.source,
+            identity_key='S1',
+            scan_kind='device',
+            netbox_object_type=ContentType.objects.get_for_model(Device),
+            netbox_object_id=cls.device.pk,
+        )
+
+    @classmethod
+    def _device(cls, name, serial):
+        return Device.objects.create(
+            name=name, serial=serial, site=cls.site, role=cls.role, device_type=cls.device_type,
+        )
+
+    def discovered(self, **data):
+        data = {
+            'name': 'sw1', 'serial': 'S1', 'model': 'USW-24', 'manufacturer': 'Ubiquiti',
+            'role': 'Network Switch', 'site_name': 'HQ', **data,
+        }
+        return DiscoveredObject(object_type='device', identity_key=data['serial'], data=data, kind='device')
+
+    def reconcile(self, *discovered):
+        return reconciliation._reconcile_chunk(self.source, self.scan_job, list(discovered))
+
+
+class FingerprintSkipTest(ReconciliationTestCase):
+
+    def test_in_sync_object_is_skipped_on_next_scan(self):
+        self.assertEqual(self.reconcile(self.discovered()), [])
+        self.mapping.refresh_from_db()
+        self.assertTrue(self.mapping.data_fingerprint)
+        self.assertTrue(self.mapping.netbox_fingerprint)
+
+        with mock.patch.object(reconciliation, 'diff_batch', wraps=reconciliation.diff_batch) as diff_batch:
+            self.assertEqual(self.reconcile(self.discovered()), [])
+        diff_batch.assert_called_once_with([])
+
+    def test_discovered_change_is_diffed(self):
+        self.reconcile(self.discovered())
+        results = self.reconcile(self.discovered(name='core-sw1'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].action, ResultActionChoices.ACTION_UPDATE)
+        self.assertEqual(set(results[0].diff), {'name'})
+
+    def test_netbox_edit_is_diffed(self):
+        self.reconcile(self.discovered())
+        Device.objects.filter(pk=self.device.pk).update(name='renamed')
+        results = self.reconcile(self.discovered())
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].diff['name'], {'current': 'renamed', 'proposed': 'sw1'})
+
+    def test_netbox_mac_edit_is_diffed(self):
+        interface = Interface.objects.create(device=self.device, name='mgmt', type='virtual')
+        mac = MACAddress.objects.create(mac_address='00:11:22:33:44:55', assigned_object=interface)
+        Interface.objects.filter(pk=interface.pk).update(primary_mac_address=mac)
+        self.assertEqual(self.reconcile(self.discovered(mac='00:11:22:33:44:55')), [])
+
+        MACAddress.objects.filter(pk=mac.pk).update(mac_address='00:11:22:33:44:66')
+        results = self.reconcile(self.discovered(mac='00:11:22:33:44:55'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(set(results[0].diff), {'mac'})
+
+
+class PartialApplyTest(ReconciliationTestCase):
+
+    def pending_update(self, data, diff):
+        return DiscoveryResult.objects.create(
+            scan_job=self.scan_job,
+            source=self.source,
+            discovered_type='device',
+            scan_kind='device',
+            proposed_data=self.discovered(**data).data,
+            matched_object_type=ContentType.objects.get_for_model(Device),
+            matched_object_id=self.device.pk,
+            diff=diff,
+            status=ResultStatusChoices.STATUS_PENDING,
+            action=ResultActionChoices.ACTION_UPDATE,
+            identity_key='S1',
+        )
+
+    def test_full_apply_stamps_fingerprints(self):
+        result = self.pending_update({'name': 'core-sw1'}, {'name': {'current': 'sw1', 'proposed': 'core-sw1'}})
+        applied, errors = reconciliation.apply_results([result])
+        self.assertEqual(errors, {})
+        self.mapping.refresh_from_db()
+        self.assertTrue(self.mapping.data_fingerprint)
+        self.assertTrue(self.mapping.netbox_fingerprint)
+
+    def test_skipped_ip_leaves_fingerprints_blank(self):
+        # The discovered IP already belongs to another device's interface
+        other = Interface.objects.create(device=self._device('sw2', 'S2'), name='mgmt', type='virtual')
+        IPAddress.objects.create(address='10.0.0.5/24', assigned_object=other)
+        result = self.pending_update(
+            {'ip': '10.0.0.5', 'prefix_length': 24},
+            {'primary_ip4': {'current': '', 'proposed': '10.0.0.5'}},
+        )
+        applied, errors = reconciliation.apply_results([result])
+        self.assertEqual(errors, {})
+        self.device.refresh_from_db()
+        self.assertIsNone(self.device.primary_ip4)
+        self.mapping.refresh_from_db()
+        self.assertEqual(self.mapping.data_fingerprint, '')
+        self.assertEqual(self.mapping.netbox_fingerprint, '')
+
+        # So the next scan proposes the IP again instead of skipping the device
+        results = self.reconcile(self.discovered(ip='10.0.0.5', prefix_length=24))
+        self.assertEqual(len(results), 1)
+        self.assertIn('primary_ip4', results[0].diff)
+
+    def test_mac_assigned_elsewhere_is_skipped(self):
+        other = Interface.objects.create(device=self._device('sw2', 'S2'), name='mgmt', type='virtual')
+        MACAddress.objects.create(mac_address='00:11:22:33:44:55', assigned_object=other)
+        result = self.pending_update(
+            {'mac': '00:11:22:33:44:55'}, {'mac': {'current': '', 'proposed': '00:11:22:33:44:55'}},
+        )
+        applied, errors = reconciliation.apply_results([result])
+        self.assertEqual(errors, {})
+        interface = Interface.objects.get(device=self.device, name='mgmt')
+        self.assertIsNone(interface.primary_mac_address)
+        self.mapping.refresh_from_db()
+        self.assertEqual(self.mapping.netbox_fingerprint, '')
+
+    def test_unassigned_mac_is_assigned_and_reused(self):
+        mac = MACAddress.objects.create(mac_address='00:11:22:33:44:55')
+        result = self.pending_update(
+            {'mac': '00:11:22:33:44:55'}, {'mac': {'current': '', 'proposed': '00:11:22:33:44:55'}},
+        )
+        applied, errors = reconciliation.apply_results([result])
+        self.assertEqual(errors, {})
+        interface = Interface.objects.get(device=self.device, name='mgmt')
+        self.assertEqual(interface.primary_mac_address, mac)
+        mac.refresh_from_db()
+        self.assertEqual(mac.assigned_object, interface)
+
+
+class SaveResultsTest(ReconciliationTestCase):
+
+    def scan(self, name):
+        scan_job = ScanJob.objects.create(source=self.source, scan_kinds=['device'])
+        diff = {'name': {'current': 'sw1', 'proposed': name}}
+        return scan_job, reconciliation._make_result(self.source, scan_job, self.discovered(name=name), self.device, diff)
+
+    def pending(self):
+        return DiscoveryResult.objects.filter(source=self.source, status=ResultStatusChoices.STATUS_PENDING)
+
+    def test_rescan_refreshes_pending_result(self):
+        first_job, first = self.scan('core-sw1')
+        reconciliation.save_results(self.source, [first])
+        second_job, second = self.scan('core-sw2')
+        reconciliation.save_results(self.source, [second])
+
+        result = self.pending().get()
+        self.assertEqual(result.pk, first.pk)
+        self.assertEqual(result.scan_job, second_job)
+        self.assertEqual(result.previous_scan_job, first_job)
+        self.assertEqual(result.proposed_data['name'], 'core-sw2')
+
+    def test_concurrent_insert_is_refreshed(self):
+        first_job, first = self.scan('core-sw1')
+        reconciliation.save_results(self.source, [first])
+        second_job, second = self.scan('core-sw2')
+
+        # The lookup runs before the other scan's insert, so it finds no live row
+        real_filter = DiscoveryResult.objects.filter
+        lookups = []
+
+        def racing_filter(*args, **kwargs):
+            lookups.append(kwargs)
+            return DiscoveryResult.objects.none() if len(lookups) == 1 else real_filter(*args, **kwargs)
+
+        with mock.patch.object(DiscoveryResult.objects, 'filter', racing_filter):
+            reconciliation.save_results(self.source, [second])
+
+        result = self.pending().get()
+        self.assertEqual(result.pk, first.pk)
+        self.assertEqual(result.scan_job, second_job)
+        self.assertEqual(result.previous_scan_job, first_job)
+
+    def test_failed_scan_keeps_refreshed_results(self):
+        first_job, first = self.scan('core-sw1')
+        reconciliation.save_results(self.source, [first])
+        failed_job, refreshed = self.scan('core-sw2')
+        inserted = reconciliation._make_result(self.source, failed_job, self.discovered(serial='S9'))
+        reconciliation.save_results(self.source, [refreshed, inserted])
+
+        self.assertEqual(reconciliation.discard_results([failed_job.pk]), 1)
+        result = self.pending().get()
+        self.assertEqual(result.pk, first.pk)
+        self.assertEqual(result.scan_job, first_job)
+        self.assertEqual(
+            DiscoveryResult.objects.get(identity_key='S9').status, ResultStatusChoices.STATUS_DISCARDED,
+        )
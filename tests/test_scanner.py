@@ -0,0 +1,127 @@
+import asyncio
+import unittest
+from collections import Counter
+
+from nb_udm_plugin.prefix_index import PrefixIndex
+from nb_udm_plugin.scanner import (
+    RAW_FIELDS, AsyncSiteNetworks, MappingProfile, SiteNetworks, raw_field_errors, role_rule_errors,
+)
+
+
+class RoleRuleTest(unittest.TestCase):
+    RULES = [
+        {'field': 'model', 'regex': '(', 'role': 'Broken'},
+        {'prefix': 'U6', 'role': 'Access Point'},
+        {'regex': 'USW'},
+    ]
+
+    def test_errors_name_each_bad_rule(self):
+        errors = role_rule_errors({'role_rules': self.RULES})
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith('Rule 1:'))
+        self.assertTrue(errors[1].startswith('Rule 3:'))
+
+    def test_valid_config_has_no_errors(self):
+        self.assertEqual(role_rule_errors({'role_rules': self.RULES[1:2]}), [])
+        self.assertEqual(role_rule_errors({}), [])
+        self.assertEqual(role_rule_errors({'role_rules': {'prefix': 'U6'}}), ['"role_rules" must be a list of rules'])
+
+    def test_invalid_rules_are_skipped_at_scan_time(self):
+        with self.assertLogs('nb_udm_plugin.scanner', 'WARNING'):
+            profile = MappingProfile({'role_rules': self.RULES})
+        self.assertEqual(len(profile.role_rules), 1)
+        self.assertEqual(profile.device_role({'model': 'U6-LR'}), 'Access Point')
+
+
+class RawFieldsTest(unittest.TestCase):
+
+    def test_errors_name_each_bad_override(self):
+        self.assertEqual(raw_field_errors({'raw_fields': {'client': ['mac'], 'device': 'name'}}), [
+            '"raw_fields" for device must be a list of field names',
+        ])
+        self.assertEqual(len(raw_field_errors({'raw_fields': {'site': ['name']}})), 1)
+        self.assertEqual(len(raw_field_errors({'raw_fields': ['mac']})), 1)
+        self.assertEqual(raw_field_errors({}), [])
+
+    def test_invalid_overrides_fall_back_at_scan_time(self):
+        with self.assertLogs('nb_udm_plugin.scanner', 'WARNING'):
+            profile = MappingProfile({'raw_fields': {'client': ['mac'], 'device': 'name'}})
+        self.assertEqual(profile.raw_fields['client'], ('mac',))
+        self.assertEqual(profile.raw_fields['device'], RAW_FIELDS['device'])
+
+        with self.assertLogs('nb_udm_plugin.scanner', 'WARNING'):
+            profile = MappingProfile({'raw_fields': ['mac']})
+        self.assertEqual(profile.raw_fields, RAW_FIELDS)
+
+
+class VlanIdentityTest(unittest.TestCase):
+
+    def test_same_vid_on_two_sites_has_two_identities(self):
+        profile = MappingProfile({})
+        hq = profile.map_vlan({'vlanId': 10, 'name': 'Staff'}, 'HQ')
+        branch = profile.map_vlan({'vlanId': 10, 'name': 'Staff'}, 'Branch')
+        self.assertEqual(hq.identity_key, 'vlan:HQ:10')
+        self.assertNotEqual(hq.identity_key, branch.identity_key)
+
+
+NETWORKS = [{'vlan': 10, 'name': 'Staff', 'ip_subnet': '10.1.10.1/26'}]
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.fetches = Counter()
+
+    def iter_networks(self, site_name):
+        self.fetches[site_name] += 1
+        return iter(NETWORKS)
+
+
+class FakeAsyncClient(FakeClient):
+
+    async def iter_networks(self, site_name):
+        self.fetches[site_name] += 1
+        for network in NETWORKS:
+            yield network
+
+
+class SiteNetworksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.netbox_prefixes = PrefixIndex()
+        self.netbox_prefixes.add('10.0.0.0/8')
+
+    def test_classic_masks_share_the_vlan_fetch(self):
+        client = FakeClient()
+        networks = SiteNetworks(client, MappingProfile({'api_mode': 'classic'}), self.netbox_prefixes)
+        self.assertEqual(networks.networks('default'), NETWORKS)
+        prefixes = networks.prefixes('default')
+        self.assertEqual(prefixes.prefix_length('10.1.10.5'), 26)
+        self.assertEqual(prefixes.prefix_length('10.2.0.1'), 8)
+        self.assertEqual(client.fetches, {'default': 1})
+
+    def test_token_mode_fetches_no_networks_for_masks(self):
+        client = FakeClient()
+        networks = SiteNetworks(client, MappingProfile({}), self.netbox_prefixes)
+        self.assertIs(networks.prefixes('default'), self.netbox_prefixes)
+        self.assertEqual(client.fetches, {})
+
+    def test_scan_without_masks_fetches_no_networks(self):
+        client = FakeClient()
+        networks = SiteNetworks(client, MappingProfile({'api_mode': 'classic'}))
+        self.assertIsNone(networks.prefixes('default'))
+        self.assertEqual(client.fetches, {})
+
+    def test_async_sites_are_fetched_once(self):
+        client = FakeAsyncClient()
+
+        async def scenario():
+            networks = AsyncSiteNetworks(client, MappingProfile({'api_mode': 'classic'}), self.netbox_prefixes)
+            return await asyncio.gather(
+                networks.networks('a'), networks.prefixes('a'), networks.prefixes('b'),
+            )
+
+        vlans, prefixes, _ = asyncio.run(scenario())
+        self.assertEqual(vlans, NETWORKS)
+        self.assertEqual(prefixes.prefix_length('10.1.10.5'), 26)
+        self.assertEqual(client.fetches, {'a': 1, 'b': 1})
@@ -0,0 +1,140 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from nb_udm_plugin import simulator, throttle
+from nb_udm_plugin.throttle import HostThrottle, get_throttle, request_class
+from nb_udm_plugin.unifi_client import UnifiClient
+
+PAGE = 'GET /proxy/network/integration/v1/sites/*/clients'
+LOGIN = 'POST /api/auth/login'
+
+
+class RequestClassTest(unittest.TestCase):
+
+    def test_query_and_ids_are_collapsed(self):
+        self.assertEqual(
+            request_class('GET', 'https://udm:443/proxy/network/integration/v1/sites/'
+                                 '88f7af54-98f8-306a-a1c7-c9349722b1f6/clients?offset=200&limit=200'),
+            PAGE,
+        )
+        self.assertEqual(
+            request_class('GET', 'https://udm/proxy/network/api/s/default/stat/sta'),
+            'GET /proxy/network/api/s/default/stat/sta',
+        )
+
+
+class HostThrottleTest(unittest.TestCase):
+
+    def make_throttle(self, **options):
+        return HostThrottle('test', **options)
+
+    def release(self, t, latency, status=200, key=PAGE):
+        self.assertEqual(t.try_acquire(), 0)
+        t.release(latency, status, key)
+
+    def test_slow_pages_are_not_compared_with_fast_logins(self):
+        t = self.make_throttle(rate_limit=200, concurrency_limit=8)
+        for _ in range(20):
+            self.release(t, 0.002, key=LOGIN)
+        for _ in range(50):
+            self.release(t, 0.4)
+        self.assertGreaterEqual(t.concurrency_limit, 8)
+        self.assertEqual(t.rate_limit, 200)
+
+    def test_jitter_below_the_slack_is_not_congestion(self):
+        t = self.make_throttle(rate_limit=200, concurrency_limit=8)
+        for i in range(100):
+            self.release(t, 0.001 if i % 2 else 0.01)
+        self.assertGreaterEqual(t.concurrency_limit, 8)
+
+    def test_latency_spike_halves_limits(self):
+        t = self.make_throttle(rate_limit=200, concurrency_limit=8)
+        for _ in range(throttle.MIN_LATENCY_SAMPLES):
+            self.release(t, 0.1)
+        limit = t.concurrency_limit
+        self.release(t, 2.0)
+        self.assertEqual(t.concurrency_limit, limit // 2)
+
+    def test_latency_is_ignored_until_the_class_has_samples(self):
+        t = self.make_throttle(rate_limit=200, concurrency_limit=8)
+        self.release(t, 0.1)
+        self.release(t, 5.0)
+        self.assertGreaterEqual(t.concurrency_limit, 8)
+
+    def test_errors_halve_limits_once_per_cooldown(self):
+        t = self.make_throttle(rate_limit=40, concurrency_limit=8)
+        self.release(t, 0.1, status=503)
+        self.release(t, 0.1, status=429)
+        self.assertEqual(t.concurrency_limit, 4)
+        self.assertEqual(t.rate_limit, 20)
+
+    def test_network_error_is_congestion(self):
+        t = self.make_throttle(concurrency_limit=8)
+        self.release(t, 0.1, status=None)
+        self.assertEqual(t.concurrency_limit, 4)
+
+    def test_fixed_limits_without_adaptive_throttle(self):
+        t = self.make_throttle(rate_limit=40, concurrency_limit=8, adaptive_throttle=False)
+        for _ in range(10):
+            self.release(t, 0.1, status=503)
+        self.assertEqual((t.rate_limit, t.concurrency_limit), (40, 8))
+
+    def test_concurrency_limit_caps_in_flight(self):
+        t = self.make_throttle(rate_limit=200, concurrency_limit=2)
+        self.assertEqual(t.try_acquire(), 0)
+        self.assertEqual(t.try_acquire(), 0)
+        self.assertGreater(t.try_acquire(), 0)
+        t.cancel()
+        self.assertEqual(t.try_acquire(), 0)
+
+
+@mock.patch.dict(throttle._throttles, clear=True)
+class GetThrottleTest(unittest.TestCase):
+    OPTIONS = {
+        'rate_limit': 20, 'min_rate_limit': 1, 'max_rate_limit': 200, 'concurrency_limit': 8,
+        'max_concurrency_limit': 64, 'adaptive_throttle': True, 'latency_tolerance': 2.0,
+    }
+
+    def test_same_settings_keep_adapted_limits(self):
+        t = get_throttle('host', **self.OPTIONS)
+        self.assertEqual(t.try_acquire(), 0)
+        t.release(0.1, None)
+        self.assertIs(get_throttle('host', **self.OPTIONS), t)
+        self.assertEqual(t.concurrency_limit, 4)
+
+    def test_changed_starting_limits_are_applied(self):
+        get_throttle('host', **self.OPTIONS)
+        t = get_throttle('host', **{**self.OPTIONS, 'rate_limit': 5, 'concurrency_limit': 2})
+        self.assertEqual((t.rate_limit, t.concurrency_limit), (5, 2))
+
+    def test_bounds_clamp_current_limits(self):
+        get_throttle('host', **self.OPTIONS)
+        t = get_throttle('host', **{**self.OPTIONS, 'max_rate_limit': 10, 'max_concurrency_limit': 4})
+        self.assertEqual((t.rate_limit, t.concurrency_limit), (10, 4))
+
+
+class SimulatorThrottleTest(unittest.TestCase):
+    """A healthy controller on loopback must not drive the limits down."""
+
+    def setUp(self):
+        controller = simulator.SimulatedController(sites=3, devices=50, clients=1000, networks=4)
+        self.server = simulator.make_server(controller, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_scan_keeps_starting_limits(self):
+        client = UnifiClient(f'http://127.0.0.1:{self.server.server_address[1]}', token='test')
+        client.connect()
+        started = time.monotonic()
+        for site in client.sites:
+            for items in (client.iter_devices(site), client.iter_clients(site), client.iter_networks(site)):
+                for _ in items:
+                    pass
+        client.disconnect()
+
+        self.assertGreaterEqual(client.transport.throttle.rate_limit, 20)
+        self.assertGreaterEqual(client.transport.throttle.concurrency_limit, 8)
+        self.assertLess(time.monotonic() - started, 10)
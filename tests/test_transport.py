@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import requests
+
+from nb_udm_plugin import throttle, transport
+from nb_udm_plugin.transport import CircuitBreaker, CircuitOpenError, UnifiTransport
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_single_trial_when_half_open(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        open_breaker(breaker)
+        self.assertTrue(breaker.before_request())
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_successful_trial_closes(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        open_breaker(breaker)
+        breaker.before_request()
+        breaker.record_success()
+        self.assertFalse(breaker.before_request())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        open_breaker(breaker)
+        breaker.before_request()
+        self.assertTrue(breaker.record_failure())
+        breaker.end_trial()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_abandoned_trial_lets_another_through(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        open_breaker(breaker)
+        breaker.before_request()
+        breaker.end_trial()
+        self.assertTrue(breaker.before_request())
+
+
+@mock.patch.dict(transport._breakers, clear=True)
+@mock.patch.dict(throttle._throttles, clear=True)
+class TransportTrialTest(unittest.TestCase):
+
+    def make_transport(self, session):
+        t = UnifiTransport(session, 'breaker-test', breaker_threshold=1, breaker_reset=60, max_retries=0)
+        open_breaker(t.breaker)
+        return t
+
+    def test_trial_raising_unexpected_error_is_resolved(self):
+        session = requests.Session()
+        t = self.make_transport(session)
+        with mock.patch.object(session, 'request', side_effect=ValueError('bad header')):
+            with self.assertRaises(ValueError):
+                t.request('GET', 'http://breaker-test/api/self/sites')
+        self.assertEqual(t.throttle.in_flight, 0)
+
+        response = requests.Response()
+        response.status_code = 200
+        with mock.patch.object(session, 'request', return_value=response):
+            self.assertIs(t.request('GET', 'http://breaker-test/api/self/sites'), response)
+        self.assertIsNone(t.breaker.opened_at)
+
+    def test_async_trial_cancelled_is_resolved(self):
+        from nb_udm_plugin.async_client import AsyncUnifiTransport
+
+        async def scenario():
+            t = AsyncUnifiTransport('breaker-test', breaker_threshold=1, breaker_reset=60, max_retries=0)
+            open_breaker(t.breaker)
+            with mock.patch.object(t.client, 'request', side_effect=asyncio.CancelledError):
+                with self.assertRaises(asyncio.CancelledError):
+                    await t.request('GET', 'http://breaker-test/api/self/sites')
+            self.assertTrue(t.breaker.before_request())
+            await t.aclose()
+
+        asyncio.run(scenario())
@@ -0,0 +1,197 @@
+"""
+Adaptive per-controller rate limiting and concurrency control.
+
+Every transport talking to the same host shares one HostThrottle, so all
+scan jobs in a worker process draw from the same budget. The throttle
+combines a token bucket (requests per second) with a concurrency limit
+(requests in flight), and adjusts both AIMD-style:
+
+- a 429, a 5xx, a network error, or a latency above ``latency_tolerance``
+  times the baseline of its request class halves both limits (at most once
+  per second);
+- every other response raises them by roughly one unit per round of
+  requests, up to the configured maximums.
+
+The latency baseline is the median of the last ``LATENCY_WINDOW`` responses
+of the same request class (method and path, with ids collapsed), so a full
+200-item page is compared with other full pages rather than with the
+fastest login seen. A class needs ``MIN_LATENCY_SAMPLES`` responses before
+its latency counts, and a response must also be ``LATENCY_SLACK`` seconds
+over the baseline, so millisecond jitter on a fast link is not congestion.
+
+Acquisition is non-blocking (try_acquire returns how long to wait), so the
+threaded and asyncio transports can share one throttle.
+"""
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+POLL_INTERVAL = 0.01
+DECREASE_COOLDOWN = 1.0
+LATENCY_WINDOW = 32
+MIN_LATENCY_SAMPLES = 8
+LATENCY_SLACK = 0.25
+
+_ID_SEGMENT_RE = re.compile(r'^(?:\d+|[0-9a-f]{24}|[0-9a-f]{8}-[0-9a-f-]{27})$', re.IGNORECASE)
+
+
+def request_class(method, url):
+    """Method and path of a request, without the query and with id segments collapsed."""
+    path = urlsplit(url).path
+    return f"{method} {'/'.join('*' if _ID_SEGMENT_RE.match(part) else part for part in path.split('/'))}"
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate)
+
+    def take(self, now):
+        """Take a token. Returns 0 on success, else seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class HostThrottle:
+    """Shared rate and concurrency limits for one controller host."""
+
+    def __init__(self, host, rate_limit=20, min_rate_limit=1, max_rate_limit=200,
+                 concurrency_limit=8, max_concurrency_limit=64, adaptive_throttle=True,
+                 latency_tolerance=2.0):
+        self.host = host
+        self.bucket = TokenBucket(rate_limit)
+        self.limit = float(concurrency_limit)
+        self.initial_rate = rate_limit
+        self.initial_limit = concurrency_limit
+        self.in_flight = 0
+        self.latencies = {}  # request class -> recent latencies
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.configure(
+            min_rate_limit=min_rate_limit, max_rate_limit=max_rate_limit,
+            max_concurrency_limit=max_concurrency_limit, adaptive_throttle=adaptive_throttle,
+            latency_tolerance=latency_tolerance,
+        )
+
+    def configure(self, min_rate_limit, max_rate_limit, max_concurrency_limit,
+                  adaptive_throttle, latency_tolerance, rate_limit=None, concurrency_limit=None):
+        """
+        Update the bounds and starting limits.
+
+        A ``rate_limit`` or ``concurrency_limit`` that differs from the one in
+        force restarts the throttle from it; passing the same values again
+        keeps the adapted limits (clamped to the new bounds). Without
+        ``adaptive_throttle`` the starting limits are used as they are.
+        """
+        with self._lock:
+            self.min_rate = float(min_rate_limit)
+            self.max_rate = float(max_rate_limit)
+            self.max_limit = float(max_concurrency_limit)
+            self.adaptive = adaptive_throttle
+            self.latency_tolerance = latency_tolerance
+            if rate_limit is not None and rate_limit != self.initial_rate:
+                self.initial_rate = rate_limit
+                self.bucket.rate = float(rate_limit)
+            if concurrency_limit is not None and concurrency_limit != self.initial_limit:
+                self.initial_limit = concurrency_limit
+                self.limit = float(concurrency_limit)
+            if not self.adaptive:
+                self.bucket.rate = float(self.initial_rate)
+                self.limit = float(self.initial_limit)
+            self.bucket.rate = min(max(self.bucket.rate, self.min_rate), self.max_rate)
+            self.limit = min(max(self.limit, 1.0), self.max_limit)
+
+    @property
+    def rate_limit(self):
+        return round(self.bucket.rate, 2)
+
+    @property
+    def concurrency_limit(self):
+        return int(self.limit)
+
+    def try_acquire(self):
+        """Claim a request slot. Returns 0 on success, else seconds to wait before retrying."""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return POLL_INTERVAL
+            wait = self.bucket.take(time.monotonic())
+            if wait:
+                return wait
+            self.in_flight += 1
+            return 0
+
+    def cancel(self):
+        """Return a slot without adapting (the request never completed)."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def baseline(self, key):
+        """Median latency of the recent responses of a request class, or None."""
+        window = self.latencies.get(key)
+        if not window or len(window) < MIN_LATENCY_SAMPLES:
+            return None
+        return statistics.median(window)
+
+    def release(self, latency, status=None, key=''):
+        """
+        Return a slot and adapt the limits to the outcome.
+
+        ``status`` is None for a network error; ``key`` is the request class
+        (see request_class) whose baseline the latency is compared with.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if not self.adaptive:
+                return
+
+            congested = status is None or status == 429 or status >= 500
+            if not congested:
+                baseline = self.baseline(key)
+                congested = baseline is not None and latency > max(
+                    baseline * self.latency_tolerance, baseline + LATENCY_SLACK,
+                )
+                window = self.latencies.get(key)
+                if window is None:
+                    window = self.latencies[key] = deque(maxlen=LATENCY_WINDOW)
+                # Slow responses join the window too, so a controller that has
+                # become slower overall moves the median instead of halving forever
+                window.append(latency)
+
+            if congested:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(1.0, self.limit / 2)
+                    self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + 1 / self.bucket.rate)
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(host, **options):
+    """Return the process-wide throttle for a controller host, updating its settings (see configure)."""
+    with _throttles_lock:
+        throttle = _throttles.get(host)
+        if throttle is None:
+            throttle = _throttles[host] = HostThrottle(host, **options)
+        else:
+            throttle.configure(**options)
+        return throttle
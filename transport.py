@@ -0,0 +1,244 @@
+"""
+HTTP transport for the UniFi client — timeouts, a sized connection pool,
+retry with jittered backoff, and a per-host circuit breaker.
+
+All limits come from the DiscoverySource config (see README):
+    connect_timeout, read_timeout   - seconds, passed to every request
+    pool_size                       - HTTPAdapter connections kept per host
+    max_retries, backoff_factor,
+    backoff_max                     - retry policy for 429/5xx and network errors
+    breaker_threshold, breaker_reset - consecutive failures before the host's
+                                       circuit opens, and seconds until a
+                                       trial request is let through
+    rate_limit, max_rate_limit, min_rate_limit,
+    concurrency_limit, max_concurrency_limit,
+    adaptive_throttle, latency_tolerance
+                                    - shared per-host throttle (see throttle.py)
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .throttle import get_throttle, request_class
+
+logger = logging.getLogger('nb_udm_plugin.transport')
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UnifiAPIError(Exception):
+    """A controller request failed after exhausting retries."""
+
+
+class CircuitOpenError(UnifiAPIError):
+    """The circuit breaker for a controller host is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker shared by all clients of one host.
+
+    After ``threshold`` consecutive failures the circuit opens and requests
+    fail immediately. Once ``reset_timeout`` seconds have passed a single
+    trial request is allowed; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raise CircuitOpenError if requests to this host should fail fast.
+
+        Returns True when the request is the half-open trial; the caller must
+        then call end_trial once the request is over, however it ended.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError('Circuit open: controller has failed repeatedly')
+            self._trial_in_flight = True
+            return True
+
+    def end_trial(self):
+        """Let another trial through if this one ended without a success or failure."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Record a failure. Returns True if this failure opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            was_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if was_trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host, threshold, reset_timeout):
+    """Return the process-wide circuit breaker for a controller host."""
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(threshold, reset_timeout)
+        else:
+            breaker.threshold = threshold
+            breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+class RetryPolicy:
+    """
+    Timeouts, retry/backoff settings, circuit breaker, throttle and counters for one host.
+
+    Shared by the requests-based UnifiTransport and the async transport.
+    """
+
+    DEFAULTS = {
+        'connect_timeout': 5,
+        'read_timeout': 30,
+        'pool_size': 16,
+        'max_retries': 3,
+        'backoff_factor': 0.5,
+        'backoff_max': 30,
+        'breaker_threshold': 5,
+        'breaker_reset': 60,
+        'rate_limit': 20,
+        'min_rate_limit': 1,
+        'max_rate_limit': 200,
+        'concurrency_limit': 8,
+        'max_concurrency_limit': 64,
+        'adaptive_throttle': True,
+        'latency_tolerance': 2.0,
+    }
+
+    THROTTLE_OPTIONS = (
+        'rate_limit', 'min_rate_limit', 'max_rate_limit', 'concurrency_limit',
+        'max_concurrency_limit', 'adaptive_throttle', 'latency_tolerance',
+    )
+
+    def __init__(self, host, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown transport option(s): {', '.join(sorted(unknown))}")
+        opts = {**self.DEFAULTS, **options}
+
+        self.host = host
+        self.connect_timeout = opts['connect_timeout']
+        self.read_timeout = opts['read_timeout']
+        self.pool_size = opts['pool_size']
+        self.max_retries = opts['max_retries']
+        self.backoff_factor = opts['backoff_factor']
+        self.backoff_max = opts['backoff_max']
+        self.breaker = get_breaker(host, opts['breaker_threshold'], opts['breaker_reset'])
+        self.throttle = get_throttle(host, **{key: opts[key] for key in self.THROTTLE_OPTIONS})
+
+        self.stats = {'retries': 0, 'breaker_trips': 0}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def options_from_config(cls, config):
+        """Pick the transport options present in a DiscoverySource config."""
+        return {key: config[key] for key in cls.DEFAULTS if key in config}
+
+    def _record_retry(self):
+        with self._stats_lock:
+            self.stats['retries'] += 1
+
+    def _record_failure(self):
+        if self.breaker.record_failure():
+            logger.error(f'Circuit opened for {self.host}')
+            with self._stats_lock:
+                self.stats['breaker_trips'] += 1
+
+    def _backoff(self, attempt, retry_after=''):
+        """Full-jitter exponential backoff, honouring a numeric Retry-After."""
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+
+class UnifiTransport(RetryPolicy):
+    """Send requests on a pooled requests.Session with timeouts, retries and circuit breaking."""
+
+    def __init__(self, session, host, **options):
+        super().__init__(host, **options)
+        self.session = session
+        self.timeout = (self.connect_timeout, self.read_timeout)
+
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=0,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying 429/5xx responses and network errors.
+
+        Returns the final response (which may still carry an error status)
+        or raises UnifiAPIError when the host is unreachable.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        key = request_class(method, url)
+        while True:
+            trial = self.breaker.before_request()
+            try:
+                while (wait := self.throttle.try_acquire()) > 0:
+                    time.sleep(wait)
+                started = time.monotonic()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    self.throttle.release(time.monotonic() - started)
+                    self._record_failure()
+                    if attempt >= self.max_retries:
+                        raise UnifiAPIError(f'{method} {url} failed: {e}') from e
+                    delay = self._backoff(attempt)
+                    logger.warning(f'{method} {url} failed ({e}), retrying in {delay:.1f}s')
+                except BaseException:
+                    self.throttle.cancel()
+                    raise
+                else:
+                    self.throttle.release(time.monotonic() - started, response.status_code, key)
+                    if response.status_code not in RETRY_STATUSES:
+                        self.breaker.record_success()
+                        return response
+                    self._record_failure()
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt, response.headers.get('Retry-After', ''))
+                    logger.warning(f'{method} {url} returned {response.status_code}, retrying in {delay:.1f}s')
+                    response.close()
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+
+            attempt += 1
+            self._record_retry()
+            time.sleep(delay)
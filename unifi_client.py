@@ -12,64 +12,93 @@ Env vars:
 """
 import logging
 import os
+import threading
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import requests
-from urllib3.exceptions import InsecureRequestWarning
+from urllib3.exceptions import HTTPError, InsecureRequestWarning
+
+from . import jsonstream
+from .cassette import RecordingTransport, ReplayTransport
+from .transport import UnifiAPIError, UnifiTransport
 
 warnings.simplefilter('ignore', InsecureRequestWarning)
 logger = logging.getLogger('nb_udm_plugin.unifi_client')
 
 
-class UnifiClient:
+class BaseUnifiClient:
     """
-    UniFi API client supporting both API token and classic authentication.
+    Connection settings and endpoint logic shared by the sync and async clients.
 
-    API Token mode uses the X-API-KEY header (UniFi Integration API).
-    Classic mode uses username/password with optional MFA (Legacy API).
+    Subclasses provide the I/O: connect, _api_request and the iterators.
     """
 
-    def __init__(self, base_url, api_mode='token', site='default', verify_ssl=False, token=''):
+    # The Integration API caps limit at 200 on collection endpoints
+    PAGE_SIZE = 200
+    PREFETCH_PAGES = 4
+
+    SITES_ENDPOINT = '/proxy/network/integration/v1/sites'
+    LEGACY_SITES_ENDPOINT = '/api/self/sites'
+    LOGIN_ENDPOINT = '/api/auth/login'
+
+    def __init__(self, base_url, api_mode='token', site='default', verify_ssl=False, token='',
+                 page_size=PAGE_SIZE, prefetch_pages=PREFETCH_PAGES, transport_options=None,
+                 stream_json=True, cassette_mode='', cassette_path=''):
         self.base_url = base_url.rstrip('/')
+        self.host = urlsplit(self.base_url).netloc
         self.api_mode = api_mode
         self.site = site
         self.verify_ssl = verify_ssl
+        self.page_size = page_size
+        self.prefetch_pages = max(1, prefetch_pages)
+        self.transport_options = transport_options or {}
+        self.stream_json = stream_json
+        self.cassette_mode = cassette_mode
+        self.cassette_path = cassette_path
         self._explicit_token = token
-        self.session = requests.Session()
-        self.session.verify = verify_ssl
         self.sites = {}
         self._connected = False
+        self._authenticated = False
 
-    def connect(self):
-        """Establish connection and authenticate."""
-        if self.api_mode == 'token':
-            token = self._explicit_token or os.getenv('NB_UDM_UNIFI_TOKEN', '')
-            if not token:
-                raise ValueError(
-                    'No API token provided. Set token on the Discovery Source '
-                    'or the NB_UDM_UNIFI_TOKEN environment variable.'
-                )
-            self._api_token = token
-            logger.info(f'Using API token authentication for {self.base_url}')
-        else:
-            username = os.getenv('NB_UDM_UNIFI_USERNAME', '')
-            password = os.getenv('NB_UDM_UNIFI_PASSWORD', '')
-            if not username or not password:
-                raise ValueError('NB_UDM_UNIFI_USERNAME and NB_UDM_UNIFI_PASSWORD must be set')
-            self._authenticate_classic(username, password)
+    @classmethod
+    def from_source(cls, source):
+        """Build a client from a DiscoverySource's config and token."""
+        config = source.config
+        return cls(
+            base_url=f"{config.get('scheme', 'https')}://{config.get('host', '')}:{config.get('port', 443)}",
+            api_mode=config.get('api_mode', 'token'),
+            site=config.get('site', 'default'),
+            verify_ssl=config.get('verify_ssl', False),
+            token=source.token,
+            page_size=config.get('page_size', cls.PAGE_SIZE),
+            prefetch_pages=config.get('prefetch_pages', cls.PREFETCH_PAGES),
+            transport_options=UnifiTransport.options_from_config(config),
+            stream_json=config.get('stream_json', True),
+            cassette_mode=config.get('cassette_mode', ''),
+            cassette_path=config.get('cassette_path', ''),
+        )
 
-        self.sites = self._get_sites()
-        self._connected = True
-        logger.info(f'Connected. Found {len(self.sites)} site(s)')
+    def _load_token(self):
+        """Load the API token for token mode."""
+        token = self._explicit_token or os.getenv('NB_UDM_UNIFI_TOKEN', '')
+        if not token:
+            raise ValueError(
+                'No API token provided. Set token on the Discovery Source '
+                'or the NB_UDM_UNIFI_TOKEN environment variable.'
+            )
+        self._api_token = token
+        logger.info(f'Using API token authentication for {self.base_url}')
 
-    def disconnect(self):
-        """Close the session."""
-        self.session.close()
-        self._connected = False
+    def _login_payload(self):
+        """Build the classic-mode login payload, including a TOTP code if configured."""
+        username = os.getenv('NB_UDM_UNIFI_USERNAME', '')
+        password = os.getenv('NB_UDM_UNIFI_PASSWORD', '')
+        if not username or not password:
+            raise ValueError('NB_UDM_UNIFI_USERNAME and NB_UDM_UNIFI_PASSWORD must be set')
 
-    def _authenticate_classic(self, username, password):
-        """Authenticate using username/password (classic mode)."""
-        login_url = f'{self.base_url}/api/auth/login'
         payload = {
             'username': username,
             'password': password,
@@ -85,11 +114,7 @@ class UnifiClient:
             except ImportError:
                 logger.warning('pyotp not installed, skipping MFA')
 
-        response = self.session.post(login_url, json=payload)
-        if response.status_code == 200:
-            logger.info('Classic authentication successful')
-        else:
-            raise Exception(f'Authentication failed: {response.status_code} - {response.text}')
+        return payload
 
     def _get_headers(self):
         """Get appropriate headers based on auth mode."""
@@ -101,47 +126,44 @@ class UnifiClient:
             headers['X-API-KEY'] = self._api_token
         return headers
 
-    def _api_request(self, endpoint):
-        """Make a GET API request."""
-        url = f'{self.base_url}{endpoint}'
-        headers = self._get_headers()
-        logger.debug(f'GET {url}')
+    def _page_endpoint(self, endpoint, offset):
+        """Append offset/limit paging parameters to an Integration API endpoint."""
+        return f'{endpoint}?offset={offset}&limit={self.page_size}'
 
-        try:
-            response = self.session.get(url, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f'API request failed: {e}')
-            return None
+    @staticmethod
+    def _remaining_offsets(first_page):
+        """Offsets of the pages after the first, derived from its totalCount."""
+        items = first_page.get('data', [])
+        total = first_page.get('totalCount', len(items))
+        # The controller may cap the limit below what was requested
+        step = first_page.get('limit') or len(items)
+        if not step or step >= total:
+            return range(0)
+        return range(step, total, step)
 
-    def _get_sites(self):
-        """Fetch all sites from the controller."""
-        sites = {}
+    @staticmethod
+    def _legacy_items(result):
+        """Items of a legacy API response (wrapped in meta/data)."""
+        if result and result.get('meta', {}).get('rc') == 'ok':
+            return result.get('data', [])
+        return []
 
+    def _parse_site(self, site):
+        """Normalize a site record from either API into (name, info)."""
         if self.api_mode == 'token':
-            result = self._api_request('/proxy/network/integration/v1/sites?limit=1000')
-            if result and 'data' in result:
-                for site in result['data']:
-                    name = site.get('name', site.get('internalReference', 'unknown'))
-                    sites[name] = {
-                        'id': site.get('id'),
-                        'name': name,
-                        'internal_reference': site.get('internalReference'),
-                        'desc': site.get('name', name),
-                    }
-        else:
-            result = self._api_request('/api/self/sites')
-            if result and result.get('meta', {}).get('rc') == 'ok':
-                for site in result.get('data', []):
-                    name = site.get('desc', site.get('name', 'unknown'))
-                    sites[name] = {
-                        'id': site.get('_id'),
-                        'name': site.get('name'),
-                        'desc': name,
-                    }
-
-        return sites
+            name = site.get('name', site.get('internalReference', 'unknown'))
+            return name, {
+                'id': site.get('id'),
+                'name': name,
+                'internal_reference': site.get('internalReference'),
+                'desc': site.get('name', name),
+            }
+        name = site.get('desc', site.get('name', 'unknown'))
+        return name, {
+            'id': site.get('_id'),
+            'name': site.get('name'),
+            'desc': name,
+        }
 
     def _resolve_site(self, site_name):
         """Find site info by name or internal reference."""
@@ -157,72 +179,273 @@ class UnifiClient:
                 return info.get('name')
         return site_name
 
-    def get_devices(self, site_name=None):
-        """Fetch all network devices from a site."""
-        site_name = site_name or self.site
-        devices = []
-
+    def _site_endpoint(self, site_name, resource, legacy_path):
+        """Endpoint of one site collection, or None if the site is unknown."""
         if self.api_mode == 'token':
             site_info = self._resolve_site(site_name)
             if not site_info:
                 logger.warning(f"Site '{site_name}' not found")
-                return devices
-            result = self._api_request(
-                f"/proxy/network/integration/v1/sites/{site_info['id']}/devices?limit=1000"
-            )
-            if result and 'data' in result:
-                devices = result['data']
+                return None
+            return f"/proxy/network/integration/v1/sites/{site_info['id']}/{resource}"
+        site_key = self._get_site_key(site_name)
+        return f'/proxy/network/api/s/{site_key}/{legacy_path}'
+
+
+class UnifiClient(BaseUnifiClient):
+    """
+    UniFi API client supporting both API token and classic authentication.
+
+    API Token mode uses the X-API-KEY header (UniFi Integration API).
+    Classic mode uses username/password with optional MFA (Legacy API).
+
+    Requests go through a UnifiTransport (timeouts, pooled connections,
+    retries and a per-host circuit breaker); failures raise UnifiAPIError.
+
+    Integration API collections are paged with offset/limit; the iter_*
+    methods follow totalCount and prefetch up to ``prefetch_pages`` pages
+    ahead of the consumer, so memory stays bounded by the page window.
+    Unpaged legacy collections are decoded incrementally when
+    ``stream_json`` is set.
+
+    With ``cassette_mode`` set to 'record' or 'replay', traffic is written
+    to or served from the cassette file at ``cassette_path``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        self.session.verify = self.verify_ssl
+        self.transport = UnifiTransport(self.session, self.host, **self.transport_options)
+        if self.cassette_mode == 'record':
+            self.transport = RecordingTransport(self.transport, self.cassette_path)
+        elif self.cassette_mode == 'replay':
+            self.transport = ReplayTransport(self.cassette_path)
+        self._auth_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def connect(self):
+        """
+        Establish connection and authenticate.
+
+        A classic-mode client that already holds a session (from an earlier
+        connect or restored cookies) skips the login; an expired session is
+        detected by the 401 on the first request and renewed then.
+        """
+        if not self._authenticated:
+            self._login()
+
+        self.sites = self._get_sites()
+        self._connected = True
+        logger.info(f'Connected. Found {len(self.sites)} site(s)')
+
+    def disconnect(self):
+        """Close the session and the page prefetch pool."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+        self._connected = False
+        self._authenticated = False
+
+    def export_cookies(self):
+        """Return the session cookies of an authenticated classic-mode client."""
+        return self.session.cookies.get_dict()
+
+    def restore_cookies(self, cookies):
+        """Adopt session cookies from an earlier login, skipping the next one."""
+        if self.api_mode == 'token' or not cookies:
+            return
+        self.session.cookies.update(cookies)
+        self._authenticated = True
+
+    def _login(self):
+        """Load credentials and authenticate according to the API mode."""
+        if self.cassette_mode == 'replay':
+            # Recorded responses need no credentials
+            self._api_token = ''
+        elif self.api_mode == 'token':
+            self._load_token()
+        else:
+            self._authenticate_classic()
+        self._authenticated = True
+
+    def _authenticate_classic(self):
+        """Authenticate using username/password (classic mode)."""
+        login_url = f'{self.base_url}{self.LOGIN_ENDPOINT}'
+        response = self.transport.request('POST', login_url, json=self._login_payload())
+        if response.status_code == 200:
+            logger.info('Classic authentication successful')
         else:
-            site_key = self._get_site_key(site_name)
-            result = self._api_request(f'/proxy/network/api/s/{site_key}/stat/device')
-            if result and result.get('meta', {}).get('rc') == 'ok':
-                devices = result.get('data', [])
+            raise Exception(f'Authentication failed: {response.status_code} - {response.text}')
 
-        logger.info(f"Found {len(devices)} device(s) on site '{site_name}'")
-        return devices
+    def _get(self, endpoint, stream=False):
+        """Send a GET, renewing an expired classic session once. Raises UnifiAPIError."""
+        url = f'{self.base_url}{endpoint}'
+        headers = self._get_headers()
+        logger.debug(f'GET {url}')
 
-    def get_clients(self, site_name=None):
-        """Fetch all connected clients from a site."""
-        site_name = site_name or self.site
-        clients = []
+        response = self.transport.request('GET', url, headers=headers, stream=stream)
+        if response.status_code == 401 and self.api_mode != 'token':
+            response.close()
+            self._reauthenticate()
+            response = self.transport.request('GET', url, headers=headers, stream=stream)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            response.close()
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {url} failed: {e}') from e
+        return response
+
+    def _api_request(self, endpoint):
+        """Make a GET API request and decode the JSON body. Raises UnifiAPIError on failure."""
+        response = self._get(endpoint)
+        try:
+            return jsonstream.loads(response.content)
+        except ValueError as e:
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {endpoint} returned invalid JSON: {e}') from e
+
+    def _api_stream(self, endpoint):
+        """
+        Make a GET API request and yield the items of its ``data`` array.
+
+        The body is decoded incrementally as it arrives (see jsonstream), so
+        large legacy responses are never materialized as a whole. An error
+        envelope, a malformed body or a connection dropped mid-body raises
+        UnifiAPIError.
+        """
+        response = self._get(endpoint, stream=True)
+        try:
+            response.raw.decode_content = True
+            yield from jsonstream.iter_data_items(response.raw)
+        except jsonstream.EnvelopeError as e:
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {endpoint} failed: {e}') from e
+        except ValueError as e:
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {endpoint} returned invalid JSON: {e}') from e
+        except (HTTPError, requests.exceptions.RequestException, OSError) as e:
+            # The connection can fail while the body is still being read
+            logger.error(f'API request failed: {e}')
+            raise UnifiAPIError(f'GET {endpoint} failed while reading the response: {e}') from e
+        finally:
+            response.close()
+
+    def _reauthenticate(self):
+        """Log in again after the controller rejected the session cookie."""
+        stale = self.export_cookies()
+        with self._auth_lock:
+            # Another thread may have renewed the session while we waited
+            if self.export_cookies() == stale:
+                logger.info(f'Session for {self.base_url} expired, re-authenticating')
+                self.session.cookies.clear()
+                self._login()
 
+    def _iter_pages(self, endpoint):
+        """
+        Yield items from a paginated Integration API collection.
+
+        The first page reveals totalCount; the remaining offsets are then
+        requested on the shared prefetch pool, keeping at most
+        ``prefetch_pages`` pages of this collection queued or in flight.
+        Items are yielded in offset order.
+        """
+        first = self._api_request(self._page_endpoint(endpoint, 0))
+        if not first or 'data' not in first:
+            return
+        yield from first['data']
+
+        offsets = iter(self._remaining_offsets(first))
+        pool = self._prefetch_pool()
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(pool.submit(self._api_request, self._page_endpoint(endpoint, offset)))
+                if len(pending) >= self.prefetch_pages:
+                    break
+            while pending:
+                page = pending.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(pool.submit(self._api_request, self._page_endpoint(endpoint, offset)))
+                if page and 'data' in page:
+                    yield from page['data']
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _prefetch_pool(self):
+        """
+        The client's page prefetch pool, shared by every collection being paged.
+
+        Concurrent scans of several sites and endpoints draw from the same
+        ``prefetch_pages`` threads, so paging adds at most that many requests
+        on top of the scan's own fetches instead of multiplying them.
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.prefetch_pages, thread_name_prefix='unifi-page')
+            return self._pool
+
+    def _iter_legacy(self, endpoint):
+        """Yield items from a legacy API endpoint (unpaged, wrapped in meta/data)."""
+        yield from self._legacy_items(self._api_request(endpoint))
+
+    def _iter_legacy_stream(self, endpoint):
+        """Like _iter_legacy, but decoding the ``data`` array item by item."""
+        yield from self._api_stream(endpoint)
+
+    def _get_sites(self):
+        """Fetch all sites from the controller."""
         if self.api_mode == 'token':
-            site_info = self._resolve_site(site_name)
-            if not site_info:
-                return clients
-            result = self._api_request(
-                f"/proxy/network/integration/v1/sites/{site_info['id']}/clients?limit=1000"
-            )
-            if result and 'data' in result:
-                clients = result['data']
+            items = self._iter_pages(self.SITES_ENDPOINT)
         else:
-            site_key = self._get_site_key(site_name)
-            result = self._api_request(f'/proxy/network/api/s/{site_key}/stat/sta')
-            if result and result.get('meta', {}).get('rc') == 'ok':
-                clients = result.get('data', [])
-
-        logger.info(f"Found {len(clients)} client(s) on site '{site_name}'")
-        return clients
+            items = self._iter_legacy(self.LEGACY_SITES_ENDPOINT)
+        return dict(self._parse_site(site) for site in items)
 
-    def get_networks(self, site_name=None):
-        """Fetch all networks (VLANs) from a site."""
+    def _iter_site_objects(self, site_name, resource, legacy_path, label):
+        """Yield objects of one collection from a site in either API mode."""
         site_name = site_name or self.site
-        networks = []
+        endpoint = self._site_endpoint(site_name, resource, legacy_path)
+        if endpoint is None:
+            return
 
         if self.api_mode == 'token':
-            site_info = self._resolve_site(site_name)
-            if not site_info:
-                return networks
-            result = self._api_request(
-                f"/proxy/network/integration/v1/sites/{site_info['id']}/networks?limit=1000"
-            )
-            if result and 'data' in result:
-                networks = result['data']
+            items = self._iter_pages(endpoint)
+        elif self.stream_json:
+            items = self._iter_legacy_stream(endpoint)
         else:
-            site_key = self._get_site_key(site_name)
-            result = self._api_request(f'/proxy/network/api/s/{site_key}/rest/networkconf')
-            if result and result.get('meta', {}).get('rc') == 'ok':
-                networks = result.get('data', [])
+            items = self._iter_legacy(endpoint)
+
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+        logger.info(f"Found {count} {label}(s) on site '{site_name}'")
 
-        logger.info(f"Found {len(networks)} network(s) on site '{site_name}'")
-        return networks
+    def iter_devices(self, site_name=None):
+        """Iterate over all network devices on a site, page by page."""
+        return self._iter_site_objects(site_name, 'devices', 'stat/device', 'device')
+
+    def iter_clients(self, site_name=None):
+        """Iterate over all connected clients on a site, page by page."""
+        return self._iter_site_objects(site_name, 'clients', 'stat/sta', 'client')
+
+    def iter_networks(self, site_name=None):
+        """Iterate over all networks (VLANs) on a site, page by page."""
+        return self._iter_site_objects(site_name, 'networks', 'rest/networkconf', 'network')
+
+    def get_devices(self, site_name=None):
+        """Fetch all network devices from a site."""
+        return list(self.iter_devices(site_name))
+
+    def get_clients(self, site_name=None):
+        """Fetch all connected clients from a site."""
+        return list(self.iter_clients(site_name))
+
+    def get_networks(self, site_name=None):
+        """Fetch all networks (VLANs) from a site."""
+        return list(self.iter_networks(site_name))
@@ -9,6 +9,7 @@ urlpatterns = [
     # DiscoverySource
     path('sources/', views.DiscoverySourceListView.as_view(), name='discoverysource_list'),
     path('sources/add/', views.DiscoverySourceAddView.as_view(), name='discoverysource_add'),
+    path('sources/scan-all/', views.DiscoverySourceScanAllView.as_view(), name='discoverysource_scan_all'),
     path('sources/<int:pk>/', views.DiscoverySourceView.as_view(), name='discoverysource'),
     path('sources/<int:pk>/edit/', views.DiscoverySourceEditView.as_view(), name='discoverysource_edit'),
     path('sources/<int:pk>/delete/', views.DiscoverySourceDeleteView.as_view(), name='discoverysource_delete'),
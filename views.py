@@ -72,19 +72,10 @@ class DiscoverySourceJobsView(ObjectJobsView):
 class DiscoverySourceTestView(View):
     def post(self, request, pk):
         source = get_object_or_404(models.DiscoverySource, pk=pk)
-        from .unifi_client import UnifiClient
+        from .client_pool import acquire_client
         try:
-            config = source.config
-            client = UnifiClient(
-                base_url=f"https://{config.get('host', '')}:{config.get('port', 443)}",
-                api_mode=config.get('api_mode', 'token'),
-                site=config.get('site', 'default'),
-                verify_ssl=config.get('verify_ssl', False),
-                token=source.token,
-            )
-            client.connect()
-            site_count = len(client.sites)
-            client.disconnect()
+            with acquire_client(source) as client:
+                site_count = len(client.sites)
             messages.success(request, f'Connection to {source.name} successful. Found {site_count} site(s).')
         except Exception as e:
             messages.error(request, f'Connection to {source.name} failed: {e}')
@@ -101,6 +92,14 @@ class DiscoverySourceScanView(View):
         return redirect(source.get_absolute_url())
 
 
+class DiscoverySourceScanAllView(View):
+    def post(self, request):
+        from .jobs import FleetScanJob
+        FleetScanJob.enqueue(user=request.user)
+        messages.info(request, 'Fleet scan of all active sources queued.')
+        return redirect('plugins:nb_udm_plugin:dashboard')
+
+
 # --- ScanJob ---
 
 @register_model_view(models.ScanJob)
@@ -141,16 +140,12 @@ class DiscoveryResultApproveView(View):
         if result.status != 'pending':
             messages.warning(request, f'Result is already {result.get_status_display()}.')
             return redirect(result.get_absolute_url())
-        from .reconciliation import apply_result
-        try:
-            obj = apply_result(result)
-            result.status = 'approved'
-            result.reviewed_by = request.user
-            result.reviewed_at = timezone.now()
-            result.save()
-            messages.success(request, f'Approved: {obj}')
-        except Exception as e:
-            messages.error(request, f'Failed to apply: {e}')
+        from .reconciliation import apply_results
+        applied, errors = apply_results([result], user=request.user)
+        if result.pk in errors:
+            messages.error(request, f'Failed to apply: {errors[result.pk]}')
+        else:
+            messages.success(request, f'Approved: {applied[result.pk]}')
         return redirect(result.get_absolute_url())
 
 
@@ -169,19 +164,11 @@ class DiscoveryResultBulkApproveView(View):
     def post(self, request):
         pk_list = request.POST.getlist('pk')
         results = models.DiscoveryResult.objects.filter(pk__in=pk_list, status='pending')
-        from .reconciliation import apply_result
-        success = 0
-        for result in results:
-            try:
-                apply_result(result)
-                result.status = 'approved'
-                result.reviewed_by = request.user
-                result.reviewed_at = timezone.now()
-                result.save()
-                success += 1
-            except Exception as e:
-                messages.error(request, f'Failed to apply {result.identity_key}: {e}')
-        messages.success(request, f'Approved {success} result(s).')
+        from .reconciliation import apply_results
+        applied, errors = apply_results(results, user=request.user)
+        for pk, error in errors.items():
+            messages.error(request, f'Failed to apply result {pk}: {error}')
+        messages.success(request, f'Approved {len(applied)} result(s).')
         return redirect('plugins:nb_udm_plugin:discoveryresult_list')
 
 
@@ -212,7 +199,7 @@ class DiscoveryMappingView(generic.ObjectView):
 
 @register_model_view(models.DiscoveryMapping, 'list', detail=False)
 class DiscoveryMappingListView(generic.ObjectListView):
-    queryset = models.DiscoveryMapping.objects.all()
+    queryset = models.DiscoveryMapping.objects.with_targets()
     table = tables.DiscoveryMappingTable
     filterset = filtersets.DiscoveryMappingFilterSet
     filterset_form = forms.DiscoveryMappingFilterForm